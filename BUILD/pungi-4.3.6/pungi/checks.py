@@ -123,6 +123,11 @@ tools = [
     ("createrepo_c", "/usr/bin/createrepo_c", is_createrepo_c_needed),
     ("createrepo_c", "/usr/bin/modifyrepo_c", is_createrepo_c_needed),
     ("createrepo_c", "/usr/bin/mergerepo_c", is_createrepo_c_needed),
+    (
+        "deltarpm",
+        "/usr/bin/makedeltarpm",
+        lambda conf: conf.get("createrepo_deltas_cache_dir"),
+    ),
 ]
 
 
@@ -673,6 +678,10 @@ def make_schema():
                 "enum": ["sha1", "sha256", "sha512"],
             },
             "createrepo_enable_cache": {"type": "boolean", "default": True},
+            "createrepo_cache_size": {
+                "anyOf": [{"type": "string"}, {"type": "number"}],
+            },
+            "createrepo_assemble_from_pkgset": {"type": "boolean", "default": False},
             "createrepo_use_xz": {"type": "boolean", "default": False},
             "createrepo_num_threads": {"type": "number", "default": get_num_cpus()},
             "createrepo_num_workers": {"type": "number", "default": 3},
@@ -759,6 +768,7 @@ def make_schema():
             ),
             "createiso_break_hardlinks": {"type": "boolean", "default": False},
             "createiso_use_xorrisofs": {"type": "boolean", "default": False},
+            "createiso_max_writes_per_fs": {"type": "number", "minimum": 1},
             "iso_level": {
                 "anyOf": [
                     {"type": "number", "enum": [1, 2, 3, 4]},
@@ -789,6 +799,15 @@ def make_schema():
                     _variant_arch_mapping({"type": "boolean"}),
                 ]
             },
+            "createrepo_deltas_cache_dir": {"type": "string"},
+            "createrepo_deltas_cache_size": {
+                "anyOf": [{"type": "string"}, {"type": "number"}],
+            },
+            "createrepo_deltas_max_ratio": {
+                "type": "number",
+                "minimum": 0,
+                "default": 0.75,
+            },
             "buildinstall_allow_reuse": {"type": "boolean", "default": False},
             "buildinstall_method": {
                 "type": "string",
@@ -812,6 +831,11 @@ def make_schema():
             "cts_url": {"type": "string"},
             "cts_keytab": {"type": "string"},
             "koji_profile": {"type": "string"},
+            "koji_max_concurrent_calls": {
+                "type": "number",
+                "minimum": 1,
+                "default": 20,
+            },
             "koji_event": {"type": "number"},
             "pkgset_koji_tag": {"$ref": "#/definitions/strings"},
             "pkgset_koji_builds": {"$ref": "#/definitions/strings"},
@@ -895,6 +919,16 @@ def make_schema():
             },
             "media_checksum_one_file": {"type": "boolean", "default": False},
             "media_checksum_base_filename": {"type": "string", "default": ""},
+            "media_checksum_cache_dir": {"type": "string"},
+            "media_checksum_cache_size": {
+                "anyOf": [{"type": "string"}, {"type": "number"}],
+                "default": "100M",
+            },
+            "media_checksum_workers": {
+                "type": "number",
+                "minimum": 1,
+                "default": 4,
+            },
             "filter_system_release_packages": {"type": "boolean", "default": True},
             "keep_original_comps": {
                 "deprecated": "remove <groups> tag from respective variant in variants XML"  # noqa: E501
@@ -907,9 +941,20 @@ def make_schema():
                     "hardlink-or-copy",
                     "symlink",
                     "abspath-symlink",
+                    "reflink",
+                    "reflink-or-copy",
+                    "reflink-or-hardlink-or-copy",
                 ],
                 "default": "hardlink-or-copy",
             },
+            "link_workers": {"type": "number", "minimum": 1, "default": 10},
+            "link_bandwidth_limit": {"type": "number", "minimum": 1},
+            "max_parallel_tasks": {"type": "number", "minimum": 1, "default": 16},
+            "resource_sampling_interval": {
+                "type": "number",
+                "minimum": 0,
+                "default": 0,
+            },
             "product_id": {"$ref": "#/definitions/str_or_scm_dict"},
             "product_id_allow_missing": {"type": "boolean", "default": False},
             "product_id_allow_name_prefix": {"type": "boolean", "default": True},
@@ -1228,6 +1273,11 @@ def make_schema():
                 "anyOf": [{"type": "string"}, {"type": "number"}],
                 "default": 10 * 1024 * 1024,
             },
+            "split_iso_method": {
+                "type": "string",
+                "enum": ["ordered", "bin-packing"],
+                "default": "ordered",
+            },
             "osbs_allow_reuse": {"type": "boolean", "default": False},
             "osbs": {
                 "type": "object",
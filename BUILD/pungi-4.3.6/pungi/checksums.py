@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Checksums of files in the compose.
+
+Images are big and the same image is often checksummed multiple times (e.g.
+source ISO listed under every architecture, or images hardlinked from an old
+compose). :class:`ChecksumEngine` reads each file only once for all
+requested checksum types and remembers the results by identity of the file,
+optionally in a cache persisted between composes.
+"""
+
+import collections
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import six
+from kobo.shortcuts import force_list
+from kobo.threads import ThreadPool, WorkerThread, run_in_threads
+
+from pungi.media_split import convert_media_size
+
+
+# Read files in big chunks, hashing is much faster than seeking on disks.
+BUFFER_SIZE = 4 * 1024**2
+
+
+def _get_hash(checksum_type):
+    try:
+        return hashlib.new(checksum_type)
+    except ValueError:
+        raise ValueError("Checksum is not supported in hashlib: %s" % checksum_type)
+
+
+def compute_checksums(path, checksum_types, buffer_size=BUFFER_SIZE):
+    """Compute checksums of given types by reading the file once.
+
+    :param str path: path to the file
+    :param checksum_types: checksum type or list of types supported by hashlib
+    :returns: dict mapping checksum type to digest in lowercase hex
+    """
+    hashes = dict(
+        (checksum_type, _get_hash(checksum_type))
+        for checksum_type in set(force_list(checksum_types))
+    )
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buf)
+            if not size:
+                break
+            chunk = view[:size]
+            for h in hashes.values():
+                h.update(chunk)
+    return dict(
+        (checksum_type, h.hexdigest().lower())
+        for checksum_type, h in six.iteritems(hashes)
+    )
+
+
+def get_file_key(path):
+    """Identify content of the file without reading it. The key is the same
+    for all hardlinks of the file and changes when the file is modified.
+    """
+    st = os.stat(path)
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:
+        # Python 2
+        mtime_ns = int(st.st_mtime * 10**9)
+    return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+
+class ChecksumCache(object):
+    """Checksums stored on disk, one small file for each file key. Multiple
+    processes can use the same cache at the same time.
+
+    Modification time of entries is updated whenever they are used, and
+    :meth:`prune` removes least recently used ones when the directory is over
+    the configured size.
+
+    :param str topdir: path to the cache directory
+    :param int max_size: size limit of the cache in bytes, unlimited if not set
+    :param logger: logger to report pruning to
+    """
+
+    def __init__(self, topdir, max_size=None, logger=None):
+        self.topdir = topdir
+        self.max_size = max_size
+        self.logger = logger
+
+    def _path(self, key):
+        return os.path.join(self.topdir, "-".join(str(x) for x in key) + ".json")
+
+    def get(self, key):
+        """Return dict of cached checksums for the key, empty if there are
+        none.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        try:
+            os.utime(path, None)
+        except OSError:
+            # Removed by pruning in another compose.
+            pass
+        return data
+
+    def update(self, key, checksums):
+        """Add checksums for the key to the cache."""
+        data = self.get(key)
+        data.update(checksums)
+        path = self._path(key)
+        tmp_path = "%s.%s.%s.tmp" % (
+            path,
+            os.getpid(),
+            threading.current_thread().ident,
+        )
+        try:
+            os.makedirs(self.topdir)
+        except OSError:
+            if not os.path.isdir(self.topdir):
+                raise
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, sort_keys=True)
+        os.rename(tmp_path, path)
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits its size
+        limit.
+        """
+        if not self.max_size:
+            return
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.topdir, "*.json")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort(reverse=True)
+        removed = 0
+        while total > self.max_size and entries:
+            _, size, path = entries.pop()
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if self.logger and removed:
+            self.logger.info(
+                "Removed %d entries from checksum cache %s, current size %d bytes",
+                removed,
+                self.topdir,
+                total,
+            )
+
+
+class ChecksumEngine(object):
+    """Compute checksums of files, each file is read at most once.
+
+    Results are remembered by :func:`get_file_key`, so multiple paths pointing
+    to the same file are only read once even if requested at the same time
+    from multiple threads. Only the most recently used results are kept in
+    memory, older ones are still found in the persistent cache if there is
+    one.
+
+    Files are hashed in threads rather than processes. The digests are
+    computed by hashlib, which releases the GIL while hashing each 4 MiB
+    chunk, so the threads hash in parallel and mostly wait for the disks.
+    Forking a compose that already runs many threads would not be safe.
+
+    :param ChecksumCache cache: persistent cache to use, optional
+    :param int workers: how many files are hashed in parallel by
+        :meth:`checksum_files`
+    :param logger: logger to report progress to
+    :param int max_memo: how many files to remember checksums of in memory
+    """
+
+    def __init__(self, cache=None, workers=4, logger=None, max_memo=10000):
+        self.cache = cache
+        self.workers = workers
+        self.logger = logger
+        self.max_memo = max_memo
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._memo = collections.OrderedDict()
+        # File key -> [lock, number of threads using it]
+        self._key_locks = {}
+        self._prefetch_pool = None
+
+    def _lookup(self, key, checksum_types):
+        # Move the entry to the end, the least recently used one is first.
+        checksums = self._memo.pop(key, {})
+        self._memo[key] = checksums
+        if self.cache and not set(checksum_types).issubset(checksums):
+            for checksum_type, digest in self.cache.get(key).items():
+                checksums.setdefault(checksum_type, digest)
+        if set(checksum_types).issubset(checksums):
+            return dict((t, checksums[t]) for t in checksum_types)
+        return None
+
+    def _remember(self, key, checksums):
+        memo = self._memo.pop(key, {})
+        memo.update(checksums)
+        self._memo[key] = memo
+        while len(self._memo) > self.max_memo:
+            self._memo.popitem(last=False)
+        return memo
+
+    @contextlib.contextmanager
+    def _locked(self, key):
+        """Make other threads wait while the file is being read. The lock is
+        forgotten once no thread uses it.
+        """
+        with self.lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def checksum(self, path, checksum_types):
+        """Return checksums of the file.
+
+        :param str path: path to the file
+        :param checksum_types: checksum type or list of types
+        :returns: dict mapping checksum type to digest in lowercase hex
+        """
+        checksum_types = sorted(set(force_list(checksum_types)))
+        key = get_file_key(path)
+
+        # Only one thread reads any given file, others wait for the result.
+        with self._locked(key):
+            with self.lock:
+                result = self._lookup(key, checksum_types)
+                if result is not None:
+                    self.hits += 1
+                    return result
+                missing = [t for t in checksum_types if t not in self._memo[key]]
+            checksums = compute_checksums(path, missing)
+            with self.lock:
+                self.misses += 1
+                memo = self._remember(key, checksums)
+                result = dict((t, memo[t]) for t in checksum_types if t in memo)
+            if self.cache:
+                try:
+                    self.cache.update(key, checksums)
+                except (IOError, OSError) as exc:
+                    if self.logger:
+                        self.logger.warning(
+                            "Failed to cache checksums for %s: %s", path, exc
+                        )
+            return result
+
+    def checksum_files(self, paths, checksum_types):
+        """Compute checksums of multiple files in parallel.
+
+        :param paths: list of paths to files
+        :param checksum_types: checksum type or list of types
+        :returns: dict mapping each path to dict of checksums
+        """
+        result = {}
+        paths = sorted(set(paths))
+
+        def _worker(thread, path, num):
+            checksums = self.checksum(path, checksum_types)
+            with self.lock:
+                result[path] = checksums
+
+        if len(paths) == 1 or self.workers <= 1:
+            for path in paths:
+                _worker(None, path, 0)
+        elif paths:
+            run_in_threads(_worker, paths, threads=min(self.workers, len(paths)))
+        return result
+
+    def prefetch(self, path, checksum_types):
+        """Start computing checksums of the file in background. The results
+        are remembered and returned by :meth:`checksum` once needed. Failures
+        are only logged, they will be reported again by :meth:`checksum`.
+        """
+        with self.lock:
+            if not self._prefetch_pool:
+                self._prefetch_pool = ThreadPool(logger=self.logger)
+                for _ in range(max(1, self.workers)):
+                    self._prefetch_pool.add(PrefetchThread(self._prefetch_pool))
+                self._prefetch_pool.start()
+            self._prefetch_pool.queue_put((self, path, checksum_types))
+
+    def wait(self):
+        """Wait for all checksums started by :meth:`prefetch`."""
+        with self.lock:
+            pool, self._prefetch_pool = self._prefetch_pool, None
+        if pool:
+            pool.stop()
+
+    def close(self):
+        """Stop computing checksums in background without waiting for the
+        queued files, and prune the persistent cache. This should be called
+        when the compose ends, whether it succeeded or not.
+        """
+        with self.lock:
+            pool, self._prefetch_pool = self._prefetch_pool, None
+        if pool:
+            pool.kill()
+            pool.stop()
+        if self.cache:
+            self.cache.prune()
+
+
+class PrefetchThread(WorkerThread):
+    def __init__(self, pool):
+        super(PrefetchThread, self).__init__(pool)
+        # Do not keep the process running if the compose fails before the
+        # checksums are collected.
+        self.daemon = True
+
+    def process(self, item, num):
+        engine, path, checksum_types = item
+        try:
+            engine.checksum(path, checksum_types)
+        except Exception as exc:
+            self.pool.log_warning(
+                "Failed to compute checksums of %s in background: %s" % (path, exc)
+            )
+
+
+def get_checksum_engine(conf, logger=None):
+    """Create checksum engine for a compose with given configuration. The
+    persistent cache is only used if configured.
+    """
+    cache = None
+    cache_dir = conf.get("media_checksum_cache_dir")
+    if cache_dir:
+        max_size = conf.get("media_checksum_cache_size")
+        if max_size is not None:
+            max_size = convert_media_size(max_size)
+        cache = ChecksumCache(
+            os.path.join(cache_dir, str(os.getuid())), max_size, logger=logger
+        )
+    return ChecksumEngine(
+        cache, workers=conf.get("media_checksum_workers", 4), logger=logger
+    )
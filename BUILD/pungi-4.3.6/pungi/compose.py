@@ -36,6 +36,9 @@ from dogpile.cache import make_region
 from pungi.graph import SimpleAcyclicOrientedGraph
 from pungi.wrappers.variants import VariantsXmlParser
 from pungi.paths import Paths
+from pungi.checksums import get_checksum_engine
+from pungi.treescan import TreeScanner
+from pungi.wrappers.kojiwrapper import KojiSessionPool
 from pungi.wrappers.scm import get_file_from_scm
 from pungi.util import (
     makedirs,
@@ -226,6 +229,27 @@ def get_compose_dir(
     return compose_dir
 
 
+class ComposeImages(Images):
+    """Image manifest that lets phases react to images as they are added.
+
+    Listeners are called with ``(variant, arch, image)`` from the thread that
+    added the image, so they should not block.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ComposeImages, self).__init__(*args, **kwargs)
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call given function for each image added from now on."""
+        self._listeners.append(callback)
+
+    def add(self, variant, arch, image):
+        super(ComposeImages, self).add(variant, arch, image)
+        for callback in self._listeners:
+            callback(variant, arch, image)
+
+
 class Compose(kobo.log.LoggingBase):
     def __init__(
         self,
@@ -311,7 +335,7 @@ class Compose(kobo.log.LoggingBase):
             )
             self.supported = True
 
-        self.im = Images()
+        self.im = ComposeImages()
         self.im.compose.id = self.compose_id
         self.im.compose.type = self.compose_type
         self.im.compose.date = self.compose_date
@@ -320,6 +344,17 @@ class Compose(kobo.log.LoggingBase):
 
         self.containers_metadata = {}
 
+        # Snapshots of trees used by ISO phases.
+        self.tree_scanner = TreeScanner()
+
+        # Koji sessions shared by all threads.
+        self.koji_sessions = KojiSessionPool(
+            max_calls=self.conf.get("koji_max_concurrent_calls", 20)
+        )
+
+        # Checksums of images and other files in the compose.
+        self.checksum_engine = get_checksum_engine(self.conf, logger=self._logger)
+
         # Stores list of deliverables that failed, but did not abort the
         # compose.
         # {deliverable: [(Variant.uid, arch, subvariant)]}
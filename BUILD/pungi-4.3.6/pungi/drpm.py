@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Delta RPMs shared between composes.
+
+Most delta RPMs are identical between consecutive composes. Instead of
+regenerating them every time, they are kept in a store keyed by SIGMD5 of
+the old and new package and only missing ones are created.
+"""
+
+import binascii
+import collections
+import contextlib
+import glob
+import os
+import shutil
+import tempfile
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+import kobo.rpmlib
+import rpm
+from kobo.shortcuts import compute_file_checksums, run
+from kobo.threads import run_in_threads
+
+from .linker import Linker
+from .util import makedirs
+
+
+RpmInfo = collections.namedtuple(
+    "RpmInfo", ["path", "name", "epoch", "version", "release", "arch", "sigmd5"]
+)
+
+
+def read_rpm_info(path):
+    """Read identification of the package from its header."""
+    hdr = kobo.rpmlib.get_rpm_header(path)
+    fields = dict(
+        (field, kobo.rpmlib.get_header_field(hdr, field))
+        for field in ("name", "epoch", "version", "release", "arch")
+    )
+    sigmd5 = kobo.rpmlib.get_header_field(hdr, "sigmd5", decode=False)
+    fields["sigmd5"] = binascii.hexlify(sigmd5).decode("ascii")
+    fields["epoch"] = str(fields["epoch"] or 0)
+    return RpmInfo(path=path, **fields)
+
+
+def find_old_packages(rel_paths, old_package_dirs):
+    """Find a package to create delta against for each of the new packages.
+    Only the newest older build with the same name and arch is used.
+
+    :param rel_paths: list of paths to new packages
+    :param old_package_dirs: list of directories with packages from an older
+        compose
+    :returns: list of (new path, old path) tuples
+    """
+    old_packages = {}
+    for old_dir in old_package_dirs:
+        for old_path in glob.glob(os.path.join(old_dir, "*.rpm")):
+            nvra = kobo.rpmlib.parse_nvra(os.path.basename(old_path))
+            old_packages.setdefault((nvra["name"], nvra["arch"]), []).append(
+                (nvra, old_path)
+            )
+
+    result = []
+    for rel_path in rel_paths:
+        nvra = kobo.rpmlib.parse_nvra(os.path.basename(rel_path))
+        best = None
+        for old_nvra, old_path in old_packages.get((nvra["name"], nvra["arch"]), []):
+            if kobo.rpmlib.compare_nvr(old_nvra, nvra, ignore_epoch=True) >= 0:
+                continue
+            if (
+                best is None
+                or kobo.rpmlib.compare_nvr(old_nvra, best[0], ignore_epoch=True) > 0
+            ):
+                best = (old_nvra, old_path)
+        if best:
+            result.append((rel_path, best[1]))
+    return result
+
+
+class DeltaRpmStore(object):
+    """Content addressed store of delta RPMs.
+
+    Each delta is stored as ``<old sigmd5>-<new sigmd5>.drpm`` together with
+    its sequence. Modification time of the files is updated on each use, and
+    :meth:`prune` removes least recently used deltas when the store is over
+    the configured size.
+
+    Deltas that are too big compared to the new package are kept in the store
+    so that they are not created again, but they are not used.
+
+    :param str topdir: path to the store
+    :param int max_size: size limit of the store in bytes, unlimited if not set
+    :param float max_ratio: biggest allowed size of a delta as a fraction of
+        size of the new package, not limited if not set
+    :param logger: logger to report progress to
+    """
+
+    def __init__(self, topdir, max_size=None, max_ratio=None, logger=None):
+        self.topdir = topdir
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Path of delta -> [lock held while checking for it and creating it,
+        # number of threads using the lock]
+        self._path_locks = {}
+
+    def _path(self, old, new):
+        return os.path.join(
+            self.topdir, old.sigmd5[:2], "%s-%s.drpm" % (old.sigmd5, new.sigmd5)
+        )
+
+    def _generate(self, old, new, path):
+        makedirs(os.path.dirname(path))
+        # Unique names, other processes can share the store.
+        tmp_paths = []
+        for suffix in (".drpm.tmp", ".seq.tmp"):
+            fd, tmp = tempfile.mkstemp(
+                prefix=os.path.basename(path) + ".",
+                suffix=suffix,
+                dir=os.path.dirname(path),
+            )
+            os.close(fd)
+            tmp_paths.append(tmp)
+        tmp_path, tmp_seq = tmp_paths
+        try:
+            run(
+                ["makedeltarpm", "-s", tmp_seq, old.path, new.path, tmp_path],
+                show_cmd=True,
+            )
+            os.rename(tmp_seq, path + ".seq")
+            os.rename(tmp_path, path)
+        finally:
+            for leftover in (tmp_path, tmp_seq):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def _too_big(self, path, new):
+        if self.max_ratio is None:
+            return False
+        return os.path.getsize(path) > self.max_ratio * os.path.getsize(new.path)
+
+    @contextlib.contextmanager
+    def _locked(self, path):
+        """Make other threads wait while the delta is being created. The lock
+        is forgotten once no thread uses it.
+        """
+        with self.lock:
+            entry = self._path_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._path_locks[path]
+
+    def get(self, old, new):
+        """Return path to delta between two packages and its sequence. The
+        delta is created if it does not exist yet.
+
+        :returns: tuple with path and sequence, or None if the delta is too
+            big to be useful
+        """
+        path = self._path(old, new)
+        # Only one thread creates each delta, others wait and reuse it.
+        with self._locked(path):
+            if os.path.exists(path):
+                # Mark as recently used.
+                os.utime(path, None)
+                with self.lock:
+                    self.hits += 1
+            else:
+                self._generate(old, new, path)
+                with self.lock:
+                    self.misses += 1
+            if self._too_big(path, new):
+                return None
+            with open(path + ".seq") as f:
+                return path, f.read().strip()
+
+    def prune(self):
+        """Remove least recently used deltas until the store fits its size
+        limit.
+        """
+        if not self.max_size:
+            return
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.topdir, "*", "*.drpm")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        removed = 0
+        while total > self.max_size and removed < len(entries):
+            _, size, path = entries[removed]
+            for fn in (path, path + ".seq"):
+                if os.path.exists(fn):
+                    os.remove(fn)
+            total -= size
+            removed += 1
+        if self.logger and removed:
+            self.logger.info(
+                "Removed %d delta RPMs from %s, current size %d bytes",
+                removed,
+                self.topdir,
+                total,
+            )
+
+
+def link_deltas(store, repo_dir, pairs, checksum_type, workers=3, logger=None):
+    """Make sure deltas for given pairs of packages exist in ``drpms``
+    directory of the repo.
+
+    :param DeltaRpmStore store: where to take the deltas from
+    :param str repo_dir: path to the repository
+    :param pairs: list of (path to new package relative to repo, path to old
+        package) tuples
+    :param str checksum_type: checksum to use for prestodelta metadata
+    :param int workers: how many deltas to process at the same time
+    :returns: list of delta records for :func:`get_prestodelta_xml`
+    """
+    deltas_dir = os.path.join(repo_dir, "drpms")
+    if os.path.exists(deltas_dir):
+        shutil.rmtree(deltas_dir)
+    makedirs(deltas_dir)
+    linker = Linker(logger=logger)
+    result = []
+
+    def _worker(thread, item, num):
+        rel_path, old_path = item
+        try:
+            new = read_rpm_info(os.path.join(repo_dir, rel_path))
+            old = read_rpm_info(old_path)
+            delta = store.get(old, new)
+        except (RuntimeError, OSError, rpm.error) as exc:
+            # Delta can not be created. This is not fatal, the client will
+            # just download the whole package.
+            if logger:
+                logger.warning("Failed to create delta for %s: %s", rel_path, exc)
+            return
+        if not delta:
+            if logger:
+                logger.debug("Delta for %s is too big, skipping it", rel_path)
+            return
+        path, sequence = delta
+        filename = "%s-%s-%s_%s-%s.%s.drpm" % (
+            new.name,
+            old.version,
+            old.release,
+            new.version,
+            new.release,
+            new.arch,
+        )
+        dst = os.path.join(deltas_dir, filename)
+        linker.link(path, dst, link_type="hardlink-or-copy")
+        checksum = compute_file_checksums(dst, [checksum_type])[checksum_type]
+        with store.lock:
+            result.append(
+                {
+                    "new": new,
+                    "old": old,
+                    "filename": "drpms/" + filename,
+                    "sequence": sequence,
+                    "size": os.path.getsize(dst),
+                    "checksum": checksum,
+                }
+            )
+
+    if pairs:
+        run_in_threads(_worker, pairs, threads=max(1, min(workers, len(pairs))))
+    return sorted(result, key=lambda delta: delta["filename"])
+
+
+def get_prestodelta_xml(deltas, checksum_type):
+    """Render prestodelta metadata for deltas returned by :func:`link_deltas`."""
+    by_package = collections.OrderedDict()
+    for delta in deltas:
+        new = delta["new"]
+        key = (new.name, new.epoch, new.version, new.release, new.arch)
+        by_package.setdefault(key, []).append(delta)
+
+    lines = ["<?xml version='1.0' encoding='UTF-8'?>", "<prestodelta>"]
+    for (name, epoch, version, release, arch), pkg_deltas in by_package.items():
+        lines.append(
+            "  <newpackage name=%s epoch=%s version=%s release=%s arch=%s>"
+            % tuple(quoteattr(x) for x in (name, epoch, version, release, arch))
+        )
+        for delta in pkg_deltas:
+            old = delta["old"]
+            lines.extend(
+                [
+                    "    <delta oldepoch=%s oldversion=%s oldrelease=%s>"
+                    % tuple(
+                        quoteattr(x) for x in (old.epoch, old.version, old.release)
+                    ),
+                    "      <filename>%s</filename>" % escape(delta["filename"]),
+                    "      <sequence>%s</sequence>" % escape(delta["sequence"]),
+                    "      <size>%d</size>" % delta["size"],
+                    '      <checksum type="%s">%s</checksum>'
+                    % (checksum_type, delta["checksum"]),
+                    "    </delta>",
+                ]
+            )
+        lines.append("  </newpackage>")
+    lines.append("</prestodelta>")
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import heapq
+
 
 class SimpleAcyclicOrientedGraph(object):
     """
@@ -7,11 +9,62 @@ class SimpleAcyclicOrientedGraph(object):
     Example data: {'P1': ['P2'], 'P3': ['P4', 'P5'], 'P2': 'P3'}
     Graph is constructed by adding oriented edges one by one. It can not contain cycles.
     Main result is spanning line, it determines ordering of the nodes.
+
+    Successors and predecessors of each node are kept in sets. A topological
+    order of the nodes is maintained as edges are added (Pearce-Kelly), so a
+    new edge only needs to search the part of the graph between its endpoints
+    to detect a cycle.
     """
 
     def __init__(self):
+        # node -> set of nodes with an edge from the node
         self._graph = {}
-        self._all_nodes = set()
+        # node -> set of nodes with an edge into the node
+        self._predecessors = {}
+        # node -> position in a topological order
+        self._order = {}
+        self._first_order = 0
+        self._next_order = 0
+
+    def _add_node(self, node):
+        if node not in self._order:
+            self._graph[node] = set()
+            self._predecessors[node] = set()
+            self._order[node] = self._next_order
+            self._next_order += 1
+
+    def _find_path(self, start, end, bound):
+        """
+        Search nodes reachable from 'start' that are not after 'end' in the
+        current order. Returns either a path to 'end' and None, or None and
+        the visited nodes.
+        """
+        parents = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for succ in self._graph[node]:
+                if succ == end:
+                    path = [end, node]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    return list(reversed(path)), None
+                if succ not in parents and self._order[succ] < bound:
+                    parents[succ] = node
+                    stack.append(succ)
+        return None, parents
+
+    def _find_ancestors(self, node, bound):
+        """Find ancestors of 'node' that are after 'bound' in the order."""
+        visited = set([node])
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for pred in self._predecessors[current]:
+                if pred not in visited and self._order[pred] > bound:
+                    visited.add(pred)
+                    stack.append(pred)
+        return visited
 
     def add_edge(self, start, end):
         """
@@ -22,84 +75,99 @@ class SimpleAcyclicOrientedGraph(object):
             raise ValueError(
                 "Can not add this kind of edge into graph: %s-%s" % (start, end)
             )
-        self._graph.setdefault(start, [])
-        if end not in self._graph[start]:
-            self._graph[start].append(end)
-        self._all_nodes.add(start)
-        self._all_nodes.add(end)
-        # try to find opposite direction path (from end to start)
-        # to detect newly created cycle
-        path = SimpleAcyclicOrientedGraph.find_path(self._graph, end, start)
-        if path:
-            raise ValueError("There is a cycle in the graph: %s" % path)
+        self._add_node(start)
+        self._add_node(end)
+        if end in self._graph[start]:
+            return
+
+        lower, upper = self._order[end], self._order[start]
+        if lower < upper and not self._predecessors[start]:
+            # Nothing leads to 'start', so it can simply go first.
+            self._first_order -= 1
+            self._order[start] = self._first_order
+        elif lower < upper and not self._graph[end]:
+            # Nothing leads from 'end', so it can simply go last.
+            self._order[end] = self._next_order
+            self._next_order += 1
+        elif lower < upper:
+            # The edge goes against the current order. Either there is a path
+            # back from 'end' to 'start', or the affected nodes are reordered.
+            path, forward = self._find_path(end, start, upper)
+            if path:
+                raise ValueError("There is a cycle in the graph: %s" % path)
+            backward = self._find_ancestors(start, lower)
+            nodes = sorted(backward, key=self._order.get) + sorted(
+                forward, key=self._order.get
+            )
+            positions = sorted(self._order[node] for node in nodes)
+            for node, position in zip(nodes, positions):
+                self._order[node] = position
+
+        self._graph[start].add(end)
+        self._predecessors[end].add(start)
 
     def get_active_nodes(self):
         """
         nodes connected to any edge
         """
-        active_nodes = set()
-        for start, ends in self._graph.items():
-            active_nodes.add(start)
-            active_nodes.update(ends)
-        return active_nodes
+        return set(self._order)
 
     def is_final_endpoint(self, node):
         """
         edge(s) ends in this node; no other edge starts in this node
         """
-        if node not in self._all_nodes:
-            return ValueError("This node is not found in the graph: %s" % node)
-        if node not in self.get_active_nodes():
-            return False
-        return False if node in self._graph else True
-
-    def remove_final_endpoint(self, node):
-        """"""
-        remove_start_points = []
-        for start, ends in self._graph.items():
-            if node in ends:
-                ends.remove(node)
-                if not ends:
-                    remove_start_points.append(start)
-        for start in remove_start_points:
-            del self._graph[start]
+        if node not in self._order:
+            raise ValueError("This node is not found in the graph: %s" % node)
+        return bool(self._predecessors[node]) and not self._graph[node]
 
     @staticmethod
-    def find_path(graph, start, end, path=[]):
+    def find_path(graph, start, end):
         """
-        find path among nodes 'start' and 'end' recursively
+        find path among nodes 'start' and 'end' in a mapping of nodes to
+        their successors
         """
-        path = path + [start]
-        if start == end:
-            return path
-        if start not in graph:
-            return None
-        for node in graph[start]:
-            if node not in path:
-                newpath = SimpleAcyclicOrientedGraph.find_path(graph, node, end, path)
-                if newpath:
-                    return newpath
+        parents = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if node == end:
+                path = [node]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                return list(reversed(path))
+            for succ in graph.get(node, ()):
+                if succ not in parents:
+                    parents[succ] = node
+                    stack.append(succ)
         return None
 
     def prune_graph(self):
         """
         Construct spanning_line by pruning the graph.
-        Looking for endpoints and remove them one by one until graph is empty.
+        Final endpoints are removed one by one, the smallest first, until
+        the graph is empty. Nodes left without any edge follow the endpoint
+        whose removal disconnected them. The graph itself is not modified.
         """
-        spanning_line = []
-        while self._graph:
-            for node in sorted(self._all_nodes):
-                if self.is_final_endpoint(node):
-                    self.remove_final_endpoint(node)
-                    spanning_line.insert(0, node)
-                    # orphan node = no edge is connected with this node
-                    orphans = self._all_nodes - self.get_active_nodes()
-                    if orphans:
-                        # restart iteration not to set size self._all_nodes
-                        # during iteration
-                        break
-            for orphan in orphans:
-                if orphan not in spanning_line:
-                    spanning_line.insert(0, orphan)
-                self._all_nodes.remove(orphan)
-        return spanning_line
+        out_degree = dict((node, len(ends)) for node, ends in self._graph.items())
+        in_degree = dict(
+            (node, len(starts)) for node, starts in self._predecessors.items()
+        )
+        endpoints = [node for node in self._order if self.is_final_endpoint(node)]
+        heapq.heapify(endpoints)
+
+        removed = []
+        while endpoints:
+            node = heapq.heappop(endpoints)
+            removed.append(node)
+            orphans = []
+            for start in self._predecessors[node]:
+                out_degree[start] -= 1
+                in_degree[node] -= 1
+                if out_degree[start] == 0:
+                    if in_degree[start]:
+                        heapq.heappush(endpoints, start)
+                    else:
+                        orphans.append(start)
+            removed.extend(sorted(orphans))
+        removed.reverse()
+        return removed
@@ -14,23 +14,170 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import collections
 import contextlib
 import errno
+import fcntl
 import os
 import shutil
+import threading
+import time
 
 import kobo.log
 from kobo.shortcuts import relative_path
-from kobo.threads import WorkerThread, ThreadPool
+from kobo.threads import WorkerThread, ThreadPool, run_in_threads
 
+from pungi.treescan import list_tree
 from pungi.util import makedirs
 
 
+# ioctl to share extents of one file with another one, from linux/fs.h
+FICLONE = 0x40049409
+# Errors meaning the file system can not do a reflink or copy_file_range
+# between the files.
+UNSUPPORTED_ERRNOS = (
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+)
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src. The data is not copied, the
+    files share the same extents until one of them is modified.
+
+    :raises OSError: if the file system does not support reflinks
+    """
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                os.remove(dst)
+                raise
+
+
+# Size of chunks copied at once when the bandwidth is limited or the data
+# has to go through user space.
+COPY_CHUNK_SIZE = 8 * 1024**2
+
+
+class Throttle(object):
+    """Limit rate of copying data. One instance can be shared by multiple
+    threads, the limit then applies to all of them together.
+
+    :param rate: maximum number of bytes per second
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Lock()
+        self._start = None
+        self._total = 0
+
+    def consume(self, size):
+        """Account size bytes that were just copied and sleep if the copying
+        is too fast.
+        """
+        with self.lock:
+            now = time.time()
+            if self._start is None or self._start + self._total / self.rate < now:
+                # Nothing was copied for a while, do not allow a burst now.
+                self._start, self._total = now, 0
+            self._total += size
+            delay = self._start + self._total / self.rate - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _kernel_copy(fsrc, fdst, throttle=None):
+    """Copy data between open files without passing it through user space,
+    using copy_file_range or sendfile, whichever works for the files.
+
+    :returns: False if neither method can be used
+    """
+    size = os.fstat(fsrc.fileno()).st_size
+    chunk_size = COPY_CHUNK_SIZE if throttle else 1 << 30
+    methods = []
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range:
+        methods.append(
+            lambda offset, count: copy_file_range(
+                fsrc.fileno(), fdst.fileno(), count, offset
+            )
+        )
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile:
+        methods.append(
+            lambda offset, count: sendfile(fdst.fileno(), fsrc.fileno(), offset, count)
+        )
+
+    for method in methods:
+        offset = 0
+        try:
+            while offset < size:
+                copied = method(offset, min(size - offset, chunk_size))
+                if not copied:
+                    break
+                offset += copied
+                if throttle:
+                    throttle.consume(copied)
+            return True
+        except OSError as ex:
+            if ex.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            fdst.seek(0)
+            fdst.truncate()
+    return False
+
+
+def copy_file_data(src, dst, throttle=None, exclusive=False):
+    """Copy content of src to dst. The copy happens in kernel via
+    copy_file_range or sendfile if available. copy_file_range also allows the
+    file system to do server side copy or share the extents.
+
+    :param Throttle throttle: limit of the copying speed, optional
+    :param bool exclusive: fail with EEXIST if dst already exists instead of
+        rewriting it
+    """
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC)
+    with open(src, "rb") as fsrc:
+        with os.fdopen(os.open(dst, flags, 0o666), "wb") as fdst:
+            if _kernel_copy(fsrc, fdst, throttle):
+                return
+            while True:
+                buf = fsrc.read(COPY_CHUNK_SIZE)
+                if not buf:
+                    break
+                fdst.write(buf)
+                if throttle:
+                    throttle.consume(len(buf))
+
+
+def clone_or_copy(src, dst):
+    """Copy file including metadata like shutil.copy2, but reflink it if the
+    file system supports it.
+    """
+    try:
+        reflink(src, dst)
+    except (IOError, OSError) as ex:
+        if ex.errno not in UNSUPPORTED_ERRNOS:
+            raise
+        copy_file_data(src, dst)
+    shutil.copystat(src, dst)
+
+
 class LinkerPool(ThreadPool):
     def __init__(self, link_type="hardlink-or-copy", logger=None):
         ThreadPool.__init__(self, logger)
         self.link_type = link_type
         self.linker = Linker()
+        # Set when all target directories were created before starting.
+        self.dirs_created = False
+        self.progress_step = 100
 
     @classmethod
     def with_workers(cls, num_workers, *args, **kwargs):
@@ -55,21 +202,103 @@ class LinkerThread(WorkerThread):
     def process(self, item, num):
         src, dst = item
 
-        if (num % 100 == 0) or (num == self.pool.queue_total):
+        if (num % self.pool.progress_step == 0) or (num == self.pool.queue_total):
             self.pool.log_debug(
                 "Linked %s out of %s packages" % (num, self.pool.queue_total)
             )
 
-        directory = os.path.dirname(dst)
-        makedirs(directory)
+        if not self.pool.dirs_created:
+            directory = os.path.dirname(dst)
+            makedirs(directory)
         self.pool.linker.link(src, dst, link_type=self.pool.link_type)
 
 
+class LinkService(object):
+    """Link many files at once, e.g. packages for all variants and arches of
+    a compose.
+
+    Files are first planned with :meth:`add` and then linked by :meth:`run`.
+    The same source and destination planned multiple times is linked only
+    once, and all target directories are created in one pass before linking.
+    Individual files are not logged, only the progress and a summary.
+
+    :param str link_type: one of the types supported by :class:`Linker`
+    :param int workers: number of threads doing the linking
+    :param logger: logger to report progress to
+    :param bwlimit: maximum number of bytes per second copied by all workers
+    """
+
+    def __init__(
+        self, link_type="hardlink-or-copy", workers=10, logger=None, bwlimit=None
+    ):
+        self.link_type = link_type
+        self.workers = workers
+        self.logger = logger
+        self.linker = Linker(bwlimit=bwlimit)
+        self.duplicates = 0
+        self._planned = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._planned)
+
+    def add(self, src, dst):
+        """Plan linking src to dst."""
+        if (src, dst) in self._planned:
+            self.duplicates += 1
+            return
+        self._planned[(src, dst)] = None
+
+    def _create_dirs(self, pairs):
+        dirs = sorted(set(os.path.dirname(dst) for _, dst in pairs))
+        for directory in dirs:
+            makedirs(directory)
+        return len(dirs)
+
+    def run(self):
+        """Link all planned files and forget them."""
+        pairs, self._planned = list(self._planned), collections.OrderedDict()
+        duplicates, self.duplicates = self.duplicates, 0
+        if not pairs:
+            return
+        start = time.time()
+        dirs = self._create_dirs(pairs)
+
+        pool = LinkerPool(self.link_type, logger=self.logger)
+        pool.linker = self.linker
+        pool.dirs_created = True
+        # Report progress roughly every 10 %, but not more often than every
+        # 100 files.
+        pool.progress_step = max(100, len(pairs) // 10)
+        for _ in range(max(1, min(self.workers, len(pairs)))):
+            pool.add(LinkerThread(pool))
+        for pair in pairs:
+            pool.queue_put(pair)
+        pool.start()
+        pool.stop()
+
+        if self.logger:
+            self.logger.info(
+                "Linked %d files (%d duplicates skipped) into %d directories "
+                "in %.1f s",
+                len(pairs),
+                duplicates,
+                dirs,
+                time.time() - start,
+            )
+
+
 class Linker(kobo.log.LoggingBase):
-    def __init__(self, always_copy=None, test=False, logger=None):
+    """Link files and directories into the compose.
+
+    :param bwlimit: maximum number of bytes per second copied by all threads
+        using this linker, unlimited by default
+    """
+
+    def __init__(self, always_copy=None, test=False, logger=None, bwlimit=None):
         kobo.log.LoggingBase.__init__(self, logger=logger)
         self.always_copy = always_copy or []
         self.test = test
+        self.throttle = Throttle(bwlimit) if bwlimit else None
         self._inode_map = {}
 
     def _is_same_type(self, path1, path2):
@@ -159,7 +388,8 @@ class Linker(kobo.log.LoggingBase):
         if src == dst:
             return True
 
-        if os.path.islink(src):
+        is_link = os.path.islink(src)
+        if is_link:
             msg = "Copying symlink %s to %s" % (src, dst)
         else:
             msg = "Copying file %s to %s" % (src, dst)
@@ -169,25 +399,30 @@ class Linker(kobo.log.LoggingBase):
             return
         self.log_info(msg)
 
-        if os.path.exists(dst):
-            if self._is_same(src, dst):
-                if not self._is_same_type(src, dst):
-                    self.log_error(
-                        "File %s already exists but has different type than %s"
-                        % (dst, src)
-                    )
-                    raise OSError(errno.EEXIST, "File exists")
-                self.log_debug(
-                    "The same file already exists, skipping copy %s to %s" % (src, dst)
-                )
+        # The destination is only checked if it turns out to exist, which
+        # saves a stat call for each new file.
+        try:
+            self._copy(src, dst, is_link)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+            if is_link and os.path.islink(dst) and not os.path.exists(dst):
+                # Broken symlink is already there.
                 return
-            else:
-                raise OSError(errno.EEXIST, "File exists")
+            if not self._is_same(src, dst):
+                raise
+            if not self._is_same_type(src, dst):
+                self.log_error(
+                    "File %s already exists but has different type than %s" % (dst, src)
+                )
+                raise
+            self.log_debug(
+                "The same file already exists, skipping copy %s to %s" % (src, dst)
+            )
 
-        if os.path.islink(src):
-            if not os.path.islink(dst):
-                os.symlink(os.readlink(src), dst)
-                return
+    def _copy(self, src, dst, is_link):
+        if is_link:
+            os.symlink(os.readlink(src), dst)
             return
 
         src_stat = os.stat(src)
@@ -201,10 +436,31 @@ class Linker(kobo.log.LoggingBase):
             os.link(self._inode_map[src_key], dst)
             return
 
-        # BEWARE: shutil.copy2 automatically *rewrites* existing files
-        shutil.copy2(src, dst)
+        copy_file_data(src, dst, throttle=self.throttle, exclusive=True)
+        shutil.copystat(src, dst)
         self._inode_map[src_key] = dst
 
+    def reflink(self, src, dst):
+        if src == dst:
+            return
+
+        msg = "Cloning %s to %s" % (src, dst)
+        if self.test:
+            self.log_info("TEST: %s" % msg)
+            return
+        self.log_info(msg)
+
+        if os.path.lexists(dst):
+            if self._is_same(src, dst) and self._is_same_type(src, dst):
+                self.log_debug(
+                    "The same file already exists, skipping clone %s to %s" % (src, dst)
+                )
+                return
+            raise OSError(errno.EEXIST, "File exists")
+
+        reflink(src, dst)
+        shutil.copystat(src, dst)
+
     def _link_file(self, src, dst, link_type):
         if link_type == "hardlink":
             self.hardlink(src, dst)
@@ -224,11 +480,36 @@ class Linker(kobo.log.LoggingBase):
                     self.copy(src, dst)
                 else:
                     raise
+        elif link_type.startswith("reflink"):
+            if os.path.islink(src):
+                # Symlinks can not be cloned.
+                self.copy(src, dst)
+            elif link_type == "reflink":
+                self.reflink(src, dst)
+            else:
+                self._reflink_or_fallback(src, dst, link_type)
         else:
             raise ValueError("Unknown link_type: %s" % link_type)
 
-    def link(self, src, dst, link_type="hardlink-or-copy"):
-        """Link directories recursively."""
+    def _reflink_or_fallback(self, src, dst, link_type):
+        if link_type not in ("reflink-or-copy", "reflink-or-hardlink-or-copy"):
+            raise ValueError("Unknown link_type: %s" % link_type)
+        try:
+            self.reflink(src, dst)
+        except (IOError, OSError) as ex:
+            if ex.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            if link_type == "reflink-or-copy":
+                self.copy(src, dst)
+            else:
+                self._link_file(src, dst, "hardlink-or-copy")
+
+    def link(self, src, dst, link_type="hardlink-or-copy", workers=1):
+        """Link directories recursively.
+
+        :param int workers: number of threads linking subtrees of a directory
+            in parallel
+        """
         if os.path.isfile(src) or os.path.islink(src):
             self._link_file(src, dst, link_type)
             return
@@ -236,12 +517,58 @@ class Linker(kobo.log.LoggingBase):
         if os.path.isfile(dst):
             raise OSError(errno.EEXIST, "File exists")
 
+        self.link_tree(src, dst, link_type, workers=workers)
         if not self.test:
-            if not os.path.exists(dst):
-                makedirs(dst)
             shutil.copystat(src, dst)
 
-        for i in os.listdir(src):
-            src_path = os.path.join(src, i)
-            dst_path = os.path.join(dst, i)
-            self.link(src_path, dst_path, link_type)
+    def link_tree(self, src, dst, link_type="hardlink-or-copy", workers=1):
+        """Link content of src directory into dst directory, which is created
+        if needed. Metadata of dst itself is not changed.
+
+        :param int workers: number of threads linking subtrees in parallel
+        :returns: list of paths of linked files relative to the directories
+        """
+        dirs, files = list_tree(src, workers=workers)
+
+        if not self.test:
+            # Create the whole directory structure before linking any files,
+            # the parents are always listed before their subdirectories.
+            makedirs(dst)
+            for rel_dir in dirs:
+                _mkdir(os.path.join(dst, rel_dir))
+
+        files_by_dir = collections.OrderedDict()
+        for rel_path in files:
+            files_by_dir.setdefault(os.path.dirname(rel_path), []).append(rel_path)
+
+        def _worker(thread, rel_paths, num):
+            for rel_path in rel_paths:
+                self._link_file(
+                    os.path.join(src, rel_path), os.path.join(dst, rel_path), link_type
+                )
+
+        if workers > 1 and len(files_by_dir) > 1:
+            run_in_threads(
+                _worker,
+                list(files_by_dir.values()),
+                threads=min(workers, len(files_by_dir)),
+            )
+        else:
+            for rel_paths in files_by_dir.values():
+                _worker(None, rel_paths, 0)
+
+        if not self.test:
+            for rel_dir in reversed(dirs):
+                shutil.copystat(os.path.join(src, rel_dir), os.path.join(dst, rel_dir))
+        return files
+
+
+def _mkdir(path):
+    """Create a directory whose parent exists. Only check what is in the way
+    if it already exists.
+    """
+    try:
+        os.mkdir(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
@@ -14,6 +14,7 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import heapq
 import os
 
 
@@ -51,28 +52,42 @@ def convert_file_size(size, block_size=2048):
     return blocks * block_size
 
 
+SPLIT_METHODS = ("ordered", "bin-packing")
+
+
 class MediaSplitter(object):
     """
     MediaSplitter splits files so that they fit on a media of given size.
 
     Each file added to the spliter has a size in bytes that will be rounded to
     the nearest multiple of block size. If the file is sticky, it will be
-    included on each disk. The files will be on disks in the same order they
-    are added; there is no re-ordering. The number of disk is thus not the
-    possible minimum.
+    included on each disk.
+
+    With the default ``ordered`` method the files will be on disks in the same
+    order they are added; there is no re-ordering. The number of disk is thus
+    not the possible minimum.
+
+    The ``bin-packing`` method places the files using first-fit-decreasing
+    algorithm. Files can be put into a group (e.g. binary packages built from
+    the same source package), and each group is kept on one disk if it fits
+    there. Files on each disk keep the order in which they were added.
     """
 
-    def __init__(self, media_size, compose=None, logger=None):
+    def __init__(self, media_size, compose=None, logger=None, method="ordered"):
+        if method not in SPLIT_METHODS:
+            raise ValueError("Unknown split method: %s" % method)
         self.media_size = media_size
+        self.method = method
         self.files = []  # to preserve order
         self.file_sizes = {}
+        self.file_groups = {}
         self.sticky_files = set()
         self.compose = compose
         self.logger = logger
         if not self.logger and self.compose:
             self.logger = self.compose._logger
 
-    def add_file(self, name, size, sticky=False):
+    def add_file(self, name, size, sticky=False, group=None):
         name = os.path.normpath(name)
         size = int(size)
         old_size = self.file_sizes.get(name, None)
@@ -86,6 +101,8 @@ class MediaSplitter(object):
 
         self.files.append(name)
         self.file_sizes[name] = size
+        if group is not None:
+            self.file_groups[name] = group
         if sticky:
             self.sticky_files.add(name)
 
@@ -109,12 +126,17 @@ class MediaSplitter(object):
             else:
                 all_files.append(name)
 
+        if self.method == "bin-packing" and self.media_size:
+            disks = self._split_bin_packing(all_files, sticky_files, sticky_files_size)
+        else:
+            disks = self._split_ordered(all_files, sticky_files, sticky_files_size)
+        self._report(disks)
+        return disks
+
+    def _split_ordered(self, all_files, sticky_files, sticky_files_size):
         disks = []
         disk = {}
-        # as it would be on single medium (sticky_files just once)
-        total_size_single = sticky_files_size
-        while all_files:
-            name = all_files.pop(0)
+        for name in all_files:
             size = convert_file_size(self.file_sizes[name])
 
             if not disks or (self.media_size and disk["size"] + size > self.media_size):
@@ -123,5 +145,64 @@ class MediaSplitter(object):
 
             disk["files"].append(name)
             disk["size"] += size
-            total_size_single += size
         return disks
+
+    def _split_bin_packing(self, all_files, sticky_files, sticky_files_size):
+        order = {}
+        groups = {}
+        for name in all_files:
+            if name in order:
+                continue
+            order[name] = len(order)
+            key = self.file_groups.get(name, (None, name))
+            groups.setdefault(key, []).append(name)
+
+        # Groups that can not fit on a single disk are split to single files.
+        capacity = self.media_size - sticky_files_size
+        items = []
+        for files in groups.values():
+            sizes = [convert_file_size(self.file_sizes[name]) for name in files]
+            if sum(sizes) <= capacity:
+                items.append((sum(sizes), files))
+            else:
+                items.extend((size, [name]) for size, name in zip(sizes, files))
+
+        # Biggest first, ties are broken by the original order to keep the
+        # result reproducible.
+        items.sort(key=lambda item: (-item[0], order[item[1][0]]))
+
+        # Each item goes to the disk with the most free space (worst fit), so
+        # only the top of a heap needs to be checked instead of every disk.
+        # As items come in decreasing size, this needs the same number of
+        # disks as first fit in most cases and spreads the files more evenly.
+        disks = []
+        heap = []
+        for size, files in items:
+            if heap and heap[0][0] + size <= 0:
+                free, num = heapq.heappop(heap)
+                disk = disks[num]
+            else:
+                free, num = -capacity, len(disks)
+                disk = {"size": sticky_files_size, "files": []}
+                disks.append(disk)
+            disk["files"].extend(files)
+            disk["size"] += size
+            heapq.heappush(heap, (free + size, num))
+
+        for disk in disks:
+            disk["files"] = sticky_files + sorted(disk["files"], key=order.get)
+        return disks
+
+    def _report(self, disks):
+        if not self.logger or not self.media_size:
+            return
+        for num, disk in enumerate(disks, 1):
+            self.logger.debug(
+                "Disk %d: %d files, %d bytes, %.1f%% full"
+                % (
+                    num,
+                    len(disk["files"]),
+                    disk["size"],
+                    100.0 * disk["size"] / self.media_size,
+                )
+            )
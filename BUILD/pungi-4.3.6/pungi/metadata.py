@@ -21,8 +21,9 @@ import time
 import productmd.composeinfo
 import productmd.treeinfo
 from productmd.common import get_major_version
-from kobo.shortcuts import relative_path, compute_file_checksums
+from kobo.shortcuts import relative_path
 
+from pungi.checksums import ChecksumEngine
 from pungi.compose_metadata.discinfo import write_discinfo as create_discinfo
 from pungi.compose_metadata.discinfo import write_media_repo as create_media_repo
 
@@ -508,7 +509,14 @@ def write_tree_info(compose, arch, variant, timestamp=None, bi=None):
 
 
 def populate_extra_files_metadata(
-    metadata, variant, arch, topdir, files, checksum_types, relative_root=None
+    metadata,
+    variant,
+    arch,
+    topdir,
+    files,
+    checksum_types,
+    relative_root=None,
+    engine=None,
 ):
     """
     :param metadata: an instance of productmd.extra_files.ExtraFiles to
@@ -520,16 +528,18 @@ def populate_extra_files_metadata(
     :param checksum_types: list of checksums to compute
     :param relative_root: ancestor directory of topdir, this will be removed
                           from paths written to local metadata file
+    :param ChecksumEngine engine: engine to compute the checksums with
     """
-    for copied_file in files:
-        full_path = os.path.join(topdir, copied_file)
+    engine = engine or ChecksumEngine()
+    full_paths = [os.path.join(topdir, copied_file) for copied_file in files]
+    try:
+        all_checksums = engine.checksum_files(full_paths, checksum_types)
+    except (IOError, OSError) as exc:
+        raise RuntimeError("Failed to calculate checksums: %s" % exc)
+
+    for copied_file, full_path in zip(files, full_paths):
         size = os.path.getsize(full_path)
-        try:
-            checksums = compute_file_checksums(full_path, checksum_types)
-        except IOError as exc:
-            raise RuntimeError(
-                "Failed to calculate checksum for %s: %s" % (full_path, exc)
-            )
+        checksums = all_checksums[full_path]
 
         if relative_root:
             copied_file = os.path.relpath(full_path, relative_root)
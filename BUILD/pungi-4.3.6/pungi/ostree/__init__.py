@@ -17,12 +17,19 @@
 import argparse
 import logging
 
+from pungi.profiler import Profiler, get_output_prefix, write_results
+
 from .tree import Tree
 from .installer import Installer
 
 
 def main(args=None):
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profiler-output",
+        metavar="PREFIX",
+        help="write profiling results to PREFIX.json and PREFIX.folded",
+    )
     subparser = parser.add_subparsers(help="Sub commands")
 
     treep = subparser.add_parser("tree", help="Compose OSTree repository")
@@ -158,7 +165,16 @@ def main(args=None):
 
     logging.basicConfig(format="%(message)s", level=logging.DEBUG)
 
+    profiler_output = get_output_prefix(args.profiler_output, "pungi-make-ostree")
+    if profiler_output:
+        Profiler.enable()
+
     _class = args._class()
     _class.set_args(args)
     func = getattr(_class, args.func)
-    func()
+    try:
+        with Profiler("%s.%s()" % (args._class.__name__, args.func)):
+            func()
+    finally:
+        if profiler_output:
+            write_results(profiler_output)
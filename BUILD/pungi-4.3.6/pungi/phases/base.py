@@ -17,7 +17,7 @@ import logging
 import math
 import time
 
-from pungi import util
+from pungi import resources, tracing, util
 
 
 class PhaseBase(object):
@@ -54,16 +54,31 @@ class PhaseBase(object):
             return True
         return False
 
-    def start(self):
+    def start(self, split=False):
+        """Start the phase.
+
+        :param bool split: only prepare the phase, the work for each part
+            returned by :meth:`get_parts` is then done by separate calls to
+            :meth:`run_part` (e.g. from tasks of
+            :class:`pungi.scheduler.TaskScheduler`)
+        """
         self._skipped = self.skip()
         if self._skipped:
             self.compose.log_warning("[SKIP ] %s" % self.msg)
             self.finished = True
             return
         self._start_time = time.time()
+        self._trace_start = tracing.begin()
+        self._trace_context = tracing.get_context()
+        # Threads started by the phase inherit this.
+        tracing.set_context(phase=self.name)
+        resources.phase_started(self.name)
         self.compose.log_info("[BEGIN] %s" % self.msg)
         self.compose.notifier.send("phase-start", phase_name=self.name)
-        self.run()
+        if split:
+            self.prepare()
+        else:
+            self.run()
 
     def get_config_block(self, variant, arch=None):
         """In config for current phase, find a block corresponding to given
@@ -110,7 +125,12 @@ class PhaseBase(object):
         if hasattr(self, "pool"):
             self.pool.stop()
         self.finished = True
+        # The phase could have written into trees scanned before.
+        self.compose.tree_scanner.invalidate()
         self.compose.log_info("[DONE ] %s" % self.msg)
+        tracing.end(getattr(self, "_trace_start", None), self.name, "phase")
+        tracing.set_context(**getattr(self, "_trace_context", {}))
+        resources.phase_stopped(self.name)
 
         if hasattr(self, "_start_time"):
             self.compose.log_info(
@@ -126,6 +146,20 @@ class PhaseBase(object):
     def run(self):
         raise NotImplementedError
 
+    def get_parts(self):
+        """Return list of (variant, arch) tuples the work of the phase can be
+        split into. Only phases that can be split implement this.
+        """
+        raise NotImplementedError
+
+    def prepare(self):
+        """Do the work shared by all parts of the phase."""
+        pass
+
+    def run_part(self, variant, arch):
+        """Do the work for one variant and arch and wait for it to finish."""
+        raise NotImplementedError
+
 
 class ConfigGuardedPhase(PhaseBase):
     """A phase that is skipped unless config option is set."""
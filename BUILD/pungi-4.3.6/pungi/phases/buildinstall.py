@@ -764,7 +764,9 @@ class BuildinstallThread(WorkerThread):
         # Copy old buildinstall output to this this compose.
         final_output_dir = compose.paths.work.buildinstall_dir(arch, variant=variant)
         old_final_output_dir = compose.paths.old_compose_path(final_output_dir)
-        copy_all(old_final_output_dir, final_output_dir)
+        copy_all(
+            old_final_output_dir, final_output_dir, workers=compose.conf["link_workers"]
+        )
 
         # Copy old buildinstall logs to this compose.
         log_fname = "buildinstall-%s-logs/dummy" % variant.uid
@@ -772,7 +774,7 @@ class BuildinstallThread(WorkerThread):
         old_final_log_dir = compose.paths.old_compose_path(final_log_dir)
         if not os.path.exists(final_log_dir):
             makedirs(final_log_dir)
-        copy_all(old_final_log_dir, final_log_dir)
+        copy_all(old_final_log_dir, final_log_dir, workers=compose.conf["link_workers"])
 
         # Write the buildinstall metadata so next compose can reuse this compose.
         self._write_buildinstall_metadata(
@@ -865,7 +867,9 @@ class BuildinstallThread(WorkerThread):
             if not os.path.exists(final_output_dir):
                 makedirs(final_output_dir)
             results_dir = os.path.join(output_dir, "results")
-            copy_all(results_dir, final_output_dir)
+            copy_all(
+                results_dir, final_output_dir, workers=compose.conf["link_workers"]
+            )
 
             # Get the log_dir into which we should copy the resulting log files.
             log_fname = "buildinstall-%s-logs/dummy" % variant.uid
@@ -873,7 +877,7 @@ class BuildinstallThread(WorkerThread):
             if not os.path.exists(final_log_dir):
                 makedirs(final_log_dir)
             log_dir = os.path.join(output_dir, "logs")
-            copy_all(log_dir, final_log_dir)
+            copy_all(log_dir, final_log_dir, workers=compose.conf["link_workers"])
         elif lorax_use_koji_plugin:
             # If Koji pungi-buildinstall is used, then the buildinstall results are
             # not stored directly in `output_dir` dir, but in "results" and "logs"
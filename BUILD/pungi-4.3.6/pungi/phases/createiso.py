@@ -14,18 +14,27 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import contextlib
+import hashlib
+import heapq
+import itertools
 import os
 import random
 import shutil
 import stat
+import sys
 import json
+import threading
 
+import productmd.rpms
 import productmd.treeinfo
 from productmd.images import Image
 from kobo.threads import ThreadPool, WorkerThread
 from kobo.shortcuts import run, relative_path
-from six.moves import shlex_quote
+import six
+from six.moves import StringIO, shlex_quote
 
+from pungi.linker import clone_or_copy
 from pungi.wrappers import iso
 from pungi.wrappers.createrepo import CreaterepoWrapper
 from pungi.wrappers import kojiwrapper
@@ -53,6 +62,15 @@ class CreateisoPhase(PhaseLoggerMixin, PhaseBase):
         super(CreateisoPhase, self).__init__(compose)
         self.pool = ThreadPool(logger=self.logger)
         self.bi = buildinstall_phase
+        self.scheduler = None
+        self.iso_names = []
+        self._lock = threading.Lock()
+        # ISO path -> (options, old image path, old reuse key)
+        self._reuse_candidates = {}
+        # ISO path -> reuse key of the new image
+        self._reuse_keys = {}
+        self._rpm_manifest = None
+        self._package_nevras = None
 
     def _find_rpms(self, path):
         """Check if there are some RPMs in the path."""
@@ -118,8 +136,8 @@ class CreateisoPhase(PhaseLoggerMixin, PhaseBase):
         old_file_name = os.path.basename(iso_path)
         current_file_name = os.path.basename(cmd["iso_path"])
         try:
-            # Hardlink ISO and manifest
-            for suffix in ("", ".manifest"):
+            # Hardlink ISO, manifest and the reuse key
+            for suffix in ("", ".manifest", REUSE_KEY_SUFFIX):
                 linker.link(iso_path + suffix, cmd["iso_path"] + suffix)
             # Copy log files
             # The log file name includes filename of the image, so we need to
@@ -156,16 +174,28 @@ class CreateisoPhase(PhaseLoggerMixin, PhaseBase):
         )
 
     def try_reuse(self, cmd, variant, arch, opts):
-        """Try to reuse image from previous compose.
+        """Find out if image from previous compose could be reused.
 
-        :returns bool: True if reuse was successful, False otherwise
+        Only the old metadata and the reuse key stored next to the old image
+        are checked here. The key of the new image is computed later in the
+        worker by :meth:`reuse_image`, and the old image is reused if the keys
+        are the same. Configuration of the compose does not matter otherwise.
+
+        :returns bool: True if the old image can possibly be reused
         """
         if not self.compose.conf["createiso_allow_reuse"]:
-            return
+            return False
 
-        log_msg = "Cannot reuse ISO for %s.%s" % (variant, arch)
-        current_metadata = self.save_reuse_metadata(cmd, variant, arch, opts)
+        self.save_reuse_metadata(cmd, variant, arch, opts)
+        if not self.compose.old_composes:
+            # Without old composes the reuse key would never be used.
+            return False
 
+        # The key of the new image is written next to it once it is created,
+        # so that next compose can reuse it.
+        self._reuse_candidates[cmd["iso_path"]] = (opts, None, None)
+
+        log_msg = "Cannot reuse ISO for %s.%s" % (variant, arch)
         if opts.buildinstall_method and not self.bi.reused(variant, arch):
             # If buildinstall phase was not reused for some reason, we can not
             # reuse any bootable image. If a package change caused rebuild of
@@ -175,62 +205,74 @@ class CreateisoPhase(PhaseLoggerMixin, PhaseBase):
             self.logger.info("%s - boot configuration changed", log_msg)
             return False
 
-        # Check old compose configuration: extra_files and product_ids can be
-        # reflected on ISO.
-        old_config = self.compose.load_old_compose_config()
-        if not old_config:
-            self.logger.info("%s - no config for old compose", log_msg)
-            return False
-        # Convert current configuration to JSON and back to encode it similarly
-        # to the old one
-        config = json.loads(json.dumps(self.compose.conf))
-        for opt in self.compose.conf:
-            # Skip a selection of options: these affect what packages can be
-            # included, which we explicitly check later on.
-            config_whitelist = set(
-                [
-                    "gather_lookaside_repos",
-                    "pkgset_koji_builds",
-                    "pkgset_koji_scratch_tasks",
-                    "pkgset_koji_module_builds",
-                ]
-            )
-            # Skip irrelevant options
-            config_whitelist.update(["osbs", "osbuild"])
-            if opt in config_whitelist:
-                continue
-
-            if old_config.get(opt) != config.get(opt):
-                self.logger.info("%s - option %s differs", log_msg, opt)
-                return False
-
         old_metadata = self._load_old_metadata(cmd, variant, arch)
         if not old_metadata:
             self.logger.info("%s - no old metadata found", log_msg)
             return False
 
-        # Test if volume ID matches - volid can be generated dynamically based on
-        # other values, and could change even if nothing else is different.
-        if current_metadata["opts"]["volid"] != old_metadata["opts"]["volid"]:
-            self.logger.info("%s - volume ID differs", log_msg)
+        old_iso_path = old_metadata["cmd"]["iso_path"]
+        old_key = read_reuse_key(old_iso_path)
+        if not old_key:
+            self.logger.info("%s - no reuse key found for old image", log_msg)
             return False
 
-        # Compare packages on the ISO.
-        if compare_packages(
-            old_metadata["opts"]["graft_points"],
-            current_metadata["opts"]["graft_points"],
-        ):
-            self.logger.info("%s - packages differ", log_msg)
+        self._reuse_candidates[cmd["iso_path"]] = (opts, old_iso_path, old_key)
+        return True
+
+    def _get_rpm_manifest(self):
+        """Load the RPM manifest of the compose. It is only loaded once for
+        the phase.
+        """
+        with self._lock:
+            if self._rpm_manifest is None:
+                self._rpm_manifest = load_rpm_manifest(self.compose)
+            return self._rpm_manifest
+
+    def _get_package_nevras(self):
+        """Map path of each package in the compose to its NEVRA."""
+        manifest = self._get_rpm_manifest()
+        with self._lock:
+            if self._package_nevras is None:
+                self._package_nevras = get_package_nevras(self.compose, manifest)
+            return self._package_nevras
+
+    def _get_reuse_key(self, cmd, variant, arch):
+        if cmd["iso_path"] not in self._reuse_keys:
+            opts = self._reuse_candidates[cmd["iso_path"]][0]
+            try:
+                reuse_key = get_reuse_key(opts, self._get_package_nevras())
+            except (IOError, OSError) as exc:
+                self.logger.info(
+                    "Failed to compute reuse key for %s.%s: %s", variant, arch, exc
+                )
+                reuse_key = None
+            self._reuse_keys[cmd["iso_path"]] = reuse_key
+        return self._reuse_keys[cmd["iso_path"]]
+
+    def reuse_image(self, cmd, variant, arch):
+        """Reuse image from previous compose if it was created from the same
+        inputs. This is called by the worker before the image is created.
+
+        :returns bool: True if reuse was successful, False otherwise
+        """
+        if cmd["iso_path"] not in self._reuse_candidates:
+            return False
+        opts, old_iso_path, old_key = self._reuse_candidates[cmd["iso_path"]]
+        if not old_key:
+            return False
+
+        log_msg = "Cannot reuse ISO for %s.%s" % (variant, arch)
+        reuse_key = self._get_reuse_key(cmd, variant, arch)
+        if not reuse_key:
+            self.logger.info("%s - failed to compute reuse key", log_msg)
+            return False
+
+        if old_key != reuse_key:
+            self.logger.info("%s - image inputs differ", log_msg)
             return False
 
         try:
-            self.perform_reuse(
-                cmd,
-                variant,
-                arch,
-                opts,
-                old_metadata["cmd"]["iso_path"],
-            )
+            self.perform_reuse(cmd, variant, arch, opts, old_iso_path)
             return True
         except Exception as exc:
             self.compose.log_error(
@@ -239,142 +281,199 @@ class CreateisoPhase(PhaseLoggerMixin, PhaseBase):
             self.compose.traceback("createiso-reuse-%s-%s" % (variant, arch))
             return False
 
-    def run(self):
-        symlink_isos_to = self.compose.conf.get("symlink_isos_to")
-        disc_type = self.compose.conf["disc_types"].get("dvd", "dvd")
-        deliverables = []
+    def save_reuse_key(self, cmd, variant, arch):
+        """Write the reuse key next to a newly created image."""
+        if cmd["iso_path"] in self._reuse_candidates:
+            reuse_key = self._get_reuse_key(cmd, variant, arch)
+            if reuse_key:
+                write_reuse_key(cmd["iso_path"], reuse_key)
 
-        commands = []
+    def get_parts(self):
+        parts = []
         for variant in self.compose.get_variants(
             types=["variant", "layered-product", "optional"]
         ):
             if variant.is_empty:
                 continue
-            for arch in variant.arches + ["src"]:
-                skip_iso = get_arch_variant_data(
-                    self.compose.conf, "createiso_skip", arch, variant
-                )
-                if skip_iso == [True]:
-                    self.logger.info(
-                        "Skipping createiso for %s.%s due to config option"
-                        % (variant, arch)
-                    )
-                    continue
+            parts.extend((variant, arch) for arch in variant.arches + ["src"])
+        return parts
+
+    def _prepare_images(self, variant, arch, deliverables):
+        """Prepare commands creating images of the variant and arch. Paths of
+        the images are added to deliverables.
+
+        :returns: list of (image file name, estimated size, job) tuples
+        """
+        symlink_isos_to = self.compose.conf.get("symlink_isos_to")
+        disc_type = self.compose.conf["disc_types"].get("dvd", "dvd")
+        commands = []
+        skip_iso = get_arch_variant_data(
+            self.compose.conf, "createiso_skip", arch, variant
+        )
+        if skip_iso == [True]:
+            self.logger.info(
+                "Skipping createiso for %s.%s due to config option" % (variant, arch)
+            )
+            return commands
+
+        volid = get_volid(self.compose, arch, variant, disc_type=disc_type)
+        os_tree = self.compose.paths.compose.os_tree(arch, variant)
+
+        iso_dir = self.compose.paths.compose.iso_dir(
+            arch, variant, symlink_to=symlink_isos_to
+        )
+        if not iso_dir:
+            return commands
+
+        if not self._find_rpms(os_tree):
+            self.logger.warning(
+                "No RPMs found for %s.%s, skipping ISO" % (variant.uid, arch)
+            )
+            return commands
 
-                volid = get_volid(self.compose, arch, variant, disc_type=disc_type)
-                os_tree = self.compose.paths.compose.os_tree(arch, variant)
+        bootable = self._is_bootable(variant, arch)
 
-                iso_dir = self.compose.paths.compose.iso_dir(
-                    arch, variant, symlink_to=symlink_isos_to
+        if bootable and not self.bi.succeeded(variant, arch):
+            self.logger.warning(
+                "ISO should be bootable, but buildinstall failed. "
+                "Skipping for %s.%s" % (variant, arch)
+            )
+            return commands
+
+        rpm_manifest = None
+        if self.compose.conf["split_iso_method"] == "bin-packing":
+            rpm_manifest = self._get_rpm_manifest()
+        split_iso_data = split_iso(
+            self.compose,
+            arch,
+            variant,
+            no_split=bootable,
+            logger=self.logger,
+            rpm_manifest=rpm_manifest,
+        )
+        disc_count = len(split_iso_data)
+
+        for disc_num, iso_data in enumerate(split_iso_data):
+            disc_num += 1
+
+            filename = self.compose.get_image_name(
+                arch, variant, disc_type=disc_type, disc_num=disc_num
+            )
+            iso_path = self.compose.paths.compose.iso_path(
+                arch, variant, filename, symlink_to=symlink_isos_to
+            )
+            if os.path.isfile(iso_path):
+                self.logger.warning(
+                    "Skipping mkisofs, image already exists: %s", iso_path
                 )
-                if not iso_dir:
-                    continue
+                continue
+            deliverables.append(iso_path)
 
-                if not self._find_rpms(os_tree):
-                    self.logger.warning(
-                        "No RPMs found for %s.%s, skipping ISO" % (variant.uid, arch)
-                    )
-                    continue
+            graft_points = prepare_iso(
+                self.compose,
+                arch,
+                variant,
+                disc_num=disc_num,
+                disc_count=disc_count,
+                split_iso_data=iso_data,
+            )
 
-                bootable = self._is_bootable(variant, arch)
+            cmd = {
+                "iso_path": iso_path,
+                "bootable": bootable,
+                "cmd": [],
+                "label": "",  # currently not used
+                "disc_num": disc_num,
+                "disc_count": disc_count,
+            }
+
+            if os.path.islink(iso_dir):
+                cmd["mount"] = os.path.abspath(
+                    os.path.join(os.path.dirname(iso_dir), os.readlink(iso_dir))
+                )
 
-                if bootable and not self.bi.succeeded(variant, arch):
-                    self.logger.warning(
-                        "ISO should be bootable, but buildinstall failed. "
-                        "Skipping for %s.%s" % (variant, arch)
-                    )
-                    continue
+            opts = createiso.CreateIsoOpts(
+                output_dir=iso_dir,
+                iso_name=filename,
+                volid=volid,
+                graft_points=graft_points,
+                arch=arch,
+                supported=self.compose.supported,
+                hfs_compat=self.compose.conf["iso_hfs_ppc64le_compatible"],
+                use_xorrisofs=self.compose.conf.get("createiso_use_xorrisofs"),
+                iso_level=get_iso_level_config(self.compose, variant, arch),
+            )
 
-                split_iso_data = split_iso(
-                    self.compose, arch, variant, no_split=bootable, logger=self.logger
+            if bootable:
+                opts = opts._replace(
+                    buildinstall_method=self.compose.conf["buildinstall_method"],
+                    boot_iso=os.path.join(os_tree, "images", "boot.iso"),
                 )
-                disc_count = len(split_iso_data)
 
-                for disc_num, iso_data in enumerate(split_iso_data):
-                    disc_num += 1
+            if self.compose.conf["create_jigdo"]:
+                jigdo_dir = self.compose.paths.compose.jigdo_dir(arch, variant)
+                opts = opts._replace(jigdo_dir=jigdo_dir, os_tree=os_tree)
 
-                    filename = self.compose.get_image_name(
-                        arch, variant, disc_type=disc_type, disc_num=disc_num
-                    )
-                    iso_path = self.compose.paths.compose.iso_path(
-                        arch, variant, filename, symlink_to=symlink_isos_to
-                    )
-                    if os.path.isfile(iso_path):
-                        self.logger.warning(
-                            "Skipping mkisofs, image already exists: %s", iso_path
-                        )
-                        continue
-                    deliverables.append(iso_path)
-
-                    graft_points = prepare_iso(
-                        self.compose,
-                        arch,
-                        variant,
-                        disc_num=disc_num,
-                        disc_count=disc_count,
-                        split_iso_data=iso_data,
-                    )
+            # The old image is reused by the worker if possible.
+            self.try_reuse(cmd, variant, arch, opts)
 
-                    cmd = {
-                        "iso_path": iso_path,
-                        "bootable": bootable,
-                        "cmd": [],
-                        "label": "",  # currently not used
-                        "disc_num": disc_num,
-                        "disc_count": disc_count,
-                    }
-
-                    if os.path.islink(iso_dir):
-                        cmd["mount"] = os.path.abspath(
-                            os.path.join(os.path.dirname(iso_dir), os.readlink(iso_dir))
-                        )
-
-                    opts = createiso.CreateIsoOpts(
-                        output_dir=iso_dir,
-                        iso_name=filename,
-                        volid=volid,
-                        graft_points=graft_points,
-                        arch=arch,
-                        supported=self.compose.supported,
-                        hfs_compat=self.compose.conf["iso_hfs_ppc64le_compatible"],
-                        use_xorrisofs=self.compose.conf.get("createiso_use_xorrisofs"),
-                        iso_level=get_iso_level_config(self.compose, variant, arch),
-                    )
+            script_dir = self.compose.paths.work.tmp_dir(arch, variant)
+            opts = opts._replace(script_dir=script_dir)
+            script_file = os.path.join(script_dir, "createiso-%s.sh" % filename)
+            with open(script_file, "w") as f:
+                createiso.write_script(opts, f)
+            cmd["cmd"] = ["bash", script_file]
+            commands.append((filename, iso_data["size"], (cmd, variant, arch)))
 
-                    if bootable:
-                        opts = opts._replace(
-                            buildinstall_method=self.compose.conf[
-                                "buildinstall_method"
-                            ],
-                            boot_iso=os.path.join(os_tree, "images", "boot.iso"),
-                        )
-
-                    if self.compose.conf["create_jigdo"]:
-                        jigdo_dir = self.compose.paths.compose.jigdo_dir(arch, variant)
-                        opts = opts._replace(jigdo_dir=jigdo_dir, os_tree=os_tree)
-
-                    # Try to reuse
-                    if self.try_reuse(cmd, variant, arch, opts):
-                        # Reuse was successful, go to next ISO
-                        continue
-
-                    script_dir = self.compose.paths.work.tmp_dir(arch, variant)
-                    opts = opts._replace(script_dir=script_dir)
-                    script_file = os.path.join(script_dir, "createiso-%s.sh" % filename)
-                    with open(script_file, "w") as f:
-                        createiso.write_script(opts, f)
-                    cmd["cmd"] = ["bash", script_file]
-                    commands.append((cmd, variant, arch))
+        return commands
+
+    def run(self):
+        deliverables = []
+        commands = []
+        for variant, arch in self.get_parts():
+            commands.extend(self._prepare_images(variant, arch, deliverables))
 
         if self.compose.notifier:
             self.compose.notifier.send("createiso-targets", deliverables=deliverables)
 
-        for (cmd, variant, arch) in commands:
-            self.pool.add(CreateIsoThread(self.pool))
+        self.scheduler = get_iso_write_scheduler(self.compose)
+        self.iso_names = [name for name, _, _ in commands]
+        for (cmd, variant, arch) in self.scheduler.plan(commands, self.logger):
+            self.pool.add(CreateIsoThread(self.pool, self.scheduler, phase=self))
             self.pool.queue_put((self.compose, cmd, variant, arch))
 
         self.pool.start()
 
+    def prepare(self):
+        self.scheduler = get_iso_write_scheduler(self.compose)
+        # Workers are added to the pool as the parts queue their images.
+        self.pool.start()
+
+    def run_part(self, variant, arch):
+        deliverables = []
+        commands = self._prepare_images(variant, arch, deliverables)
+        if self.compose.notifier and deliverables:
+            self.compose.notifier.send("createiso-targets", deliverables=deliverables)
+
+        jobs = self.scheduler.plan(commands, self.logger)
+        part = _PartJobs(len(jobs))
+        with self._lock:
+            self.iso_names.extend(name for name, _, _ in commands)
+            for (cmd, variant, arch) in jobs:
+                # Images of all parts are created in parallel by the shared
+                # pool, limited only by the write scheduler.
+                thread = CreateIsoThread(self.pool, self.scheduler, phase=self)
+                self.pool.add(thread)
+                thread.running = True
+                thread.start()
+                self.pool.queue_put((self.compose, cmd, variant, arch, part))
+        part.wait()
+
+    def stop(self):
+        super(CreateisoPhase, self).stop()
+        if self.scheduler:
+            self.scheduler.report(self.iso_names, self.logger)
+
 
 def read_packages(graft_points):
     """Read packages that were listed in given graft points file.
@@ -406,7 +505,334 @@ def compare_packages(old_graft_points, new_graft_points):
     return old_files != new_files
 
 
+REUSE_KEY_SUFFIX = ".reuse-key"
+
+# Options that are only paths on the compose host and do not affect content of
+# the image.
+_REUSE_KEY_SKIPPED_OPTS = set(
+    [
+        "boot_iso",
+        "graft_points",
+        "iso_name",
+        "jigdo_dir",
+        "os_tree",
+        "output_dir",
+        "script_dir",
+    ]
+)
+
+
+def _is_compose_metadata(iso_path):
+    """Check if the file is written anew by every compose. Such files depend
+    entirely on the packages and configuration (and possibly current time).
+    """
+    return iso_path in (".discinfo", ".treeinfo", "media.repo") or (
+        iso_path.startswith("repodata/") or "/repodata/" in iso_path
+    )
+
+
+def _get_file_key(path, nevras=None):
+    """Identify a file without reading it: packages by their size and NEVRA,
+    other files by size and modification time.
+    """
+    st = os.stat(path)
+    if stat.S_ISDIR(st.st_mode):
+        return None
+    if nevras and path in nevras:
+        return [st.st_size, nevras[path]]
+    return [st.st_size, st.st_mtime]
+
+
+def load_rpm_manifest(compose):
+    """Load the RPM manifest of the compose.
+
+    :returns: productmd.rpms.Rpms, empty if there is no manifest
+    """
+    manifest = productmd.rpms.Rpms()
+    manifest_file = compose.paths.compose.metadata("rpms.json")
+    if os.path.exists(manifest_file):
+        manifest.load(manifest_file)
+    return manifest
+
+
+def get_package_nevras(compose, manifest=None):
+    """Map path of each package in the compose to its NEVRA, as recorded in
+    the RPM manifest.
+
+    :param manifest: loaded RPM manifest, it is loaded from the compose if
+        not given
+    :returns: dict, empty if there is no manifest
+    """
+    if manifest is None:
+        manifest = load_rpm_manifest(compose)
+    compose_dir = compose.paths.compose.topdir()
+    result = {}
+    for arches in manifest.rpms.values():
+        for srpms in arches.values():
+            for rpms in srpms.values():
+                for nevra, rpm_data in rpms.items():
+                    result[os.path.join(compose_dir, rpm_data["path"])] = nevra
+    return result
+
+
+def get_reuse_key(opts, nevras=None):
+    """Compute a key identifying content of the image created with given
+    options. It covers every file in the graft points (path on the image,
+    size and NEVRA for packages or modification time for other files), the
+    boot image, volume ID and all options passed to mkisofs or xorriso. No
+    file is read. Metadata written by each compose (repodata, .discinfo,
+    .treeinfo and media.repo) is skipped, as it only reflects the packages
+    and configuration. Two images with the same key are interchangeable.
+
+    :param CreateIsoOpts opts: options of the image
+    :param dict nevras: mapping of package paths to NEVRAs, see
+        :func:`get_package_nevras`
+    :returns str: hex digest
+    """
+    files = []
+    if opts.graft_points:
+        with open(opts.graft_points) as f:
+            for line in f:
+                iso_path, fs_path = line.rstrip("\n").split("=", 1)
+                if not _is_compose_metadata(iso_path):
+                    files.append([iso_path, _get_file_key(fs_path, nevras)])
+    files.sort()
+
+    boot_images = []
+    if opts.boot_iso:
+        boot_images.append(_get_file_key(opts.boot_iso))
+
+    options = dict(
+        (key, value)
+        for key, value in opts._asdict().items()
+        if key not in _REUSE_KEY_SKIPPED_OPTS
+    )
+    options["jigdo"] = bool(opts.jigdo_dir)
+
+    # Render the commands with fixed paths so that only the options matter.
+    commands = StringIO()
+    if not (opts.use_xorrisofs and opts.buildinstall_method):
+        placeholder_opts = opts._replace(
+            iso_name="image.iso", graft_points="graft-points"
+        )
+        createiso.make_image(commands, placeholder_opts)
+        createiso.run_isohybrid(commands, placeholder_opts)
+
+    data = {
+        "files": files,
+        "boot_images": boot_images,
+        "volid": opts.volid,
+        "options": options,
+        "commands": commands.getvalue(),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def write_reuse_key(iso_path, reuse_key):
+    """Store the reuse key next to the image."""
+    with open(iso_path + REUSE_KEY_SUFFIX, "w") as f:
+        f.write(reuse_key + "\n")
+
+
+def read_reuse_key(iso_path):
+    """Load reuse key stored next to the image.
+
+    :returns: the key or None if the file does not exist
+    """
+    try:
+        with open(iso_path + REUSE_KEY_SUFFIX) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _get_filesystem_id(path):
+    """Return ID of file system where the path is or would be created."""
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+class _WriteSlots(object):
+    """Limit number of concurrent writes into one file system. When a slot is
+    freed, it is given to the biggest waiting image, regardless of the order
+    in which the writes were requested.
+    """
+
+    def __init__(self, max_writes):
+        self.max_writes = max_writes
+        self.active = 0
+        self.waiting = []
+        self.condition = threading.Condition()
+        self._counter = itertools.count()
+
+    def acquire(self, size):
+        with self.condition:
+            entry = (-size, next(self._counter))
+            heapq.heappush(self.waiting, entry)
+            while self.active >= self.max_writes or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.active += 1
+            # The next waiting image may be able to start as well.
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+
+class IsoWriteScheduler(object):
+    """Decide in which order ISO images are created and how many of them can
+    be written at the same time.
+
+    The biggest images take longest to create, so they are started first to
+    not prolong the phase by starting late. Writing many images to the same
+    file system at once only makes the disks seek, so the number of concurrent
+    writes to each file system can be limited. One scheduler is shared by all
+    phases creating images in the compose, see :func:`get_iso_write_scheduler`.
+
+    :param int max_writes: how many images can be written into one file
+        system at the same time; no limit if not set
+    :param logger: logger to report the order to
+    """
+
+    def __init__(self, max_writes=None, logger=None):
+        self.max_writes = max_writes
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.planned = []
+        self.started = []
+        self._sizes = {}
+        self._slots = {}
+
+    def plan(self, jobs, logger=None):
+        """Sort the jobs so that the biggest images are created first.
+
+        :param jobs: list of (image file name, estimated size, job) tuples
+        :param logger: logger to report the planned order to, defaults to the
+            logger of the scheduler
+        :returns: list of jobs in the order they should be queued
+        """
+        logger = logger or self.logger
+        ordered = sorted(jobs, key=lambda job: -job[1])
+        with self.lock:
+            for name, size, _ in ordered:
+                self.planned.append(name)
+                self._sizes[name] = size
+        if logger and ordered:
+            logger.info(
+                "Planned order of ISO images (%s):\n%s",
+                "at most %d writes per file system" % self.max_writes
+                if self.max_writes
+                else "no limit on concurrent writes",
+                "\n".join(
+                    "  %d. %s (%d bytes)" % (idx, name, size)
+                    for idx, (name, size, _) in enumerate(ordered, 1)
+                ),
+            )
+        return [job for _, _, job in ordered]
+
+    def _get_slots(self, iso_path):
+        fs_id = _get_filesystem_id(os.path.dirname(iso_path))
+        with self.lock:
+            if fs_id not in self._slots:
+                self._slots[fs_id] = _WriteSlots(self.max_writes)
+            return self._slots[fs_id]
+
+    @contextlib.contextmanager
+    def writing(self, iso_path):
+        """Context manager that waits until the image can be written."""
+        name = os.path.basename(iso_path)
+        slots = self._get_slots(iso_path) if self.max_writes else None
+        if slots:
+            slots.acquire(self._sizes.get(name, 0))
+        try:
+            with self.lock:
+                self.started.append(name)
+                position = len(self.started)
+            if self.logger:
+                self.logger.info(
+                    "[ORDER] Writing ISO %d/%d: %s", position, len(self.planned), name
+                )
+            yield
+        finally:
+            if slots:
+                slots.release()
+
+    def report(self, names=None, logger=None):
+        """Log the order in which the images were actually started.
+
+        :param names: only report these images, all by default
+        :param logger: logger to use instead of the logger of the scheduler
+        """
+        logger = logger or self.logger
+        started = [name for name in self.started if names is None or name in names]
+        if logger and started:
+            logger.info(
+                "Actual order of ISO images:\n%s",
+                "\n".join(
+                    "  %d. %s" % (idx, name) for idx, name in enumerate(started, 1)
+                ),
+            )
+
+
+_scheduler_lock = threading.Lock()
+
+
+def get_iso_write_scheduler(compose):
+    """Return the scheduler shared by all phases of the compose, so that the
+    limit on concurrent writes holds even when the phases run in parallel.
+    """
+    with _scheduler_lock:
+        scheduler = getattr(compose, "iso_write_scheduler", None)
+        if scheduler is None:
+            scheduler = IsoWriteScheduler(
+                compose.conf.get("createiso_max_writes_per_fs"),
+                logger=compose._logger,
+            )
+            compose.iso_write_scheduler = scheduler
+        return scheduler
+
+
+class _PartJobs(object):
+    """Track images queued by one part of the phase, so that the part can
+    wait only for its own images.
+    """
+
+    def __init__(self, count):
+        self.remaining = count
+        self.exc_info = None
+        self.condition = threading.Condition()
+
+    def done(self, exc_info=None):
+        with self.condition:
+            self.remaining -= 1
+            if exc_info and not self.exc_info:
+                self.exc_info = exc_info
+            self.condition.notify_all()
+
+    def wait(self):
+        """Wait for all images of the part and raise the first error."""
+        with self.condition:
+            while self.remaining:
+                self.condition.wait()
+        if self.exc_info:
+            six.reraise(*self.exc_info)
+
+
 class CreateIsoThread(WorkerThread):
+    def __init__(self, pool, scheduler=None, phase=None):
+        super(CreateIsoThread, self).__init__(pool)
+        self.scheduler = scheduler or IsoWriteScheduler()
+        self.phase = phase
+
     def fail(self, compose, cmd, variant, arch):
         self.pool.log_error("CreateISO failed, removing ISO: %s" % cmd["iso_path"])
         try:
@@ -424,12 +850,23 @@ class CreateIsoThread(WorkerThread):
             )
 
     def process(self, item, num):
-        compose, cmd, variant, arch = item
-        can_fail = compose.can_fail(variant, arch, "iso")
-        with failable(
-            compose, can_fail, variant, arch, "iso", logger=self.pool._logger
-        ):
-            self.worker(compose, cmd, variant, arch, num)
+        compose, cmd, variant, arch = item[:4]
+        # Images queued by a part of the phase report back to it instead of
+        # stopping the whole pool on failure.
+        part = item[4] if len(item) > 4 else None
+        try:
+            can_fail = compose.can_fail(variant, arch, "iso")
+            with failable(
+                compose, can_fail, variant, arch, "iso", logger=self.pool._logger
+            ):
+                self.worker(compose, cmd, variant, arch, num)
+        except Exception:
+            if not part:
+                raise
+            part.done(sys.exc_info())
+        else:
+            if part:
+                part.done()
 
     def worker(self, compose, cmd, variant, arch, num):
         mounts = [compose.topdir]
@@ -448,14 +885,22 @@ class CreateIsoThread(WorkerThread):
         )
         self.pool.log_info("[BEGIN] %s" % msg)
 
+        if self.phase and self.phase.reuse_image(cmd, variant, arch):
+            self.pool.log_info("[DONE ] %s (reused)" % msg)
+            return
+
         try:
-            run_createiso_command(
-                num, compose, bootable, arch, cmd["cmd"], mounts, log_file
-            )
+            with self.scheduler.writing(cmd["iso_path"]):
+                run_createiso_command(
+                    num, compose, bootable, arch, cmd["cmd"], mounts, log_file
+                )
         except Exception:
             self.fail(compose, cmd, variant, arch)
             raise
 
+        if self.phase:
+            self.phase.save_reuse_key(cmd, variant, arch)
+
         add_iso_to_metadata(
             compose,
             variant,
@@ -572,7 +1017,7 @@ def run_createiso_command(num, compose, bootable, arch, cmd, mounts, log_file):
     )
 
 
-def split_iso(compose, arch, variant, no_split=False, logger=None):
+def split_iso(compose, arch, variant, no_split=False, logger=None, rpm_manifest=None):
     """
     Split contents of the os/ directory for given tree into chunks fitting on ISO.
 
@@ -582,6 +1027,10 @@ def split_iso(compose, arch, variant, no_split=False, logger=None):
     If `no_split` is set, we will pretend that the media is practically
     infinite so that everything goes on single disc. A warning is printed if
     the size is bigger than configured.
+
+    The RPM manifest is needed to keep packages from the same source package
+    together with the bin-packing method. If `rpm_manifest` is not given, it
+    is loaded from the compose.
     """
     if not logger:
         logger = compose._logger
@@ -590,18 +1039,21 @@ def split_iso(compose, arch, variant, no_split=False, logger=None):
     split_size = convert_media_size(media_size) - convert_media_size(media_reserve)
     real_size = None if no_split else split_size
 
-    ms = MediaSplitter(real_size, compose, logger=logger)
+    method = compose.conf["split_iso_method"]
+    ms = MediaSplitter(real_size, compose, logger=logger, method=method)
+    source_rpms = (
+        _get_source_rpms(compose, arch, variant, rpm_manifest)
+        if method == "bin-packing"
+        else {}
+    )
 
     os_tree = compose.paths.compose.os_tree(arch, variant)
     extra_files_dir = compose.paths.work.extra_files_dir(arch, variant)
 
     # scan extra files to mark them "sticky" -> they'll be on all media after split
     extra_files = set(["media.repo"])
-    for root, dirs, files in os.walk(extra_files_dir):
-        for fn in files:
-            path = os.path.join(root, fn)
-            rel_path = relative_path(path, extra_files_dir.rstrip("/") + "/")
-            extra_files.add(rel_path)
+    for entry in compose.tree_scanner.scan(extra_files_dir).files:
+        extra_files.add(entry.rel_path)
 
     packages = []
     all_files = []
@@ -615,28 +1067,25 @@ def split_iso(compose, arch, variant, no_split=False, logger=None):
     if all_files_ignore:
         logger.debug("split_iso all_files_ignore = %s" % ", ".join(all_files_ignore))
 
-    for root, dirs, files in os.walk(os_tree):
-        for dn in dirs[:]:
-            repo_dir = os.path.join(root, dn)
-            if repo_dir == os.path.join(
-                compose.paths.compose.repository(arch, variant), "repodata"
-            ):
-                dirs.remove(dn)
-
-        for fn in files:
-            path = os.path.join(root, fn)
-            rel_path = relative_path(path, os_tree.rstrip("/") + "/")
-            sticky = rel_path in extra_files
-            if rel_path in all_files_ignore:
-                logger.info("split_iso: Skipping %s" % rel_path)
-                continue
-            if root.startswith(compose.paths.compose.packages(arch, variant)):
-                packages.append((path, os.path.getsize(path), sticky))
-            else:
-                all_files.append((path, os.path.getsize(path), sticky))
+    repodata_dir = os.path.join(
+        compose.paths.compose.repository(arch, variant), "repodata"
+    )
+    packages_dir = compose.paths.compose.packages(arch, variant)
+    for entry in compose.tree_scanner.scan(os_tree).files:
+        root = os.path.dirname(entry.path)
+        if root == repodata_dir or root.startswith(repodata_dir + "/"):
+            continue
+        sticky = entry.rel_path in extra_files
+        if entry.rel_path in all_files_ignore:
+            logger.info("split_iso: Skipping %s" % entry.rel_path)
+            continue
+        if root.startswith(packages_dir):
+            packages.append((entry.path, entry.size, sticky))
+        else:
+            all_files.append((entry.path, entry.size, sticky))
 
     for path, size, sticky in all_files + packages:
-        ms.add_file(path, size, sticky)
+        ms.add_file(path, size, sticky, group=source_rpms.get(path))
 
     logger.debug("Splitting media for %s.%s:" % (variant.uid, arch))
     result = ms.split()
@@ -649,6 +1098,20 @@ def split_iso(compose, arch, variant, no_split=False, logger=None):
     return result
 
 
+def _get_source_rpms(compose, arch, variant, manifest=None):
+    """Map path of each package in the variant to the source package it was
+    built from, as recorded in the RPM manifest.
+    """
+    if manifest is None:
+        manifest = load_rpm_manifest(compose)
+    compose_dir = compose.paths.compose.topdir()
+    result = {}
+    for srpm_nevra, rpms in manifest.rpms.get(variant.uid, {}).get(arch, {}).items():
+        for rpm_data in rpms.values():
+            result[os.path.join(compose_dir, rpm_data["path"])] = srpm_nevra
+    return result
+
+
 def prepare_iso(
     compose, arch, variant, disc_num=1, disc_count=None, split_iso_data=None
 ):
@@ -713,13 +1176,19 @@ def prepare_iso(
     data["disc_numbers"] = [disc_num]
     new_di_path = os.path.join(iso_dir, ".discinfo")
     write_discinfo(new_di_path, **data)
+    compose.tree_scanner.invalidate(iso_dir)
 
     if not disc_count or disc_count == 1:
-        data = iso.get_graft_points(compose.paths.compose.topdir(), [tree_dir, iso_dir])
+        data = iso.get_graft_points(
+            compose.paths.compose.topdir(),
+            [tree_dir, iso_dir],
+            scanner=compose.tree_scanner,
+        )
     else:
         data = iso.get_graft_points(
             compose.paths.compose.topdir(),
             [iso._paths_from_list(tree_dir, split_iso_data["files"]), iso_dir],
+            scanner=compose.tree_scanner,
         )
 
     if compose.conf["createiso_break_hardlinks"]:
@@ -729,16 +1198,6 @@ def prepare_iso(
         break_hardlinks(
             data, compose.paths.work.iso_staging_dir(arch, variant, filename)
         )
-        # Create hardlinks for files with duplicate contents.
-        compose.log_debug(
-            "Creating hardlinks for ISO %s for %s.%s" % (filename, variant, arch)
-        )
-        create_hardlinks(
-            compose.paths.work.iso_staging_dir(arch, variant, filename),
-            log_file=compose.paths.log.log_file(
-                arch, "iso-hardlink-%s.log" % variant.uid
-            ),
-        )
 
     # TODO: /content /graft-points
     gp = "%s-graft-points" % iso_dir
@@ -784,24 +1243,28 @@ def copy_boot_images(src, dest):
 def break_hardlinks(graft_points, staging_dir):
     """Iterate over graft points and copy any file that has more than 1
     hardlink into the staging directory. Replace the entry in the dict.
+
+    The files are cloned if the file system supports reflinks. Graft points
+    pointing to the same file share a single copy in the staging directory.
     """
+    staged = {}
     for f in graft_points:
         info = os.stat(graft_points[f])
         if stat.S_ISREG(info.st_mode) and info.st_nlink > 1:
             dest_path = os.path.join(staging_dir, graft_points[f].lstrip("/"))
-            makedirs(os.path.dirname(dest_path))
-            shutil.copy2(graft_points[f], dest_path)
+            key = (info.st_dev, info.st_ino)
+            if staged.get(key) != dest_path:
+                makedirs(os.path.dirname(dest_path))
+                if os.path.lexists(dest_path):
+                    os.remove(dest_path)
+                if key in staged:
+                    os.link(staged[key], dest_path)
+                else:
+                    clone_or_copy(graft_points[f], dest_path)
+                    staged[key] = dest_path
             graft_points[f] = dest_path
 
 
-def create_hardlinks(staging_dir, log_file):
-    """Create hardlinks within the staging directory.
-    Should happen after break_hardlinks()
-    """
-    cmd = ["/usr/sbin/hardlink", "-c", "-vv", staging_dir]
-    run(cmd, logfile=log_file, show_cmd=True)
-
-
 class OldFileLinker(object):
     """
     A wrapper around os.link that remembers which files were linked and can
@@ -22,14 +22,16 @@ import glob
 import os
 import shutil
 import threading
-import xml.dom.minidom
 
 import productmd.modules
 import productmd.rpms
 from kobo.shortcuts import relative_path, run
 from kobo.threads import ThreadPool, WorkerThread
 
+from ..drpm import DeltaRpmStore, find_old_packages, get_prestodelta_xml, link_deltas
+from ..media_split import convert_media_size
 from ..module_util import Modulemd, collect_module_defaults, collect_module_obsoletes
+from ..repodata import RepodataAssembler, RepodataFinaliser
 from ..util import (
     get_arch_variant_data,
     read_single_module_stream_from_file,
@@ -47,11 +49,16 @@ createrepo_dirs = set()
 class CreaterepoPhase(PhaseBase):
     name = "createrepo"
 
-    def __init__(self, compose, pkgset_phase=None):
+    def __init__(self, compose, pkgset_phase=None, gather_phase=None):
         PhaseBase.__init__(self, compose)
         self.pool = ThreadPool(logger=self.compose._logger)
         self.modules_metadata = ModulesMetadata(compose)
         self.pkgset_phase = pkgset_phase
+        self.gather_phase = gather_phase
+        self.delta_store = get_delta_store(compose)
+        self.checksum_cache = None
+        self.reference_pkgset = None
+        self.manifest_index = None
 
     def validate(self):
         errors = []
@@ -62,15 +69,39 @@ class CreaterepoPhase(PhaseBase):
         if errors:
             raise ValueError("\n".join(errors))
 
-    def run(self):
+    def get_parts(self):
+        parts = []
+        for variant in self.compose.get_variants():
+            if variant.is_empty:
+                continue
+            parts.append((variant, "src"))
+            parts.extend((variant, arch) for arch in variant.arches)
+        return parts
+
+    def _get_repos(self, variant, arch):
+        """List (arch, variant, pkg_type) of repos created for the part."""
+        if arch == "src":
+            return [(None, variant, "srpm")]
+        return [(arch, variant, "rpm"), (arch, variant, "debuginfo")]
+
+    def prepare(self):
         get_productids_from_scm(self.compose)
-        reference_pkgset = None
+        self.reference_pkgset = None
         if self.pkgset_phase and self.pkgset_phase.package_sets:
-            reference_pkgset = self.pkgset_phase.package_sets[-1]
-        for i in range(self.compose.conf["createrepo_num_threads"]):
-            self.pool.add(
-                CreaterepoThread(self.pool, reference_pkgset, self.modules_metadata)
-            )
+            self.reference_pkgset = self.pkgset_phase.package_sets[-1]
+        manifest = None
+        if self.gather_phase and not self.gather_phase.skip():
+            # Gather ran in this process, there is no need to parse the JSON
+            # it just wrote.
+            manifest = self.gather_phase.manifest
+        self.manifest_index = RpmManifestIndex(self.compose, manifest=manifest)
+        self.checksum_cache = get_checksum_cache(self.compose)
+        if self.checksum_cache:
+            self.checksum_cache.snapshot()
+        # Parts run from different threads share the limit of the phase.
+        self._semaphore = threading.Semaphore(
+            self.compose.conf["createrepo_num_threads"]
+        )
 
         for variant in self.compose.get_variants():
             if variant.is_empty:
@@ -84,20 +115,292 @@ class CreaterepoPhase(PhaseBase):
                     compose=self.compose,
                 )
 
-            self.pool.queue_put((self.compose, None, variant, "srpm"))
-            for arch in variant.arches:
-                self.pool.queue_put((self.compose, arch, variant, "rpm"))
-                self.pool.queue_put((self.compose, arch, variant, "debuginfo"))
+    def run(self):
+        self.prepare()
+        for i in range(self.compose.conf["createrepo_num_threads"]):
+            self.pool.add(
+                CreaterepoThread(
+                    self.pool,
+                    self.reference_pkgset,
+                    self.modules_metadata,
+                    self.manifest_index,
+                    self.delta_store,
+                    self.checksum_cache,
+                )
+            )
+
+        for variant, arch in self.get_parts():
+            for repo in self._get_repos(variant, arch):
+                self.pool.queue_put((self.compose,) + repo)
 
         self.pool.start()
 
+    def run_part(self, variant, arch):
+        for repo_arch, _, pkg_type in self._get_repos(variant, arch):
+            with self._semaphore:
+                create_variant_repo(
+                    self.compose,
+                    repo_arch,
+                    variant,
+                    pkg_type=pkg_type,
+                    pkgset=self.reference_pkgset,
+                    modules_metadata=self.modules_metadata,
+                    manifest_index=self.manifest_index,
+                    delta_store=self.delta_store,
+                    checksum_cache=self.checksum_cache,
+                )
+        # The repositories were written into trees that could be scanned
+        # before.
+        self.compose.tree_scanner.invalidate()
+
     def stop(self):
         super(CreaterepoPhase, self).stop()
         self.modules_metadata.write_modules_metadata()
+        if self.delta_store:
+            self.compose.log_info(
+                "Delta RPM store %s: %d reused, %d created",
+                self.delta_store.topdir,
+                self.delta_store.hits,
+                self.delta_store.misses,
+            )
+            self.delta_store.prune()
+        if self.checksum_cache:
+            hits, misses = self.checksum_cache.get_stats()
+            self.compose.log_info(
+                "[CACHE] createrepo: %d cached checksums used, %d checksums computed"
+                % (hits, misses)
+            )
+            self.checksum_cache.prune()
+
+
+def get_delta_store(compose):
+    """Return store of delta RPMs shared between composes or None if it's not
+    configured.
+    """
+    topdir = compose.conf.get("createrepo_deltas_cache_dir")
+    if not topdir:
+        return None
+    max_size = compose.conf.get("createrepo_deltas_cache_size")
+    if max_size is not None:
+        max_size = convert_media_size(max_size)
+    return DeltaRpmStore(
+        topdir,
+        max_size=max_size,
+        max_ratio=compose.conf["createrepo_deltas_max_ratio"],
+        logger=compose._logger,
+    )
+
+
+class ChecksumCache(object):
+    """Directory with package checksums cached by ``createrepo_c``.
+
+    Each entry is named ``<package file name>-<key>-<checksum type>``, where
+    the key is derived from the package header, size and modification time.
+    The entries therefore do not depend on the compose, and a single
+    directory is shared by all releases.
+
+    Modification time of entries is updated whenever they are used, and
+    :meth:`prune` removes least recently used ones when the directory is over
+    the configured size.
+
+    :param str topdir: path to the cache directory
+    :param int max_size: size limit of the cache in bytes, unlimited if not set
+    :param logger: logger to report pruning to
+    """
+
+    def __init__(self, topdir, max_size=None, logger=None):
+        self.topdir = topdir
+        self.max_size = max_size
+        self.logger = logger
+        self.lock = threading.Lock()
+        self._cached_before = None
+        self._used = set()
+
+    def get_cached_packages(self):
+        """Return a dict mapping package file name to names of its entries
+        currently in the cache.
+        """
+        cached = {}
+        for entry in os.listdir(self.topdir):
+            filename = entry.rsplit("-", 2)[0]
+            cached.setdefault(filename, []).append(entry)
+        return cached
+
+    def snapshot(self):
+        """Remember which packages are in the cache before createrepo runs.
+        The directory is listed only once, as it can be large and is shared
+        by all createrepo tasks.
+        """
+        with self.lock:
+            if self._cached_before is None:
+                self._cached_before = self.get_cached_packages()
+
+    def mark_used(self, rel_paths):
+        """Record packages processed by createrepo. Their entries that were
+        in the cache before are marked as recently used.
+
+        :returns: tuple with number of the packages whose checksum was
+            already cached and number of the packages whose checksum had to
+            be computed
+        """
+        self.snapshot()
+        filenames = set(os.path.basename(p) for p in rel_paths)
+        with self.lock:
+            new = filenames - self._used
+            self._used.update(new)
+        misses = len([f for f in new if f not in self._cached_before])
+        for filename in new:
+            for entry in self._cached_before.get(filename, []):
+                try:
+                    os.utime(os.path.join(self.topdir, entry), None)
+                except OSError:
+                    # Removed by pruning in another compose.
+                    pass
+        return len(filenames) - misses, misses
+
+    def get_stats(self):
+        """Count how many of the used packages had their checksum in the
+        cache before and how many were added to it.
+
+        :returns: tuple with number of hits and misses
+        """
+        with self.lock:
+            used = set(self._used)
+            cached_before = self._cached_before or {}
+        hits = len([filename for filename in used if filename in cached_before])
+        cached_after = self.get_cached_packages()
+        misses = len(
+            [
+                filename
+                for filename in used
+                if filename not in cached_before and filename in cached_after
+            ]
+        )
+        return hits, misses
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits its size
+        limit.
+        """
+        if not self.max_size:
+            return
+        entries = []
+        total = 0
+        for entry in os.listdir(self.topdir):
+            path = os.path.join(self.topdir, entry)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort(reverse=True)
+        removed = 0
+        while total > self.max_size and entries:
+            _, size, path = entries.pop()
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if self.logger and removed:
+            self.logger.info(
+                "Removed %d entries from createrepo cache %s, current size %d bytes",
+                removed,
+                self.topdir,
+                total,
+            )
+
+
+def get_checksum_cache(compose):
+    """Return checksum cache for createrepo_c or None if the cache is disabled
+    or can not be used.
+    """
+    if not compose.conf["createrepo_enable_cache"]:
+        return None
+    cachedir = os.path.join(CACHE_TOPDIR, str(os.getuid()))
+    if not os.path.exists(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except Exception as e:
+            compose.log_warning(
+                "Cache disabled because cannot create cache dir %s %s"
+                % (cachedir, str(e))
+            )
+            return None
+    max_size = compose.conf.get("createrepo_cache_size")
+    if max_size is not None:
+        max_size = convert_media_size(max_size)
+    return ChecksumCache(cachedir, max_size=max_size, logger=compose._logger)
+
+
+class RpmManifestIndex(object):
+    """Index of the RPM manifest shared by all createrepo tasks.
+
+    The manifest is loaded at most once (either from the in-memory manifest
+    of the gather phase or from ``rpms.json``) and grouped by variant, arch
+    and category, so that each task gets its list of packages directly.
+
+    :param compose: Compose instance
+    :param manifest: optional ``productmd.rpms.Rpms`` instance; the metadata
+        file is loaded lazily on first access if not given
+    """
+
+    def __init__(self, compose, manifest=None):
+        self.compose = compose
+        self._manifest = manifest
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        manifest = self._manifest
+        if manifest is None:
+            manifest_file = self.compose.paths.compose.metadata("rpms.json")
+            self.compose.log_debug("Loading RPM manifest: %s", manifest_file)
+            manifest = productmd.rpms.Rpms()
+            manifest.load(manifest_file)
+
+        index = {}
+        for variant_uid, arches in manifest.rpms.items():
+            for rpms_arch, data in arches.items():
+                for srpm_data in data.values():
+                    for rpm_data in srpm_data.values():
+                        key = (variant_uid, rpms_arch, rpm_data["category"])
+                        index.setdefault(key, []).append(rpm_data["path"])
+        # Drop the reference, the index is all that is needed from now on.
+        self._manifest = None
+        return index
+
+    def get_paths(self, variant, arch, category):
+        """Return paths (relative to the ``compose`` directory) of packages in
+        given variant, arch and category. If arch is ``None``, packages from
+        all arches are returned.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = self._load()
+
+        if arch is not None:
+            return list(self._index.get((variant.uid, arch, category), []))
+
+        paths = []
+        for (variant_uid, _, rpm_category), rpm_paths in self._index.items():
+            if variant_uid == variant.uid and rpm_category == category:
+                paths.extend(rpm_paths)
+        return paths
 
 
 def create_variant_repo(
-    compose, arch, variant, pkg_type, pkgset, modules_metadata=None
+    compose,
+    arch,
+    variant,
+    pkg_type,
+    pkgset,
+    modules_metadata=None,
+    manifest_index=None,
+    delta_store=None,
+    checksum_cache=None,
 ):
     types = {
         "rpm": (
@@ -155,25 +458,15 @@ def create_variant_repo(
     # We only want delta RPMs for binary repos.
     with_deltas = pkg_type == "rpm" and _has_deltas(compose, variant, arch)
 
-    rpms = set()
-    rpm_nevras = set()
-
     # read rpms from metadata rather than guessing it by scanning filesystem
-    manifest_file = compose.paths.compose.metadata("rpms.json")
-    manifest = productmd.rpms.Rpms()
-    manifest.load(manifest_file)
-
-    for rpms_arch, data in manifest.rpms.get(variant.uid, {}).items():
-        if arch is not None and arch != rpms_arch:
-            continue
-        for srpm_data in data.values():
-            for rpm_nevra, rpm_data in srpm_data.items():
-                if types[pkg_type][0] != rpm_data["category"]:
-                    continue
-                path = os.path.join(compose.topdir, "compose", rpm_data["path"])
-                rel_path = relative_path(path, repo_dir.rstrip("/") + "/")
-                rpms.add(rel_path)
-                rpm_nevras.add(str(rpm_nevra))
+    if manifest_index is None:
+        manifest_index = RpmManifestIndex(compose)
+
+    rpms = set()
+    repo_dir_prefix = repo_dir.rstrip("/") + "/"
+    for rpm_path in manifest_index.get_paths(variant, arch, types[pkg_type][0]):
+        path = os.path.join(compose.topdir, "compose", rpm_path)
+        rpms.add(relative_path(path, repo_dir_prefix))
 
     file_list = compose.paths.work.repo_package_list(arch, variant, pkg_type)
     with open(file_list, "w") as f:
@@ -182,7 +475,12 @@ def create_variant_repo(
 
     # Only find last compose when we actually want delta RPMs.
     old_package_dirs = _get_old_package_dirs(compose, repo_dir) if with_deltas else None
-    if old_package_dirs:
+    # Deltas from the store are added to the repo after createrepo finishes,
+    # createrepo itself does not need to know about them.
+    use_delta_store = bool(old_package_dirs and delta_store)
+    if use_delta_store:
+        with_deltas = False
+    elif old_package_dirs:
         # If we are creating deltas, we can not reuse existing metadata, as
         # that would stop deltas from being created.
         # This seems to only affect createrepo_c though.
@@ -192,66 +490,95 @@ def create_variant_repo(
     if compose.has_comps and pkg_type == "rpm":
         comps_path = compose.paths.work.comps(arch=arch, variant=variant)
 
-    if compose.conf["createrepo_enable_cache"]:
-        cachedir = os.path.join(
-            CACHE_TOPDIR,
-            "%s-%s" % (compose.conf["release_short"], os.getuid()),
+    if checksum_cache is None:
+        checksum_cache = get_checksum_cache(compose)
+    cachedir = checksum_cache.topdir if checksum_cache else None
+    processed_rpms = sorted(rpms)
+    log_file = compose.paths.log.log_file(
+        arch, "createrepo-%s.%s" % (variant, pkg_type)
+    )
+    if (
+        compose.conf["createrepo_assemble_from_pkgset"]
+        and repo_dir_arch
+        and createrepo_c
+        and not compose.conf["createrepo_extra_args"]
+    ):
+        processed_rpms = _assemble_variant_repodata(
+            compose,
+            repo,
+            repo_dir,
+            repo_dir_arch,
+            sorted(rpms),
+            comps_path,
+            cachedir,
+            log_file,
         )
-        if not os.path.exists(cachedir):
-            try:
-                os.makedirs(cachedir)
-            except Exception as e:
-                compose.log_warning(
-                    "Cache disabled because cannot create cache dir %s %s"
-                    % (cachedir, str(e))
-                )
-                cachedir = None
     else:
-        cachedir = None
-    cmd = repo.get_createrepo_cmd(
+        cmd = repo.get_createrepo_cmd(
+            repo_dir,
+            update=True,
+            database=compose.should_create_yum_database,
+            skip_stat=True,
+            pkglist=file_list,
+            outputdir=repo_dir,
+            workers=compose.conf["createrepo_num_workers"],
+            groupfile=comps_path,
+            update_md_path=repo_dir_arch,
+            checksum=createrepo_checksum,
+            deltas=with_deltas,
+            oldpackagedirs=None if use_delta_store else old_package_dirs,
+            use_xz=compose.conf["createrepo_use_xz"],
+            extra_args=compose.conf["createrepo_extra_args"],
+            cachedir=cachedir,
+        )
+        run(cmd, logfile=log_file, show_cmd=True)
+
+    if checksum_cache:
+        hits, misses = checksum_cache.mark_used(processed_rpms)
+        compose.log_info(
+            "[CACHE] createrepo %s.%s (%s): %d cached checksums used, "
+            "%d checksums computed" % (variant.uid, arch, pkg_type, hits, misses)
+        )
+
+    # Extra metadata is collected first and added to repodata in one go.
+    finaliser = RepodataFinaliser(
         repo_dir,
-        update=True,
-        database=compose.should_create_yum_database,
-        skip_stat=True,
-        pkglist=file_list,
-        outputdir=repo_dir,
-        workers=compose.conf["createrepo_num_workers"],
-        groupfile=comps_path,
-        update_md_path=repo_dir_arch,
         checksum=createrepo_checksum,
-        deltas=with_deltas,
-        oldpackagedirs=old_package_dirs,
-        use_xz=compose.conf["createrepo_use_xz"],
-        extra_args=compose.conf["createrepo_extra_args"],
-        cachedir=cachedir,
-    )
-    log_file = compose.paths.log.log_file(
-        arch, "createrepo-%s.%s" % (variant, pkg_type)
+        workers=compose.conf["createrepo_num_workers"],
     )
-    run(cmd, logfile=log_file, show_cmd=True)
 
-    # call modifyrepo to inject productid
+    if use_delta_store:
+        if not isinstance(old_package_dirs, list):
+            old_package_dirs = [old_package_dirs]
+        deltas = link_deltas(
+            delta_store,
+            repo_dir,
+            find_old_packages(sorted(rpms), old_package_dirs),
+            createrepo_checksum,
+            workers=compose.conf["createrepo_num_workers"],
+            logger=compose._logger,
+        )
+        finaliser.add_content(
+            "prestodelta",
+            "prestodelta.xml",
+            get_prestodelta_xml(deltas, createrepo_checksum),
+        )
+
+    # inject productid
     product_id = compose.conf.get("product_id")
+    product_id_path = None
     if product_id and pkg_type == "rpm":
         # add product certificate to base (rpm) repo; skip source and debug
         product_id_path = compose.paths.work.product_id(arch, variant)
         if os.path.isfile(product_id_path):
-            cmd = repo.get_modifyrepo_cmd(
-                os.path.join(repo_dir, "repodata"), product_id_path, compress_type="gz"
-            )
-            log_file = compose.paths.log.log_file(arch, "modifyrepo-%s" % variant)
-            run(cmd, logfile=log_file, show_cmd=True)
-            # productinfo is not supported by modifyrepo in any way
-            # this is a HACK to make CDN happy (dmach: at least I think,
-            # need to confirm with dgregor)
-            shutil.copy2(
-                product_id_path, os.path.join(repo_dir, "repodata", "productid")
-            )
+            finaliser.add_file("productid", product_id_path)
+        else:
+            product_id_path = None
 
-    # call modifyrepo to inject modulemd if needed
+    # inject modulemd if needed
+    metadata = []
     if pkg_type == "rpm" and arch in variant.arch_mmds and Modulemd is not None:
         mod_index = Modulemd.ModuleIndex()
-        metadata = []
 
         for module_id, mmd in variant.arch_mmds.get(arch, {}).items():
             if modules_metadata:
@@ -285,26 +612,78 @@ def create_variant_repo(
                 variant.module_uid_to_koji_tag[nsvc] = "DUMMY"
                 metadata.append((nsvc, []))
 
-        log_file = compose.paths.log.log_file(arch, "modifyrepo-modules-%s" % variant)
-        add_modular_metadata(repo, repo_dir, mod_index, log_file)
+        # Dumping empty index fails, we need to check for that.
+        if mod_index.get_module_names():
+            finaliser.add_content("modules", "modules.yaml", mod_index.dump_to_string())
 
-        for module_id, module_rpms in metadata:
-            modulemd_path = os.path.join(
-                types[pkg_type][1](relative=True),
-                find_file_in_repodata(repo_dir, "modules"),
-            )
-            modules_metadata.prepare_module_metadata(
-                variant,
-                arch,
-                module_id,
-                modulemd_path,
-                types[pkg_type][0],
-                list(module_rpms),
-            )
+    locations = finaliser.write()
+
+    if product_id_path:
+        # productinfo is not supported by modifyrepo in any way
+        # this is a HACK to make CDN happy (dmach: at least I think,
+        # need to confirm with dgregor)
+        shutil.copy2(product_id_path, os.path.join(repo_dir, "repodata", "productid"))
+
+    for module_id, module_rpms in metadata:
+        modulemd_path = os.path.join(
+            types[pkg_type][1](relative=True), locations["modules"]
+        )
+        modules_metadata.prepare_module_metadata(
+            variant,
+            arch,
+            module_id,
+            modulemd_path,
+            types[pkg_type][0],
+            list(module_rpms),
+        )
 
     compose.log_info("[DONE ] %s" % msg)
 
 
+def _assemble_variant_repodata(
+    compose, repo, repo_dir, source_repo, rpms, comps_path, cachedir, log_file
+):
+    """Create repodata for variant repo by reusing package records from the
+    package set repo. Packages missing there are processed by createrepo.
+
+    :returns: list of packages that were processed by createrepo
+    """
+    assembler = RepodataAssembler(
+        repo_dir,
+        checksum=compose.conf["createrepo_checksum"],
+        database=compose.should_create_yum_database,
+        use_xz=compose.conf["createrepo_use_xz"],
+    )
+    missing = assembler.add_packages(source_repo, rpms)
+    compose.log_debug(
+        "Reused %d package records from %s, %d missing",
+        len(rpms) - len(missing),
+        source_repo,
+        len(missing),
+    )
+    if missing:
+        with temp_dir(prefix="createrepo-", dir=compose.paths.work.tmp_dir()) as tmp:
+            file_list = os.path.join(tmp, "pkglist")
+            with open(file_list, "w") as f:
+                for rel_path in missing:
+                    f.write("%s\n" % rel_path)
+            cmd = repo.get_createrepo_cmd(
+                repo_dir,
+                update=False,
+                database=False,
+                skip_stat=True,
+                pkglist=file_list,
+                outputdir=tmp,
+                workers=compose.conf["createrepo_num_workers"],
+                checksum=compose.conf["createrepo_checksum"],
+                cachedir=cachedir,
+            )
+            run(cmd, logfile=log_file, show_cmd=True)
+            assembler.add_repo(tmp)
+    assembler.write(groupfile=comps_path)
+    return missing
+
+
 def add_modular_metadata(repo, repo_path, mod_index, log_file):
     """Add modular metadata into a repository."""
     # Dumping empty index fails, we need to check for that.
@@ -325,20 +704,22 @@ def add_modular_metadata(repo, repo_path, mod_index, log_file):
         run(cmd, logfile=log_file, show_cmd=True)
 
 
-def find_file_in_repodata(repo_path, type_):
-    dom = xml.dom.minidom.parse(os.path.join(repo_path, "repodata", "repomd.xml"))
-    for entry in dom.getElementsByTagName("data"):
-        if entry.getAttribute("type") == type_:
-            return entry.getElementsByTagName("location")[0].getAttribute("href")
-        entry.unlink()
-    raise RuntimeError("No such file in repodata: %s" % type_)
-
-
 class CreaterepoThread(WorkerThread):
-    def __init__(self, pool, reference_pkgset, modules_metadata):
+    def __init__(
+        self,
+        pool,
+        reference_pkgset,
+        modules_metadata,
+        manifest_index=None,
+        delta_store=None,
+        checksum_cache=None,
+    ):
         super(CreaterepoThread, self).__init__(pool)
         self.reference_pkgset = reference_pkgset
         self.modules_metadata = modules_metadata
+        self.manifest_index = manifest_index
+        self.delta_store = delta_store
+        self.checksum_cache = checksum_cache
 
     def process(self, item, num):
         compose, arch, variant, pkg_type = item
@@ -349,6 +730,9 @@ class CreaterepoThread(WorkerThread):
             pkg_type=pkg_type,
             pkgset=self.reference_pkgset,
             modules_metadata=self.modules_metadata,
+            manifest_index=self.manifest_index,
+            delta_store=self.delta_store,
+            checksum_cache=self.checksum_cache,
         )
 
 
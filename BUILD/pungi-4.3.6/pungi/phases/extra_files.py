@@ -123,6 +123,7 @@ def copy_extra_files(
             copy_all(extra_files_dir, os_tree),
             compose.conf["media_checksums"],
             relative_root=compose.paths.compose.topdir(),
+            engine=compose.checksum_engine,
         )
 
     compose.log_info("[DONE ] %s" % msg)
@@ -33,6 +33,8 @@ from pungi.phases.createiso import (
     compare_packages,
     OldFileLinker,
     get_iso_level_config,
+    get_iso_write_scheduler,
+    IsoWriteScheduler,
 )
 from pungi.util import (
     failable,
@@ -52,6 +54,8 @@ class ExtraIsosPhase(PhaseLoggerMixin, ConfigGuardedPhase, PhaseBase):
         super(ExtraIsosPhase, self).__init__(compose)
         self.pool = ThreadPool(logger=self.logger)
         self.bi = buildinstall_phase
+        self.scheduler = None
+        self.iso_names = []
 
     def validate(self):
         for variant in self.compose.get_variants(types=["variant"]):
@@ -74,19 +78,54 @@ class ExtraIsosPhase(PhaseLoggerMixin, ConfigGuardedPhase, PhaseBase):
                 if not config["skip_src"]:
                     arches.add("src")
                 for arch in sorted(arches):
-                    commands.append((config, variant, arch))
+                    commands.append(
+                        (
+                            self._get_name(config, variant, arch),
+                            self._estimate_size(config, variant, arch),
+                            (config, variant, arch),
+                        )
+                    )
 
-        for (config, variant, arch) in commands:
-            self.pool.add(ExtraIsosThread(self.pool, self.bi))
+        self.scheduler = get_iso_write_scheduler(self.compose)
+        self.iso_names = [name for name, _, _ in commands]
+        for (config, variant, arch) in self.scheduler.plan(commands, self.logger):
+            self.pool.add(ExtraIsosThread(self.pool, self.bi, self.scheduler))
             self.pool.queue_put((self.compose, config, variant, arch))
 
         self.pool.start()
 
+    def stop(self):
+        super(ExtraIsosPhase, self).stop()
+        if self.scheduler:
+            self.scheduler.report(self.iso_names, self.logger)
+
+    def _get_name(self, config, variant, arch):
+        try:
+            return get_filename(self.compose, variant, arch, config.get("filename"))
+        except RuntimeError:
+            # The worker will report the problem.
+            return "%s.%s" % (variant.uid, arch)
+
+    def _estimate_size(self, config, variant, arch):
+        """The image will contain the os trees of all included variants."""
+        size = 0
+        for uid in [variant.uid] + config["include_variants"]:
+            if uid not in self.compose.all_variants:
+                continue
+            os_tree = self.compose.paths.compose.os_tree(
+                arch, self.compose.all_variants[uid], create_dir=False
+            )
+            size += sum(
+                entry.size for entry in self.compose.tree_scanner.scan(os_tree).files
+            )
+        return size
+
 
 class ExtraIsosThread(WorkerThread):
-    def __init__(self, pool, buildinstall_phase):
+    def __init__(self, pool, buildinstall_phase, scheduler=None):
         super(ExtraIsosThread, self).__init__(pool)
         self.bi = buildinstall_phase
+        self.scheduler = scheduler or IsoWriteScheduler()
 
     def process(self, item, num):
         self.num = num
@@ -156,17 +195,18 @@ class ExtraIsosThread(WorkerThread):
             with open(script_file, "w") as f:
                 createiso.write_script(opts, f)
 
-            run_createiso_command(
-                self.num,
-                compose,
-                bootable,
-                arch,
-                ["bash", script_file],
-                [compose.topdir],
-                log_file=compose.paths.log.log_file(
-                    arch, "extraiso-%s" % os.path.basename(iso_path)
-                ),
-            )
+            with self.scheduler.writing(iso_path):
+                run_createiso_command(
+                    self.num,
+                    compose,
+                    bootable,
+                    arch,
+                    ["bash", script_file],
+                    [compose.topdir],
+                    log_file=compose.paths.log.log_file(
+                        arch, "extraiso-%s" % os.path.basename(iso_path)
+                    ),
+                )
 
         img = add_iso_to_metadata(
             compose,
@@ -351,6 +391,7 @@ def get_extra_files(compose, variant, arch, extra_files):
             extra_files_dir,
             filelist,
             compose.conf["media_checksums"],
+            engine=compose.checksum_engine,
         )
 
 
@@ -370,8 +411,11 @@ def get_iso_contents(
             buildinstall_dir = os.path.join(buildinstall_dir, variant.uid)
 
         copy_boot_images(buildinstall_dir, iso_dir)
+        compose.tree_scanner.invalidate(iso_dir)
         files = iso.get_graft_points(
-            compose.paths.compose.topdir(), [buildinstall_dir, iso_dir]
+            compose.paths.compose.topdir(),
+            [buildinstall_dir, iso_dir],
+            scanner=compose.tree_scanner,
         )
 
         # We need to point efiboot.img to compose/ tree, because it was
@@ -389,7 +433,7 @@ def get_iso_contents(
         # Get packages...
         package_dir = compose.paths.compose.packages(arch, var)
         for k, v in iso.get_graft_points(
-            compose.paths.compose.topdir(), [package_dir]
+            compose.paths.compose.topdir(), [package_dir], scanner=compose.tree_scanner
         ).items():
             files[os.path.join(var.uid, "Packages", k)] = v
 
@@ -397,7 +441,7 @@ def get_iso_contents(
         tree_dir = compose.paths.compose.repository(arch, var)
         repo_dir = os.path.join(tree_dir, "repodata")
         for k, v in iso.get_graft_points(
-            compose.paths.compose.topdir(), [repo_dir]
+            compose.paths.compose.topdir(), [repo_dir], scanner=compose.tree_scanner
         ).items():
             files[os.path.join(var.uid, "repodata", k)] = v
 
@@ -405,7 +449,9 @@ def get_iso_contents(
             # Get extra files...
             extra_files_dir = compose.paths.work.extra_files_dir(arch, var)
             for k, v in iso.get_graft_points(
-                compose.paths.compose.topdir(), [extra_files_dir]
+                compose.paths.compose.topdir(),
+                [extra_files_dir],
+                scanner=compose.tree_scanner,
             ).items():
                 files[os.path.join(var.uid, k)] = v
 
@@ -420,10 +466,16 @@ def get_iso_contents(
         original_treeinfo,
         os.path.join(extra_files_dir, ".treeinfo"),
     )
+    # The directory is shared by all extra ISOs for the variant and arch.
+    compose.tree_scanner.invalidate(extra_files_dir)
 
     # Add extra files specific for the ISO
     files.update(
-        iso.get_graft_points(compose.paths.compose.topdir(), [extra_files_dir])
+        iso.get_graft_points(
+            compose.paths.compose.topdir(),
+            [extra_files_dir],
+            scanner=compose.tree_scanner,
+        )
     )
 
     gp = "%s-graft-points" % iso_dir
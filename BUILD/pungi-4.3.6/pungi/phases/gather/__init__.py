@@ -44,7 +44,7 @@ from pungi.util import get_arch_data, get_arch_variant_data, get_variant_data, m
 from pungi.wrappers.scm import get_file_from_scm
 
 from ...wrappers.createrepo import CreaterepoWrapper
-from .link import link_files
+from .link import get_link_service, link_files
 
 
 def get_gather_source(name):
@@ -125,6 +125,9 @@ class GatherPhase(PhaseBase):
             self.compose, self.pkgset_phase.package_sets, self.pkgset_phase.path_prefix
         )
 
+        # All packages are linked at once, so that target directories are
+        # created in one go and packages shared by variants are linked once.
+        linker = get_link_service(self.compose)
         for variant_uid in get_ordered_variant_uids(self.compose):
             variant = self.compose.all_variants[variant_uid]
             if variant.is_empty:
@@ -137,8 +140,14 @@ class GatherPhase(PhaseBase):
                     pkg_map[arch][variant.uid],
                     self.pkgset_phase.package_sets,
                     manifest=self.manifest,
+                    linker=linker,
                 )
 
+        msg = "Linking %d packages" % len(linker)
+        self.compose.log_info("[BEGIN] %s" % msg)
+        linker.run()
+        self.compose.log_info("[DONE ] %s" % msg)
+
         self._write_manifest()
 
     def stop(self):
@@ -18,12 +18,7 @@ import os
 
 import kobo.rpmlib
 
-from pungi.linker import LinkerPool
-
-
-# TODO: global Linker instance - to keep hardlinks on dest?
-# DONE: show overall progress, not each file
-#   TODO: (these should be logged separately)
+from pungi.linker import LinkService
 
 
 def _get_src_nevra(compose, pkg_obj, srpm_map):
@@ -57,14 +52,35 @@ def get_package_path(filename, hashed_directory=False):
     return filename
 
 
-def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={}):
+def get_link_service(compose):
+    """Create a service for linking packages into the compose."""
+    bwlimit = compose.conf.get("link_bandwidth_limit")
+    return LinkService(
+        compose.conf["link_type"],
+        workers=compose.conf["link_workers"],
+        logger=compose._logger,
+        bwlimit=bwlimit * 1024**2 if bwlimit else None,
+    )
+
+
+def link_files(
+    compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={}, linker=None
+):
+    """Link packages for given variant and arch and add them to the manifest.
+
+    If ``linker`` service is given, the packages are only planned in it and
+    the caller is responsible for running it. Otherwise they are linked
+    immediately.
+    """
     # srpm_map instance is shared between link_files() runs
 
     msg = "Linking packages (arch: %s, variant: %s)" % (arch, variant)
-    compose.log_info("[BEGIN] %s" % msg)
-    link_type = compose.conf["link_type"]
-
-    pool = LinkerPool.with_workers(10, link_type, logger=compose._logger)
+    if linker:
+        compose.log_debug("Planning packages (arch: %s, variant: %s)" % (arch, variant))
+        pool = linker
+    else:
+        compose.log_info("[BEGIN] %s" % msg)
+        pool = get_link_service(compose)
 
     hashed_directories = compose.conf["hashed_directories"]
 
@@ -87,7 +103,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        pool.add(pkg["path"], dst)
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -116,7 +132,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        pool.add(pkg["path"], dst)
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -146,7 +162,7 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
         dst_relpath = os.path.join(packages_dir_relpath, package_path)
 
         # link file
-        pool.queue_put((pkg["path"], dst))
+        pool.add(pkg["path"], dst)
 
         # update rpm manifest
         pkg_obj = pkg_by_path[pkg["path"]]
@@ -162,6 +178,6 @@ def link_files(compose, arch, variant, pkg_map, pkg_sets, manifest, srpm_map={})
             srpm_nevra=src_nevra,
         )
 
-    pool.start()
-    pool.stop()
-    compose.log_info("[DONE ] %s" % msg)
+    if not linker:
+        pool.run()
+        compose.log_info("[DONE ] %s" % msg)
@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import os
-from kobo import shortcuts
 from collections import defaultdict
-import threading
 
 from .base import PhaseBase
+from ..checksums import ChecksumEngine
 from ..util import get_format_substs, get_file_size
 
 
@@ -26,6 +25,9 @@ class ImageChecksumPhase(PhaseBase):
         super(ImageChecksumPhase, self).__init__(compose)
         self.checksums = self.compose.conf["media_checksums"]
         self.one_file = self.compose.conf["media_checksum_one_file"]
+        # Start hashing images as soon as they are added to the manifest, so
+        # that it overlaps with building other images.
+        self.compose.im.add_listener(self._image_added)
 
     def skip(self):
         # Skipping this phase does not make sense:
@@ -67,8 +69,15 @@ class ImageChecksumPhase(PhaseBase):
             base_checksum_name += "-"
         return base_checksum_name
 
+    def _image_added(self, variant, arch, image):
+        path = os.path.join(self.compose.paths.compose.topdir(), image.path)
+        self.compose.checksum_engine.prefetch(path, self.checksums)
+
     def run(self):
         topdir = self.compose.paths.compose.topdir()
+        # Collect digests computed in background, make_checksums will then
+        # only read images that were not announced.
+        self.compose.checksum_engine.wait()
 
         make_checksums(
             topdir,
@@ -76,105 +85,77 @@ class ImageChecksumPhase(PhaseBase):
             self.checksums,
             self.one_file,
             self._get_base_filename,
+            engine=self.compose.checksum_engine,
         )
 
 
-def _compute_checksums(
+def _add_checksums(
     results,
-    cache,
+    digests,
     variant,
     arch,
     path,
-    images,
-    checksum_types,
+    image,
     base_checksum_name_gen,
     one_file,
-    results_lock,
-    cache_lock,
 ):
-    for image in images:
-        filename = os.path.basename(image.path)
-        full_path = os.path.join(path, filename)
-        if not os.path.exists(full_path):
-            continue
-
-        filesize = image.size or get_file_size(full_path)
-
-        cache_lock.acquire()
-        if full_path not in cache:
-            cache_lock.release()
-            # Source ISO is listed under each binary architecture. There's no
-            # point in checksumming it twice, so we can just remember the
-            # digest from first run..
-            checksum_value = shortcuts.compute_file_checksums(full_path, checksum_types)
-            with cache_lock:
-                cache[full_path] = checksum_value
+    filename = os.path.basename(image.path)
+    full_path = os.path.join(path, filename)
+    filesize = image.size or get_file_size(full_path)
+
+    for checksum, digest in digests.items():
+        # Update metadata with the checksum
+        image.add_checksum(None, checksum, digest)
+        # If not turned of, create the file-specific checksum file
+        if not one_file:
+            checksum_filename = os.path.join(
+                path, "%s.%sSUM" % (filename, checksum.upper())
+            )
+            results[checksum_filename].add((filename, filesize, checksum, digest))
+
+        if one_file:
+            dirname = os.path.basename(path)
+            base_checksum_name = base_checksum_name_gen(variant, arch, dirname=dirname)
+            checksum_filename = base_checksum_name + "CHECKSUM"
         else:
-            cache_lock.release()
-
-        with cache_lock:
-            digests = cache[full_path]
-
-        for checksum, digest in digests.items():
-            # Update metadata with the checksum
-            image.add_checksum(None, checksum, digest)
-            # If not turned of, create the file-specific checksum file
-            if not one_file:
-                checksum_filename = os.path.join(
-                    path, "%s.%sSUM" % (filename, checksum.upper())
-                )
-                with results_lock:
-                    results[checksum_filename].add(
-                        (filename, filesize, checksum, digest)
-                    )
-
-            if one_file:
-                dirname = os.path.basename(path)
-                base_checksum_name = base_checksum_name_gen(
-                    variant, arch, dirname=dirname
-                )
-                checksum_filename = base_checksum_name + "CHECKSUM"
-            else:
-                base_checksum_name = base_checksum_name_gen(variant, arch)
-                checksum_filename = "%s%sSUM" % (base_checksum_name, checksum.upper())
-            checksum_path = os.path.join(path, checksum_filename)
-
-            with results_lock:
-                results[checksum_path].add((filename, filesize, checksum, digest))
-
-
-def make_checksums(topdir, im, checksum_types, one_file, base_checksum_name_gen):
+            base_checksum_name = base_checksum_name_gen(variant, arch)
+            checksum_filename = "%s%sSUM" % (base_checksum_name, checksum.upper())
+        checksum_path = os.path.join(path, checksum_filename)
+
+        results[checksum_path].add((filename, filesize, checksum, digest))
+
+
+def make_checksums(
+    topdir, im, checksum_types, one_file, base_checksum_name_gen, engine=None
+):
     results = defaultdict(set)
-    cache = {}
-    threads = []
-    results_lock = threading.Lock()  # lock to synchronize access to the results dict.
-    cache_lock = threading.Lock()  # lock to synchronize access to the cache dict.
-
-    # create all worker threads
-    for (variant, arch, path), images in get_images(topdir, im).items():
-        threads.append(
-            threading.Thread(
-                target=_compute_checksums,
-                args=[
-                    results,
-                    cache,
-                    variant,
-                    arch,
-                    path,
-                    images,
-                    checksum_types,
-                    base_checksum_name_gen,
-                    one_file,
-                    results_lock,
-                    cache_lock,
-                ],
-            )
+    engine = engine or ChecksumEngine()
+
+    images = []
+    for (variant, arch, path), dir_images in get_images(topdir, im).items():
+        for image in dir_images:
+            full_path = os.path.join(path, os.path.basename(image.path))
+            if os.path.exists(full_path):
+                images.append((variant, arch, path, image, full_path))
+
+    # Source ISO is listed under each binary architecture. Each path is only
+    # hashed once, and images are distributed over the engine's workers
+    # individually.
+    digests = engine.checksum_files(
+        set(full_path for _, _, _, _, full_path in images), checksum_types
+    )
+
+    for variant, arch, path, image, full_path in images:
+        _add_checksums(
+            results,
+            digests[full_path],
+            variant,
+            arch,
+            path,
+            image,
+            base_checksum_name_gen,
+            one_file,
         )
-        threads[-1].start()
-
-    # wait for all worker threads to finish
-    for thread in threads:
-        thread.join()
 
     for file in results:
         dump_checksums(file, results[file])
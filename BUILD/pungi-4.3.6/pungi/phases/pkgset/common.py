@@ -125,7 +125,7 @@ def _create_arch_repo(worker_thread, args, task_num):
             msg = "Copying repodata for reuse: %s" % old_repo_dir
             try:
                 compose.log_info("[BEGIN] %s", msg)
-                copy_all(old_repo_dir, repo_dir)
+                copy_all(old_repo_dir, repo_dir, workers=compose.conf["link_workers"])
                 compose.log_info("[DONE ] %s", msg)
                 return
             except Exception as e:
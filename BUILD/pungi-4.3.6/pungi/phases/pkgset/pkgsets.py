@@ -800,7 +800,7 @@ class KojiPackageSet(PackageSetBase):
             and reuse_data["include_packages"] == include_packages
         ):
             self.log_info("Copying repo data for reuse: %s" % old_repo_dir)
-            copy_all(old_repo_dir, repo_dir)
+            copy_all(old_repo_dir, repo_dir, workers=compose.conf["link_workers"])
             self.reuse = old_repo_dir
             self.rpms_by_arch = reuse_data["rpms_by_arch"]
             self.srpms_by_name = reuse_data["srpms_by_name"]
@@ -18,13 +18,21 @@
 Simple profiler that collects time spent in functions
 or code blocks and also call counts.
 
+Profiled blocks nested in the same thread form a tree, e.g. time of
+``label2`` in the example below is reported under ``label1`` too. Both wall
+clock and CPU time of the thread are measured. Recording is thread-safe.
+
+Nothing is recorded unless profiling is enabled with ``Profiler.enable()``
+before any profiled code runs.
+
 
 Usage
 =====
 
 @Profiler("label1")
 def func():
-    ...
+    with Profiler("label2"):
+        ...
 
 or
 
@@ -34,43 +42,216 @@ with Profiler("label2"):
 
 To print profiling data, run:
 Profiler.print_results()
+
+To save the data as JSON and in collapsed stack format (for flamegraph.pl or
+speedscope), run:
+write_results("/path/to/prefix")
+
+Scripts supporting profiling accept a command line option with the prefix,
+or write the results into directory given by ``PUNGI_PROFILE_DIR``
+environment variable.
 """
 
 from __future__ import print_function
 
 
 import functools
+import json
+import os
+import random
 import sys
+import threading
 import time
 
 
+ENV_VAR = "PUNGI_PROFILE_DIR"
+
+# Number of durations kept for each node to compute percentiles.
+MAX_SAMPLES = 1000
+
+
+def _get_cpu_time_func():
+    for name in ("thread_time", "process_time", "clock"):
+        func = getattr(time, name, None)
+        if func:
+            try:
+                func()
+                return func
+            except (OSError, ValueError):
+                # thread_time may not be supported on the platform.
+                pass
+    return time.time
+
+
+_cpu_time = _get_cpu_time_func()
+
+
+class _Node(object):
+    """Statistics of one path in the tree of profiled blocks."""
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.self_wall = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def add(self, wall, cpu, children_wall):
+        self.calls += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.self_wall += max(0.0, wall - children_wall)
+        self.min = wall if self.min is None else min(self.min, wall)
+        self.max = wall if self.max is None else max(self.max, wall)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(wall)
+        else:
+            # Reservoir sampling keeps a uniform sample of all durations.
+            idx = random.randint(0, self.calls - 1)
+            if idx < MAX_SAMPLES:
+                self.samples[idx] = wall
+
+    def percentile(self, percent):
+        samples = sorted(self.samples)
+        if not samples:
+            return None
+        idx = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[idx]
+
+
 class Profiler(object):
+    enabled = False
     _data = {}
+    _lock = threading.Lock()
+    _local = threading.local()
 
     def __init__(self, name):
         self.name = name
-        self._data.setdefault(name, {"time": 0, "calls": 0})
+
+    @classmethod
+    def enable(cls, enabled=True):
+        cls.enabled = enabled
+
+    @classmethod
+    def _get_stack(cls):
+        stack = getattr(cls._local, "stack", None)
+        if stack is None:
+            stack = cls._local.stack = []
+        return stack
 
     def __enter__(self):
-        self.start = time.time()
+        if not self.enabled:
+            return
+        # The same instance can be used by multiple threads at the same time
+        # (e.g. as a decorator), all state is kept in the thread.
+        stack = self._get_stack()
+        path = (stack[-1]["path"] if stack else ()) + (self.name,)
+        stack.append(
+            {"path": path, "wall": time.time(), "cpu": _cpu_time(), "children": 0.0}
+        )
 
     def __exit__(self, ty, val, tb):
-        delta = time.time() - self.start
-        self._data[self.name]["time"] += delta
-        self._data[self.name]["calls"] += 1
+        if not self.enabled:
+            return
+        stack = self._get_stack()
+        frame = stack.pop()
+        wall = time.time() - frame["wall"]
+        cpu = _cpu_time() - frame["cpu"]
+        if stack:
+            stack[-1]["children"] += wall
+        with self._lock:
+            node = self._data.setdefault(frame["path"], _Node())
+            node.add(wall, cpu, frame["children"])
 
     def __call__(self, func):
         @functools.wraps(func)
         def decorated(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
             with self:
                 return func(*args, **kwargs)
 
         return decorated
 
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._data.clear()
+
+    @classmethod
+    def get_results(cls):
+        """Return list of dicts with statistics of all nodes, sorted by
+        path. Times are in seconds.
+        """
+        with cls._lock:
+            nodes = sorted(cls._data.items())
+            return [
+                {
+                    "path": list(path),
+                    "calls": node.calls,
+                    "wall": node.wall,
+                    "cpu": node.cpu,
+                    "self_wall": node.self_wall,
+                    "min": node.min,
+                    "max": node.max,
+                    "p50": node.percentile(50),
+                    "p90": node.percentile(90),
+                    "p99": node.percentile(99),
+                }
+                for path, node in nodes
+            ]
+
     @classmethod
     def print_results(cls, stream=sys.stdout):
         print("Profiling results:", file=stream)
-        results = cls._data.items()
-        results = sorted(results, key=lambda x: x[1]["time"], reverse=True)
-        for name, data in results:
-            print("  %6.2f %5d %s" % (data["time"], data["calls"], name), file=stream)
+        results = sorted(cls.get_results(), key=lambda x: x["wall"], reverse=True)
+        for data in results:
+            print(
+                "  %6.2f %6.2f %5d %s"
+                % (data["wall"], data["cpu"], data["calls"], " > ".join(data["path"])),
+                file=stream,
+            )
+
+    @classmethod
+    def dump_json(cls, stream):
+        json.dump({"nodes": cls.get_results()}, stream, indent=2)
+
+    @classmethod
+    def dump_collapsed(cls, stream):
+        """Write self time of each node in microseconds in the collapsed stack
+        format: one line per node with labels separated by semicolons.
+        """
+        for data in cls.get_results():
+            value = int(data["self_wall"] * 1000000)
+            if value:
+                stream.write(
+                    "%s %d\n"
+                    % (";".join(x.replace(";", ",") for x in data["path"]), value)
+                )
+
+
+def get_output_prefix(prefix, program):
+    """Return prefix of files to write profiling results to. An explicitly
+    given prefix wins, otherwise results go into directory from environment
+    if set. Returns None if profiling results should not be written, and
+    profiling should stay disabled.
+    """
+    if prefix:
+        return prefix
+    directory = os.environ.get(ENV_VAR)
+    if directory:
+        return os.path.join(directory, "%s-%d" % (program, os.getpid()))
+    return None
+
+
+def write_results(prefix):
+    """Write profiling results to ``prefix.json`` and ``prefix.folded``."""
+    directory = os.path.dirname(prefix)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(prefix + ".json", "w") as f:
+        Profiler.dump_json(f)
+    with open(prefix + ".folded", "w") as f:
+        Profiler.dump_collapsed(f)
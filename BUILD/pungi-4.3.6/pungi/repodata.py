@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import time
+
+import createrepo_c as cr
+from kobo.threads import run_in_threads
+
+
+class RepodataAssembler(object):
+    """Create repodata for a repository from package records that already
+    exist in metadata of another repository.
+
+    Only the location of each record is rewritten, the packages themselves are
+    never opened. This is useful for variant repos, which contain a subset of
+    packages from a package set repo.
+
+    :param str repo_dir: path to the repository being created
+    :param str checksum: name of checksum type used for metadata files
+    :param bool database: whether to create SQLite databases as well
+    :param bool use_xz: compress SQLite databases with xz instead of bzip2
+    """
+
+    def __init__(self, repo_dir, checksum="sha256", database=False, use_xz=False):
+        self.repo_dir = repo_dir
+        self.checksum = cr.checksum_type(checksum)
+        self.database = database
+        self.db_compression = cr.XZ_COMPRESSION if use_xz else cr.BZ2_COMPRESSION
+        self.packages = {}
+        # Loaded metadata must be kept alive as long as the packages are used.
+        self._metadata = []
+
+    def _load(self, repo_path):
+        md = cr.Metadata(key=cr.HT_KEY_FILENAME)
+        md.locate_and_load_xml(repo_path)
+        self._metadata.append(md)
+        return md
+
+    def add_packages(self, source_repo, rel_paths):
+        """Copy records of given packages from the source repo. The records are
+        matched by file name.
+
+        :param str source_repo: path to repo with records to reuse
+        :param rel_paths: paths to packages relative to the created repo
+        :returns: list of paths that have no record in the source repo
+        """
+        md = self._load(source_repo)
+        missing = []
+        for rel_path in rel_paths:
+            filename = os.path.basename(rel_path)
+            if not md.has_key(filename):
+                missing.append(rel_path)
+                continue
+            pkg = md.get(filename)
+            pkg.location_href = rel_path
+            pkg.location_base = None
+            self.packages[rel_path] = pkg
+        return missing
+
+    def add_repo(self, repo_path):
+        """Add all packages from metadata of given repo. The locations are
+        expected to already be relative to the created repo.
+        """
+        md = self._load(repo_path)
+        for key in md.keys():
+            pkg = md.get(key)
+            self.packages[pkg.location_href] = pkg
+
+    def _add_record(self, repomd, mdtype, path):
+        record = cr.RepomdRecord(mdtype, path)
+        record.fill(self.checksum)
+        record.rename_file()
+        repomd.set_record(record)
+        return record
+
+    def _add_database(self, repomd, mdtype, db, db_path, checksum):
+        db.dbinfo_update(checksum)
+        db.close()
+        compressed_path = db_path + cr.compression_suffix(self.db_compression)
+        cr.compress_file(db_path, compressed_path, self.db_compression)
+        os.remove(db_path)
+        self._add_record(repomd, mdtype, compressed_path)
+
+    def write(self, groupfile=None):
+        """Write the repodata. The existing ``repodata`` directory is replaced
+        only after all files are successfully written.
+
+        :param str groupfile: optional path to comps file to include
+        """
+        tmp_dir = os.path.join(self.repo_dir, ".repodata")
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        files = [
+            ("primary", cr.PrimaryXmlFile, cr.PrimarySqlite),
+            ("filelists", cr.FilelistsXmlFile, cr.FilelistsSqlite),
+            ("other", cr.OtherXmlFile, cr.OtherSqlite),
+        ]
+        outputs = []
+        for mdtype, xml_cls, db_cls in files:
+            xml_path = os.path.join(tmp_dir, "%s.xml.gz" % mdtype)
+            xml = xml_cls(xml_path)
+            xml.set_num_of_pkgs(len(self.packages))
+            db_path = os.path.join(tmp_dir, "%s.sqlite" % mdtype)
+            db = db_cls(db_path) if self.database else None
+            outputs.append((mdtype, xml, xml_path, db, db_path))
+
+        for rel_path in sorted(self.packages):
+            pkg = self.packages[rel_path]
+            for _, xml, _, db, _ in outputs:
+                xml.add_pkg(pkg)
+                if db:
+                    db.add_pkg(pkg)
+
+        repomd = cr.Repomd()
+        repomd.set_revision(str(int(time.time())))
+        for mdtype, xml, xml_path, db, db_path in outputs:
+            xml.close()
+            record = self._add_record(repomd, mdtype, xml_path)
+            if db:
+                self._add_database(repomd, mdtype + "_db", db, db_path, record.checksum)
+
+        if groupfile:
+            group_path = os.path.join(tmp_dir, os.path.basename(groupfile))
+            shutil.copy2(groupfile, group_path)
+            record = cr.RepomdRecord("group", group_path)
+            record_gz = record.compress_and_fill(self.checksum, cr.GZ_COMPRESSION)
+            record_gz.type = "group_gz"
+            record_gz.rename_file()
+            record.fill(self.checksum)
+            record.rename_file()
+            repomd.set_record(record)
+            repomd.set_record(record_gz)
+
+        repomd.sort_records()
+        with open(os.path.join(tmp_dir, "repomd.xml"), "w") as f:
+            f.write(repomd.xml_dump())
+
+        repodata = os.path.join(self.repo_dir, "repodata")
+        old_dir = os.path.join(self.repo_dir, ".repodata.old")
+        if os.path.exists(repodata):
+            os.rename(repodata, old_dir)
+        os.rename(tmp_dir, repodata)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+
+class RepodataFinaliser(object):
+    """Add extra metadata files (e.g. productid or modules) to an existing
+    repository.
+
+    Unlike running ``modifyrepo`` for each file, all files are compressed in
+    parallel and ``repomd.xml`` is rewritten only once. The new file replaces
+    the old one atomically. Existing records of the same type are replaced.
+
+    :param str repo_dir: path to the repository
+    :param str checksum: name of checksum type used for the new records
+    :param int workers: how many files to compress at the same time
+    """
+
+    def __init__(self, repo_dir, checksum="sha256", workers=3):
+        self.repo_dir = repo_dir
+        self.checksum = cr.checksum_type(checksum)
+        self.workers = workers
+        self.files = []
+        self._staging_dir = None
+
+    def _get_staging_dir(self):
+        if self._staging_dir is None:
+            self._staging_dir = tempfile.mkdtemp(
+                prefix=".finalise-", dir=os.path.join(self.repo_dir, "repodata")
+            )
+        return self._staging_dir
+
+    def add_file(self, mdtype, path):
+        """Schedule the file at given path to be added as ``mdtype``."""
+        staged_path = os.path.join(self._get_staging_dir(), os.path.basename(path))
+        shutil.copy2(path, staged_path)
+        self.files.append((mdtype, staged_path))
+
+    def add_content(self, mdtype, filename, content):
+        """Schedule a file with given content to be added as ``mdtype``."""
+        staged_path = os.path.join(self._get_staging_dir(), filename)
+        with open(staged_path, "w") as f:
+            f.write(content)
+        self.files.append((mdtype, staged_path))
+
+    def _compress(self, mdtype, path):
+        record = cr.RepomdRecord(mdtype, path)
+        compressed = record.compress_and_fill(self.checksum, cr.GZ_COMPRESSION)
+        compressed.type = mdtype
+        compressed.rename_file()
+        return compressed
+
+    def write(self):
+        """Compress all scheduled files and update ``repomd.xml``.
+
+        :returns: a dict mapping metadata type to location of the file
+                  relative to the repository
+        """
+        if not self.files:
+            return {}
+
+        repodata = os.path.join(self.repo_dir, "repodata")
+        records = {}
+
+        def _compress_worker(thread, item, num):
+            mdtype, path = item
+            records[mdtype] = self._compress(mdtype, path)
+
+        try:
+            run_in_threads(
+                _compress_worker,
+                self.files,
+                threads=max(1, min(self.workers, len(self.files))),
+            )
+
+            repomd_path = os.path.join(repodata, "repomd.xml")
+            repomd = cr.Repomd(repomd_path)
+            old_files = set(
+                record.location_href
+                for record in repomd.records
+                if record.type in records
+            )
+            result = {}
+            for mdtype, _ in self.files:
+                record = records[mdtype]
+                filename = os.path.basename(record.location_real)
+                os.rename(record.location_real, os.path.join(repodata, filename))
+                repomd.set_record(record)
+                result[mdtype] = record.location_href
+                old_files.discard(record.location_href)
+
+            tmp_repomd = repomd_path + ".tmp"
+            with open(tmp_repomd, "w") as f:
+                f.write(repomd.xml_dump())
+            os.rename(tmp_repomd, repomd_path)
+
+            for location in old_files:
+                path = os.path.join(self.repo_dir, location)
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            shutil.rmtree(self._staging_dir)
+            self._staging_dir = None
+            self.files = []
+
+        return result
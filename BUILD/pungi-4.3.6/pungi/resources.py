@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Resource usage of a compose.
+
+The usage of the pungi process and all its descendants (e.g. commands
+executed with ``run()``) is read from ``/proc``. CPU time and I/O of the
+whole compose are counted as difference between its start and end, which is
+exact as reaped children are included in the counters of the parent. The
+process tree is also sampled in background to find peak RSS and to show how
+the usage changed over time.
+
+Phases and tasks running in parallel share the process tree, so its usage can
+not be split between them. Only the time when each of them ran is recorded,
+to be matched with the samples.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+PROC = "/proc"
+
+
+class Usage(object):
+    """Resource usage of the process tree at one point in time."""
+
+    def __init__(self, cpu=0.0, rss=0, read_bytes=0, write_bytes=0, rx=0, tx=0):
+        self.cpu = cpu
+        self.rss = rss
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.rx = rx
+        self.tx = tx
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _parse_stat(data):
+    # The command name in parentheses can contain spaces.
+    fields = data[data.rindex(")") + 2 :].split()
+    return {
+        "ppid": int(fields[1]),
+        "utime": int(fields[11]),
+        "stime": int(fields[12]),
+        "cutime": int(fields[13]),
+        "cstime": int(fields[14]),
+        "rss": int(fields[21]),
+    }
+
+
+def _read_io(pid):
+    result = {}
+    try:
+        for line in _read(os.path.join(PROC, str(pid), "io")).splitlines():
+            key, _, value = line.partition(":")
+            result[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return result
+
+
+def _read_net():
+    """Return bytes received and sent on all interfaces except loopback. The
+    counters are shared by all processes in the network namespace.
+    """
+    rx = tx = 0
+    try:
+        lines = _read(os.path.join(PROC, "self", "net", "dev")).splitlines()
+    except (IOError, OSError):
+        return 0, 0
+    for line in lines[2:]:
+        name, _, data = line.partition(":")
+        if name.strip() == "lo":
+            continue
+        fields = data.split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+
+def _list_processes():
+    """Return dict mapping pid to parsed stat of all visible processes."""
+    result = {}
+    for name in os.listdir(PROC):
+        if not name.isdigit():
+            continue
+        try:
+            result[int(name)] = _parse_stat(_read(os.path.join(PROC, name, "stat")))
+        except (IOError, OSError, ValueError, IndexError):
+            # The process exited in the meantime.
+            pass
+    return result
+
+
+def get_usage(pid=None):
+    """Measure usage of given process (current one by default) and all its
+    descendants.
+
+    :rtype: Usage
+    """
+    pid = pid or os.getpid()
+    processes = _list_processes()
+    if pid not in processes:
+        raise RuntimeError("Process %s not found in %s" % (pid, PROC))
+    children = {}
+    for child, stat in processes.items():
+        children.setdefault(stat["ppid"], []).append(child)
+
+    ticks = float(os.sysconf("SC_CLK_TCK"))
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    usage = Usage()
+    usage.rx, usage.tx = _read_net()
+
+    own = processes[pid]
+    # Waited-for children are included in the counters of the parent.
+    usage.cpu += (own["cutime"] + own["cstime"]) / ticks
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        stat = processes[current]
+        usage.cpu += (stat["utime"] + stat["stime"]) / ticks
+        usage.rss += stat["rss"] * page_size
+        io = _read_io(current)
+        usage.read_bytes += io.get("read_bytes", 0)
+        usage.write_bytes += io.get("write_bytes", 0)
+        pending.extend(children.get(current, []))
+    return usage
+
+
+def _diff(start, end):
+    return {
+        "cpu_seconds": round(end.cpu - start.cpu, 2),
+        "read_bytes": end.read_bytes - start.read_bytes,
+        "write_bytes": end.write_bytes - start.write_bytes,
+        "net_rx_bytes": end.rx - start.rx,
+        "net_tx_bytes": end.tx - start.tx,
+    }
+
+
+class _Record(object):
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+
+
+class ResourceMonitor(object):
+    """Record resource usage of the compose and when phases and scheduler
+    tasks ran.
+
+    Starting and stopping a phase or task only records the current time, the
+    process tree is scanned only by the sampling thread.
+
+    :param float interval: seconds between samples
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.records = {}
+        self.samples = []
+        self.peak_rss = 0
+        self._start = None
+        self._start_time = None
+        self._end = None
+        self._end_time = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try:
+            usage = get_usage()
+        except (IOError, OSError, RuntimeError):
+            return None
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, usage.rss)
+            self.samples.append((time.time(), usage))
+        return usage
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._start_time = time.time()
+        self._start = self._sample()
+        self._thread = threading.Thread(target=self._loop, name="resource-sampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._end = self._sample()
+        self._end_time = time.time()
+
+    def started(self, kind, name):
+        with self.lock:
+            self.records[(kind, name)] = _Record()
+
+    def stopped(self, kind, name):
+        with self.lock:
+            record = self.records.get((kind, name))
+            if record and record.end_time is None:
+                record.end_time = time.time()
+
+    def get_summary(self):
+        summary = {
+            "interval": self.interval,
+            "total": None,
+            "samples": [],
+            "phases": {},
+            "tasks": {},
+        }
+        with self.lock:
+            start_time = self._start_time
+            end_time = self._end_time or time.time()
+            if self._start:
+                summary["total"] = _diff(self._start, self._end or self._start)
+                summary["total"]["duration"] = end_time - start_time
+                summary["total"]["peak_rss"] = self.peak_rss
+                for sample_time, usage in self.samples:
+                    sample = _diff(self._start, usage)
+                    sample["time"] = round(sample_time - start_time, 2)
+                    sample["rss"] = usage.rss
+                    summary["samples"].append(sample)
+            for (kind, name), record in self.records.items():
+                summary[kind][name] = {
+                    "start": round(record.start_time - start_time, 2),
+                    "duration": (record.end_time or end_time) - record.start_time,
+                }
+        return summary
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.get_summary(), f, indent=2, sort_keys=True)
+
+
+_monitor = None
+
+
+def start_monitoring(interval):
+    """Start recording resource usage. Does nothing if /proc is not
+    available.
+    """
+    global _monitor
+    if _monitor is None and os.path.isdir(os.path.join(PROC, "self")):
+        _monitor = ResourceMonitor(interval)
+        _monitor.start()
+    return _monitor
+
+
+def stop_monitoring(path=None):
+    """Stop recording and optionally write the summary to a file."""
+    global _monitor
+    monitor, _monitor = _monitor, None
+    if monitor:
+        monitor.stop()
+        if path:
+            monitor.dump(path)
+    return monitor
+
+
+def phase_started(name):
+    if _monitor:
+        _monitor.started("phases", name)
+
+
+def phase_stopped(name):
+    if _monitor:
+        _monitor.stopped("phases", name)
+
+
+def task_started(name):
+    if _monitor:
+        _monitor.started("tasks", name)
+
+
+def task_stopped(name):
+    if _monitor:
+        _monitor.stopped("tasks", name)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Scheduling of compose tasks.
+
+Phases and smaller pieces of work (e.g. writing metadata of one variant and
+arch) are added as tasks with explicit dependencies. Each task starts as soon
+as everything it depends on has finished, instead of waiting for unrelated
+work in the same stage of the compose.
+"""
+
+import collections
+import functools
+import sys
+import threading
+import time
+
+import kobo.log
+import six
+
+from pungi import resources, tracing
+from pungi.profiler import Profiler
+
+
+class Task(object):
+    """A unit of work in :class:`TaskScheduler`.
+
+    :param str name: unique name of the task
+    :param func: function to run, without arguments
+    :param deps: names of tasks that must finish before this one starts
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.start_time = None
+        self.end_time = None
+
+
+class TaskScheduler(kobo.log.LoggingBase):
+    """Run tasks in dependency order on a bounded number of threads.
+
+    Dependencies must be added before the tasks depending on them, so the
+    graph can not contain cycles. If any task fails, no new tasks are started,
+    the running ones are waited for and the first error is raised.
+
+    :param int max_workers: maximum number of tasks running at the same time
+    :param logger: logger to report progress to
+    """
+
+    def __init__(self, max_workers=16, logger=None):
+        kobo.log.LoggingBase.__init__(self, logger=logger)
+        self.max_workers = max(1, max_workers)
+        self.tasks = []
+        self._by_name = {}
+        self._cond = threading.Condition()
+        self._done = set()
+        self._running = set()
+        self._exceptions = []
+
+    def add(self, name, func, deps=()):
+        """Add a task.
+
+        :raises ValueError: if the name is already used or a dependency is
+            not known
+        :returns: name of the task
+        """
+        if name in self._by_name:
+            raise ValueError("Task %s is already scheduled" % name)
+        unknown = [dep for dep in deps if dep not in self._by_name]
+        if unknown:
+            raise ValueError(
+                "Task %s depends on unknown tasks: %s" % (name, ", ".join(unknown))
+            )
+        task = Task(name, func, deps)
+        self.tasks.append(task)
+        self._by_name[name] = task
+        return name
+
+    def add_phase(self, phase, deps=()):
+        """Add a task running the whole phase. The task has the same name as
+        the phase.
+        """
+
+        def _run():
+            phase.start()
+            phase.stop()
+
+        return self.add(phase.name, _run, deps)
+
+    def add_split_phase(self, phase, deps=(), part_deps=None):
+        """Add tasks running a phase split into parts by variant and arch.
+
+        Each part returned by ``phase.get_parts()`` runs in a task named
+        ``<phase>-<variant uid>.<arch>``, and the phase is finished by a task
+        with the same name as the phase once all the parts are done. The phase
+        is started by the first part that can run, so that it does not start
+        long before there is anything to do.
+
+        :param deps: names of tasks that must finish before the phase starts
+        :param part_deps: function returning names of additional tasks that
+            must finish before a part can run, called with the variant and
+            arch of the part
+        :returns: dict mapping (variant uid, arch) to name of the task
+        """
+        lock = threading.Lock()
+        started = []
+
+        def _start():
+            with lock:
+                if not started:
+                    started.append(True)
+                    phase.start(split=True)
+
+        def _run_part(variant, arch):
+            _start()
+            if not phase.skip():
+                phase.run_part(variant, arch)
+
+        def _stop():
+            # Without any parts the phase is started only now.
+            _start()
+            phase.stop()
+
+        parts = collections.OrderedDict()
+        for variant, arch in phase.get_parts():
+            extra_deps = part_deps(variant, arch) if part_deps else []
+            parts[(variant.uid, arch)] = self.add(
+                "%s-%s.%s" % (phase.name, variant.uid, arch),
+                functools.partial(_run_part, variant, arch),
+                list(deps) + list(extra_deps),
+            )
+        self.add(phase.name, _stop, list(deps) + list(parts.values()))
+        return parts
+
+    def _is_ready(self, task):
+        return all(dep in self._done for dep in task.deps)
+
+    def _run_task(self, task):
+        task.start_time = time.time()
+        self.log_debug("[BEGIN] Task %s" % task.name)
+        tracing.set_context(task=task.name)
+        resources.task_started(task.name)
+        try:
+            with tracing.span(task.name, "task"):
+                with Profiler(task.name):
+                    task.func()
+        except Exception:
+            self.log_error("[FAIL] Task %s failed" % task.name)
+            with self._cond:
+                self._exceptions.append(sys.exc_info())
+        else:
+            self.log_debug("[DONE ] Task %s" % task.name)
+            with self._cond:
+                self._done.add(task.name)
+        finally:
+            task.end_time = time.time()
+            resources.task_stopped(task.name)
+            with self._cond:
+                self._running.discard(task.name)
+                self._cond.notify_all()
+
+    def _start_ready(self, pending, threads):
+        for task in list(pending):
+            if len(self._running) >= self.max_workers:
+                break
+            if self._is_ready(task):
+                pending.remove(task)
+                self._running.add(task.name)
+                thread = threading.Thread(
+                    target=self._run_task, args=(task,), name="task-%s" % task.name
+                )
+                threads.append(thread)
+                thread.start()
+
+    def run(self):
+        """Run all tasks and wait for them to finish."""
+        pending = list(self.tasks)
+        threads = []
+        with self._cond:
+            while True:
+                if not self._exceptions:
+                    self._start_ready(pending, threads)
+                if not self._running:
+                    # Either everything is done, or nothing more can start
+                    # because of a failure.
+                    break
+                # With a timeout the wait can be interrupted by signals.
+                self._cond.wait(1)
+        for thread in threads:
+            thread.join()
+
+        if self._exceptions:
+            six.reraise(*self._exceptions[0])
@@ -31,6 +31,7 @@ class ValidationCompose(pungi.compose.Compose):
         self.paths = pungi.paths.Paths(self)
         self.variants = {}
         self.all_variants = {}
+        self.im = pungi.compose.ComposeImages()
 
     @property
     def old_composes(self):
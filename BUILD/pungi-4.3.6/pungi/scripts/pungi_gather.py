@@ -11,7 +11,7 @@ import sys
 import pungi.ks
 from pungi.dnf_wrapper import DnfWrapper, Conf
 from pungi.gather_dnf import Gather, GatherOptions
-from pungi.profiler import Profiler
+from pungi.profiler import Profiler, get_output_prefix, write_results
 from pungi.util import temp_dir
 
 
@@ -21,6 +21,11 @@ def get_parser():
         "--profiler",
         action="store_true",
     )
+    parser.add_argument(
+        "--profiler-output",
+        metavar="PREFIX",
+        help="write profiling results to PREFIX.json and PREFIX.folded",
+    )
     parser.add_argument(
         "--arch",
         required=True,
@@ -230,6 +235,14 @@ def cli_main():
     parser = get_parser()
     ns = parser.parse_args()
 
-    with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_") as persistdir:
-        with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_cache_") as cachedir:
-            main(ns, persistdir, cachedir)
+    profiler_output = get_output_prefix(ns.profiler_output, "pungi-gather")
+    if ns.profiler or profiler_output:
+        Profiler.enable()
+
+    try:
+        with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_") as persistdir:
+            with temp_dir(dir=ns.tempdir, prefix="pungi_dnf_cache_") as cachedir:
+                main(ns, persistdir, cachedir)
+    finally:
+        if profiler_output:
+            write_results(profiler_output)
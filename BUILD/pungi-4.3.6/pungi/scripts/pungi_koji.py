@@ -4,7 +4,9 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import argparse
+import collections
 import getpass
+import functools
 import glob
 import json
 import locale
@@ -20,8 +22,9 @@ import subprocess
 from six.moves import shlex_quote
 
 from pungi.phases import PHASES_NAMES
-from pungi import get_full_version, util
+from pungi import get_full_version, resources, tracing, util
 from pungi.errors import UnsignedPackagesError
+from pungi.profiler import Profiler, get_output_prefix, write_results
 from pungi.wrappers import kojiwrapper
 
 
@@ -194,6 +197,18 @@ def main():
         default=False,
         help="quiet mode, don't print log on screen",
     )
+    parser.add_argument(
+        "--profiler-output",
+        metavar="PREFIX",
+        help="write profiling results to PREFIX.json and PREFIX.folded",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=False,
+        help="record timeline of phases, threads and commands into "
+        "logs/global/trace.json (Chrome trace format)",
+    )
 
     opts = parser.parse_args()
     import pungi.notifier
@@ -343,6 +358,13 @@ def main():
 
     notifier.compose = compose
     COMPOSE = compose
+    if opts.trace:
+        tracing.start_tracing()
+    profiler_output = get_output_prefix(opts.profiler_output, "pungi-koji")
+    if profiler_output:
+        Profiler.enable()
+    if conf["resource_sampling_interval"]:
+        resources.start_monitoring(conf["resource_sampling_interval"])
     try:
         run_compose(
             compose,
@@ -357,6 +379,18 @@ def main():
         for fp in glob.glob(compose.paths.work.pkgset_reuse_file("*")):
             os.unlink(fp)
         raise
+    finally:
+        # Do not keep hashing images in background if the compose failed.
+        compose.checksum_engine.close()
+        if opts.trace:
+            trace_file = os.path.join(compose.paths.log.topdir(), "trace.json")
+            tracing.stop_tracing(trace_file)
+            compose.log_info("Trace written to %s" % trace_file)
+        if profiler_output:
+            write_results(profiler_output)
+        resources_file = os.path.join(compose.paths.log.topdir(), "resources.json")
+        if resources.stop_monitoring(resources_file):
+            compose.log_info("Resource usage written to %s" % resources_file)
 
 
 def run_compose(
@@ -364,6 +398,7 @@ def run_compose(
 ):
     import pungi.phases
     import pungi.metadata
+    import pungi.scheduler
     import pungi.util
 
     errors = []
@@ -398,7 +433,9 @@ def run_compose(
     buildinstall_phase = pungi.phases.BuildinstallPhase(compose, pkgset_phase)
     gather_phase = pungi.phases.GatherPhase(compose, pkgset_phase)
     extrafiles_phase = pungi.phases.ExtraFilesPhase(compose, pkgset_phase)
-    createrepo_phase = pungi.phases.CreaterepoPhase(compose, pkgset_phase)
+    createrepo_phase = pungi.phases.CreaterepoPhase(
+        compose, pkgset_phase, gather_phase=gather_phase
+    )
     ostree_installer_phase = pungi.phases.OstreeInstallerPhase(
         compose, buildinstall_phase, pkgset_phase
     )
@@ -493,60 +530,110 @@ def run_compose(
             # Store the password
             compose.conf["signing_key_password"] = signing_key_password
 
-    init_phase.start()
-    init_phase.stop()
+    with Profiler(init_phase.name):
+        init_phase.start()
+        init_phase.stop()
 
-    pkgset_phase.start()
-    pkgset_phase.stop()
+    with Profiler(pkgset_phase.name):
+        pkgset_phase.start()
+        pkgset_phase.stop()
 
-    # WEAVER phase - launches other phases which can safely run in parallel
-    essentials_schema = (
-        buildinstall_phase,
-        (gather_phase, createrepo_phase),
-        extrafiles_phase,
-        (ostree_phase, ostree_installer_phase),
+    # Phases and metadata writing run as tasks, each of them starts as soon as
+    # its dependencies finish.
+    scheduler = pungi.scheduler.TaskScheduler(
+        compose.conf["max_parallel_tasks"], logger=compose._logger
     )
-    essentials_phase = pungi.phases.WeaverPhase(compose, essentials_schema)
-    essentials_phase.start()
-    essentials_phase.stop()
+    scheduler.add_phase(buildinstall_phase)
+    scheduler.add_phase(gather_phase)
+    # Repositories are created for each variant and arch separately.
+    createrepo_tasks = scheduler.add_split_phase(
+        createrepo_phase, deps=[gather_phase.name]
+    )
+    scheduler.add_phase(extrafiles_phase)
+    scheduler.add_phase(ostree_phase)
+    scheduler.add_phase(ostree_installer_phase, deps=[ostree_phase.name])
+    scheduler.add_phase(repoclosure_phase, deps=[createrepo_phase.name])
+
+    def _get_tree_variants(variant):
+        """Return all variants sharing the tree with the given one: the
+        top-level variant and everything nested in it.
+        """
+        while variant.parent:
+            variant = variant.parent
+        return [variant] + variant.get_variants(recursive=True)
+
+    def _get_part_tasks(tasks, variant, arch):
+        return [
+            tasks[(v.uid, arch)]
+            for v in _get_tree_variants(variant)
+            if (v.uid, arch) in tasks
+        ]
+
+    # Everything that can write into the os trees must finish before the
+    # metadata describing the trees is written. Phases not split by variant
+    # can write into any tree.
+    trees_done = [
+        buildinstall_phase.name,
+        extrafiles_phase.name,
+        ostree_installer_phase.name,
+    ]
+    metadata_tasks = collections.defaultdict(list)
+
+    def _write_tree_info(arch, variant):
+        pungi.metadata.write_tree_info(compose, arch, variant, bi=buildinstall_phase)
+
+    def _write_discinfo(arch, variant):
+        timestamp = pungi.metadata.write_discinfo(compose, arch, variant)
+        pungi.metadata.write_media_repo(compose, arch, variant, timestamp)
 
-    # write treeinfo before ISOs are created
     for variant in compose.get_variants():
         for arch in variant.arches + ["src"]:
-            pungi.metadata.write_tree_info(
-                compose, arch, variant, bi=buildinstall_phase
+            deps = trees_done + _get_part_tasks(createrepo_tasks, variant, arch)
+            metadata_tasks[(variant.uid, arch)].append(
+                scheduler.add(
+                    "treeinfo-%s.%s" % (variant.uid, arch),
+                    functools.partial(_write_tree_info, arch, variant),
+                    deps=deps,
+                )
             )
+            if variant.type == "addon" or variant.is_empty:
+                continue
+            metadata_tasks[(variant.uid, arch)].append(
+                scheduler.add(
+                    "discinfo-%s.%s" % (variant.uid, arch),
+                    functools.partial(_write_discinfo, arch, variant),
+                    deps=deps,
+                )
+            )
+    all_metadata_tasks = [task for tasks in metadata_tasks.values() for task in tasks]
 
-    # write .discinfo and media.repo before ISOs are created
-    for variant in compose.get_variants():
-        if variant.type == "addon" or variant.is_empty:
-            continue
-        for arch in variant.arches + ["src"]:
-            timestamp = pungi.metadata.write_discinfo(compose, arch, variant)
-            pungi.metadata.write_media_repo(compose, arch, variant, timestamp)
+    def _get_createiso_deps(variant, arch):
+        # An image of a variant only needs its own tree to be complete.
+        return [
+            task
+            for v in _get_tree_variants(variant)
+            for task in metadata_tasks.get((v.uid, arch), [])
+        ]
 
-    # Run phases for image artifacts in parallel
-    compose_images_schema = (
-        createiso_phase,
+    scheduler.add_split_phase(createiso_phase, part_deps=_get_createiso_deps)
+
+    # Phases for other image artifacts may include content of multiple
+    # trees.
+    image_phases = (
         extra_isos_phase,
         liveimages_phase,
         image_build_phase,
         livemedia_phase,
         osbuild_phase,
     )
-    post_image_phase = pungi.phases.WeaverPhase(
-        compose, (image_checksum_phase, image_container_phase)
-    )
-    compose_images_phase = pungi.phases.WeaverPhase(compose, compose_images_schema)
-    extra_phase_schema = (
-        (compose_images_phase, post_image_phase),
-        osbs_phase,
-        repoclosure_phase,
-    )
-    extra_phase = pungi.phases.WeaverPhase(compose, extra_phase_schema)
-
-    extra_phase.start()
-    extra_phase.stop()
+    for phase in image_phases:
+        scheduler.add_phase(phase, deps=all_metadata_tasks)
+    images_done = [createiso_phase.name] + [phase.name for phase in image_phases]
+    scheduler.add_phase(image_checksum_phase, deps=images_done)
+    scheduler.add_phase(image_container_phase, deps=images_done)
+    scheduler.add_phase(osbs_phase, deps=all_metadata_tasks)
+
+    scheduler.run()
 
     pungi.metadata.write_compose_info(compose)
     if not (
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Timeline of a compose in Chrome trace-event format.
+
+When tracing is started, spans are recorded for every phase, every item
+processed by a :class:`kobo.threads.WorkerThread` and every command executed
+by :func:`kobo.shortcuts.run`. The resulting file can be opened in Perfetto or
+chrome://tracing to see what ran when and in which thread.
+
+Nothing is recorded unless :func:`start_tracing` is called. The first call
+replaces the kobo functions with wrappers, which stay in place until the
+process exits. Modules can keep references to the wrappers, so when tracing
+is not active they only call the original functions.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+import kobo.shortcuts
+import kobo.threads
+import six
+
+
+_tracer = None
+_context = threading.local()
+
+# Original functions replaced by the wrappers.
+_originals = {}
+_hooks_lock = threading.Lock()
+
+
+class Tracer(object):
+    """Collection of recorded spans. Safe to use from multiple threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.events = []
+        self._threads = {}
+
+    def now(self):
+        """Current time in microseconds."""
+        return int(time.time() * 1000000)
+
+    def add_span(self, name, category, start, end=None, **args):
+        """Record a span that started at given time in current thread."""
+        end = self.now() if end is None else end
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start,
+            "dur": max(0, end - start),
+            "pid": self.pid,
+            "tid": thread.ident,
+            "args": dict((k, v) for k, v in args.items() if v is not None),
+        }
+        with self.lock:
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def get_trace(self):
+        """Return the trace as a dict serializable to JSON."""
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in sorted(threads.items())
+        ]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.get_trace(), f)
+
+
+def get_tracer():
+    """Return the active tracer or None if tracing is not enabled."""
+    return _tracer
+
+
+def get_context():
+    """Return attributes (e.g. phase) describing the work done by current
+    thread.
+    """
+    return getattr(_context, "attrs", {})
+
+
+def set_context(**attrs):
+    """Replace attributes describing the work done by current thread. Threads
+    started by kobo thread pools inherit them.
+    """
+    _context.attrs = dict((k, v) for k, v in attrs.items() if v is not None)
+
+
+def begin():
+    """Return start time of a new span, or None if tracing is disabled."""
+    tracer = _tracer
+    return tracer.now() if tracer else None
+
+
+def end(start, name, category, **args):
+    """Record a span started by :func:`begin`."""
+    tracer = _tracer
+    if tracer and start is not None:
+        attrs = dict(get_context())
+        attrs.update(args)
+        tracer.add_span(name, category, start, **attrs)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """Record a span covering the body of the with statement."""
+    start = begin()
+    try:
+        yield
+    finally:
+        end(start, name, category, **args)
+
+
+def _describe_item(item):
+    """Find variant and arch in an item processed by a worker thread."""
+    args = {"item": repr(item)[:200]}
+    parts = item if isinstance(item, (tuple, list)) else [item]
+    for part in parts:
+        if hasattr(part, "uid") and hasattr(part, "arches"):
+            args["variant"] = part.uid
+            arches = set(part.arches) | set(["src", "global"])
+            for other in parts:
+                if isinstance(other, six.string_types) and other in arches:
+                    args["arch"] = other
+            break
+    return args
+
+
+def _thread_start(self, *args, **kwargs):
+    # Called in the thread starting the pool, which usually runs a phase.
+    if _tracer:
+        self._trace_context = dict(get_context())
+    return _originals["start"](self, *args, **kwargs)
+
+
+def _thread_run(self):
+    if not _tracer:
+        return _originals["run"](self)
+    set_context(**getattr(self, "_trace_context", {}))
+    process = self.process
+
+    def _process(item, num):
+        start = begin()
+        try:
+            return process(item, num)
+        finally:
+            end(
+                start,
+                "%s.process" % type(self).__name__,
+                "worker",
+                **_describe_item(item)
+            )
+
+    self.process = _process
+    return _originals["run"](self)
+
+
+def _format_cmd(cmd):
+    if isinstance(cmd, (list, tuple)):
+        return " ".join(str(x) for x in cmd)
+    return str(cmd)
+
+
+def _run(cmd, *args, **kwargs):
+    start = begin()
+    if start is None:
+        return _originals["kobo_run"](cmd, *args, **kwargs)
+    try:
+        return _originals["kobo_run"](cmd, *args, **kwargs)
+    finally:
+        end(
+            start,
+            os.path.basename(_format_cmd(cmd).split(" ", 1)[0]),
+            "subprocess",
+            cmd=_format_cmd(cmd),
+            workdir=kwargs.get("workdir"),
+        )
+
+
+def _install_hooks():
+    """Replace kobo functions with the wrappers, only once per process."""
+    with _hooks_lock:
+        if _originals:
+            return
+        _originals["start"] = kobo.threads.WorkerThread.start
+        _originals["run"] = kobo.threads.WorkerThread.run
+        _originals["kobo_run"] = kobo.shortcuts.run
+        kobo.threads.WorkerThread.start = _thread_start
+        kobo.threads.WorkerThread.run = _thread_run
+        kobo.shortcuts.run = _run
+        # Modules imported run directly from kobo before tracing started.
+        for name, module in list(sys.modules.items()):
+            if not name.startswith("pungi") or module is None:
+                continue
+            if getattr(module, "run", None) is _originals["kobo_run"]:
+                module.run = _run
+
+
+def start_tracing():
+    """Start recording spans.
+
+    :rtype: Tracer
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+        _install_hooks()
+    return _tracer
+
+
+def stop_tracing(path=None):
+    """Stop recording spans and optionally write the trace to a file.
+
+    :returns: the tracer with recorded spans
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer and path:
+        tracer.dump(path)
+    return tracer
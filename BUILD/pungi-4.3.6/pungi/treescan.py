@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <https://gnu.org/licenses/>.
+
+
+"""
+Snapshots of directory trees.
+
+Several ISO related phases need to know all files in the same trees (e.g.
+the os/ tree is split into discs and then scanned again for graft points).
+Walking the trees is slow on network file systems, so the snapshots are
+shared via :class:`TreeScanner` available on the compose.
+"""
+
+import collections
+import os
+import threading
+
+from kobo.threads import run_in_threads
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2
+    from scandir import scandir
+
+
+TreeEntry = collections.namedtuple(
+    "TreeEntry", ["rel_path", "path", "size", "dev", "inode", "nlink"]
+)
+
+
+class TreeSnapshot(object):
+    """Files and directories found in a tree.
+
+    :ivar str topdir: absolute path to the scanned directory
+    :ivar files: list of :class:`TreeEntry` for all files, in the same order
+        as ``os.walk`` would find them
+    :ivar dirs: list of relative paths of all subdirectories
+    """
+
+    def __init__(self, topdir, files=None, dirs=None):
+        self.topdir = topdir
+        self.files = files or []
+        self.dirs = dirs or []
+        self._dir_set = None
+
+    def has_dir(self, rel_dir):
+        """Check if given subdirectory exists in the tree."""
+        if self._dir_set is None:
+            self._dir_set = set(self.dirs)
+        return rel_dir in self._dir_set
+
+    def subtree(self, rel_dir):
+        """Return snapshot of given subdirectory."""
+        prefix = rel_dir.rstrip("/") + "/"
+        return TreeSnapshot(
+            os.path.join(self.topdir, rel_dir.rstrip("/")),
+            [
+                entry._replace(rel_path=entry.rel_path[len(prefix) :])
+                for entry in self.files
+                if entry.rel_path.startswith(prefix)
+            ],
+            [
+                rel_path[len(prefix) :]
+                for rel_path in self.dirs
+                if rel_path.startswith(prefix)
+            ],
+        )
+
+
+def _stat(entry):
+    try:
+        return entry.stat()
+    except OSError:
+        # Broken symlink.
+        return entry.stat(follow_symlinks=False)
+
+
+def scan_tree(path):
+    """Scan the tree under given path. Like ``os.walk``, symlinks to
+    directories are not followed and unreadable directories are skipped.
+
+    :rtype: TreeSnapshot
+    """
+    snapshot = TreeSnapshot(os.path.abspath(path))
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            entries = list(scandir(os.path.join(snapshot.topdir, rel_dir)))
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                info = _stat(entry)
+                snapshot.files.append(
+                    TreeEntry(
+                        rel_path,
+                        entry.path,
+                        info.st_size,
+                        info.st_dev,
+                        info.st_ino,
+                        info.st_nlink,
+                    )
+                )
+            elif not entry.is_symlink():
+                subdirs.append(rel_path)
+        snapshot.dirs.extend(subdirs)
+        # Process subdirectories depth first in the listing order.
+        pending.extend(reversed(subdirs))
+    return snapshot
+
+
+def _list_subtree(topdir, rel_dir, dirs, files):
+    pending = [rel_dir]
+    while pending:
+        rel_dir = pending.pop()
+        subdirs = []
+        for entry in scandir(os.path.join(topdir, rel_dir)):
+            rel_path = os.path.join(rel_dir, entry.name)
+            # The type is usually known from the directory listing, no stat is
+            # needed. Symlinks to directories are reported as files.
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(rel_path)
+            else:
+                files.append(rel_path)
+        dirs.extend(subdirs)
+        pending.extend(reversed(subdirs))
+
+
+def list_tree(path, workers=1):
+    """List names of all files and directories under given path without
+    reading their metadata. Symlinks are listed as files and never followed.
+    Unlike :func:`scan_tree`, errors are not ignored.
+
+    Directories are listed before their content, so they can be created in
+    the listed order.
+
+    :param int workers: number of threads listing top-level subdirectories in
+        parallel
+    :returns: tuple of lists of relative paths of directories and files
+    """
+    dirs = []
+    files = []
+    subdirs = []
+    for entry in scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry.name)
+        else:
+            files.append(entry.name)
+
+    results = dict((subdir, ([], [])) for subdir in subdirs)
+
+    def _worker(thread, subdir, num):
+        _list_subtree(path, subdir, *results[subdir])
+
+    if workers > 1 and len(subdirs) > 1:
+        run_in_threads(_worker, subdirs, threads=min(workers, len(subdirs)))
+    else:
+        for subdir in subdirs:
+            _worker(None, subdir, 0)
+
+    for subdir in subdirs:
+        dirs.append(subdir)
+        dirs.extend(results[subdir][0])
+        files.extend(results[subdir][1])
+    return dirs, files
+
+
+class TreeScanner(object):
+    """Cache of tree snapshots shared by all phases of a compose.
+
+    A tree is scanned at most once. If a tree containing the requested path
+    was already scanned, the snapshot is derived from it without touching the
+    disk. Snapshots must be invalidated after writing into the trees.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._snapshots = {}
+        self._scan_locks = {}
+        self._generation = 0
+
+    def _find_cached(self, path):
+        if path in self._snapshots:
+            return self._snapshots[path]
+        parent = path
+        while True:
+            parent, name = os.path.split(parent)
+            if not name:
+                return None
+            snapshot = self._snapshots.get(parent)
+            if snapshot is not None:
+                rel_dir = os.path.relpath(path, parent)
+                if not snapshot.has_dir(rel_dir):
+                    return None
+                self._snapshots[path] = snapshot.subtree(rel_dir)
+                return self._snapshots[path]
+
+    def scan(self, path):
+        """Get snapshot of the tree under given path.
+
+        :rtype: TreeSnapshot
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            snapshot = self._find_cached(path)
+            if snapshot is not None:
+                return snapshot
+            scan_lock = self._scan_locks.setdefault(path, threading.Lock())
+
+        # Only one thread scans any given tree, others wait for the result.
+        with scan_lock:
+            with self.lock:
+                snapshot = self._find_cached(path)
+                generation = self._generation
+            if snapshot is not None:
+                return snapshot
+            snapshot = scan_tree(path)
+            with self.lock:
+                # Do not keep the snapshot if it was invalidated while the
+                # scan was running.
+                if generation == self._generation:
+                    self._snapshots[path] = snapshot
+            return snapshot
+
+    def invalidate(self, path=None):
+        """Forget snapshots of trees affected by changes in given path, or all
+        snapshots if no path is given.
+        """
+        with self.lock:
+            self._generation += 1
+            if path is None:
+                self._snapshots.clear()
+                return
+            path = os.path.abspath(path)
+            for cached in list(self._snapshots):
+                if (
+                    cached == path
+                    or cached.startswith(path + "/")
+                    or path.startswith(cached + "/")
+                ):
+                    del self._snapshots[cached]
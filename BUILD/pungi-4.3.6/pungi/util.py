@@ -14,13 +14,13 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 import argparse
+import collections
 import json
 import subprocess
 import os
 import shutil
 import string
 import sys
-import hashlib
 import errno
 import re
 import contextlib
@@ -32,9 +32,11 @@ from six.moves import urllib, range, shlex_quote
 
 import kobo.conf
 from kobo.shortcuts import run, force_list
-from kobo.threads import WorkerThread, ThreadPool
+from kobo.threads import WorkerThread, ThreadPool, run_in_threads
 from productmd.common import get_major_version
+from pungi.checksums import compute_checksums
 from pungi.module_util import Modulemd
+from pungi.treescan import list_tree
 
 # Patterns that match all names of debuginfo packages
 DEBUG_PATTERNS = ["*-debuginfo", "*-debuginfo-*", "*-debugsource"]
@@ -141,32 +143,16 @@ def _doCheckSum(path, hash, logger):
     """Generate a checksum hash from a provided path.
     Return a string of type:hash"""
 
-    # Try to figure out what hash we want to do
     try:
-        sum = hashlib.new(hash)
+        checksums = compute_checksums(path, [hash])
     except ValueError:
         logger.error("Invalid hash type: %s" % hash)
         return False
-
-    # Try to open the file, using binary flag.
-    try:
-        myfile = open(path, "rb")
     except IOError as e:
         logger.error("Could not open file %s: %s" % (path, e))
         return False
 
-    # Loop through the file reading chunks at a time as to not
-    # put the entire file in memory.  That would suck for DVDs
-    while True:
-        chunk = myfile.read(
-            8192
-        )  # magic number!  Taking suggestions for better blocksize
-        if not chunk:
-            break  # we're done with the file
-        sum.update(chunk)
-    myfile.close()
-
-    return "%s:%s" % (hash, sum.hexdigest())
+    return "%s:%s" % (hash, checksums[hash])
 
 
 def makedirs(path, mode=0o775):
@@ -635,11 +621,14 @@ def get_format_substs(compose, **kwargs):
     return substs
 
 
-def copy_all(src, dest):
+def copy_all(src, dest, workers=1, link_type="copy"):
     """
     Copy all files and directories within ``src`` to the ``dest`` directory.
 
-    This is equivalent to running ``cp -r src/* dest``.
+    This is equivalent to running ``cp -r src/* dest``. Files already
+    existing in ``dest`` are replaced. Symlinks to files directly in ``src``
+    are copied as symlinks, symlinks to directories and symlinks in
+    subdirectories are followed the same way :func:`shutil.copytree` does it.
 
     :param src:
         Source directory to copy from.
@@ -647,6 +636,18 @@ def copy_all(src, dest):
     :param dest:
         Destination directory to copy to.
 
+    :param workers:
+        Number of threads copying subdirectories in parallel.
+
+    :param link_type:
+        How to put the files into ``dest``. Any type supported by
+        :class:`pungi.linker.Linker` other than ``copy`` (e.g.
+        ``hardlink-or-copy`` or ``reflink-or-copy``) links the whole tree
+        with the linker: symlinks are never followed, files hardlinked to
+        each other in ``src`` stay hardlinked, and an existing file in
+        ``dest`` is only kept if it is the same as in ``src``, otherwise the
+        copying fails.
+
     :return:
         A list of relative paths to the files copied.
 
@@ -654,23 +655,56 @@ def copy_all(src, dest):
         >>> _copy_all('/tmp/src/', '/tmp/dest/')
         ['file1', 'dir1/file2', 'dir1/subdir/file3']
     """
-    contents = os.listdir(src)
-    if not contents:
+    if not os.listdir(src):
         raise RuntimeError("Source directory %s is empty." % src)
+    if link_type != "copy":
+        # The linker module itself depends on this one.
+        from pungi.linker import Linker
+
+        return Linker().link_tree(src, dest, link_type=link_type, workers=workers)
+
+    dirs, files = list_tree(src, workers=workers)
     makedirs(dest)
-    for item in contents:
-        source = os.path.join(src, item)
-        destination = os.path.join(dest, item)
-        if os.path.isdir(source):
-            shutil.copytree(source, destination)
-        else:
-            if os.path.islink(source):
+    for rel_dir in dirs:
+        makedirs(os.path.join(dest, rel_dir))
+
+    files_by_dir = collections.OrderedDict()
+    for rel_path in files:
+        files_by_dir.setdefault(os.path.dirname(rel_path), []).append(rel_path)
+    copied = {}
+
+    def _copy(thread, rel_dir, num):
+        copied[rel_dir] = []
+        for rel_path in files_by_dir[rel_dir]:
+            source = os.path.join(src, rel_path)
+            destination = os.path.join(dest, rel_path)
+            if os.path.lexists(destination) and not os.path.isdir(destination):
+                os.unlink(destination)
+            if os.path.isdir(source):
+                # A symlink to directory, copy its content.
+                shutil.copytree(source, destination)
+                copied[rel_dir].extend(
+                    os.path.join(rel_path, f) for f in recursive_file_list(destination)
+                )
+                continue
+            elif not rel_dir and os.path.islink(source):
                 # It's a symlink, we should preserve it instead of resolving.
                 os.symlink(os.readlink(source), destination)
             else:
                 shutil.copy2(source, destination)
+            copied[rel_dir].append(rel_path)
+
+    if workers > 1 and len(files_by_dir) > 1:
+        run_in_threads(
+            _copy, list(files_by_dir), threads=min(workers, len(files_by_dir))
+        )
+    else:
+        for rel_dir in files_by_dir:
+            _copy(None, rel_dir, 0)
 
-    return recursive_file_list(src)
+    for rel_dir in reversed(dirs):
+        shutil.copystat(os.path.join(src, rel_dir), os.path.join(dest, rel_dir))
+    return [rel_path for rel_dir in files_by_dir for rel_path in copied[rel_dir]]
 
 
 def move_all(src, dest, rm_src_dir=False):
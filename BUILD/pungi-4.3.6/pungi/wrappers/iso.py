@@ -14,13 +14,14 @@
 # along with this program; if not, see <https://gnu.org/licenses/>.
 
 
+import fnmatch
 import os
-from fnmatch import fnmatch
+import re
 import contextlib
 from six.moves import shlex_quote
 
-from kobo.shortcuts import force_list, relative_path, run
-from pungi import util
+from kobo.shortcuts import force_list, run
+from pungi import treescan, util
 
 
 def get_boot_options(arch, createfrom, efi=True, hfs_compat=True):
@@ -289,10 +290,13 @@ def get_volume_id(path):
     raise RuntimeError("Could not read Volume ID")
 
 
-def get_graft_points(compose_top_dir, paths, exclusive_paths=None, exclude=None):
+def get_graft_points(
+    compose_top_dir, paths, exclusive_paths=None, exclude=None, scanner=None
+):
     # path priority in ascending order (1st = lowest prio)
     # paths merge according to priority
     # exclusive paths override whole dirs
+    # trees are scanned via scanner (pungi.treescan.TreeScanner) if given
 
     result = {}
     exclude = exclude or []
@@ -302,11 +306,11 @@ def get_graft_points(compose_top_dir, paths, exclusive_paths=None, exclude=None)
         if isinstance(i, dict):
             tree = i
         else:
-            tree = _scan_tree(i)
+            tree = _scan_tree(i, scanner)
         result = _merge_trees(result, tree)
 
     for i in exclusive_paths:
-        tree = _scan_tree(i)
+        tree = _scan_tree(i, scanner)
         result = _merge_trees(result, tree, exclusive=True)
 
     # Resolve possible symlinks pointing outside of the compose top dir.
@@ -336,20 +340,15 @@ def _paths_from_list(root, paths):
     return result
 
 
-def _scan_tree(path):
-    path = os.path.abspath(path)
+def _scan_tree(path, scanner=None):
+    snapshot = scanner.scan(path) if scanner else treescan.scan_tree(path)
     result = {}
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            abspath = os.path.join(root, f)
-            relpath = relative_path(abspath, path.rstrip("/") + "/")
-            result[relpath] = abspath
-
-        # include empty dirs
-        if root != path:
-            abspath = os.path.join(root, "")
-            relpath = relative_path(abspath, path.rstrip("/") + "/")
-            result[relpath] = abspath
+    for entry in snapshot.files:
+        result[entry.rel_path] = entry.path
+
+    # include empty dirs
+    for rel_path in snapshot.dirs:
+        result[rel_path + "/"] = os.path.join(snapshot.topdir, rel_path, "")
 
     return result
 
@@ -357,20 +356,14 @@ def _scan_tree(path):
 def _merge_trees(tree1, tree2, exclusive=False):
     # tree2 has higher priority
     result = tree2.copy()
-    all_dirs = set(
-        [os.path.dirname(i).rstrip("/") for i in result if os.path.dirname(i) != ""]
-    )
+    if exclusive:
+        all_dirs = set(
+            [os.path.dirname(i).rstrip("/") for i in result if os.path.dirname(i) != ""]
+        )
 
     for i in tree1:
-        dn = os.path.dirname(i)
-        if exclusive:
-            match = False
-            for a in all_dirs:
-                if dn == a or dn.startswith("%s/" % a):
-                    match = True
-                    break
-            if match:
-                continue
+        if exclusive and _is_in_dirs(os.path.dirname(i), all_dirs):
+            continue
 
         if i in result:
             continue
@@ -379,40 +372,52 @@ def _merge_trees(tree1, tree2, exclusive=False):
     return result
 
 
+def _is_in_dirs(path, dirs):
+    """Check if the path or any of its parent directories is in given set."""
+    if path in dirs:
+        return True
+    idx = path.find("/")
+    while idx != -1:
+        if path[:idx] in dirs:
+            return True
+        idx = path.find("/", idx + 1)
+    return False
+
+
+def _compile_patterns(patterns):
+    """Return a regular expression matching any of given shell patterns, or
+    None if there are no patterns.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join("(?:%s)" % fnmatch.translate(p) for p in patterns))
+
+
 def write_graft_points(file_name, h, exclude=None):
-    exclude = exclude or []
+    exclude_re = _compile_patterns(exclude)
     result = {}
+    # All prefixes of directories that had something in them. Directories are
+    # processed after their content, so if a directory entry is not in here,
+    # the directory is empty.
+    seen_prefixes = set()
     seen_dirs = set()
     for i in sorted(h, reverse=True):
         dn = os.path.dirname(i)
 
-        if not i.endswith("/"):
+        if not i.endswith("/") or dn not in seen_prefixes:
             result[i] = h[i]
+
+        if dn not in seen_dirs:
             seen_dirs.add(dn)
-            continue
+            seen_prefixes.update(dn[:idx] for idx in range(len(dn) + 1))
 
-        found = False
-        for j in seen_dirs:
-            if j.startswith(dn):
-                found = True
-                break
-        if not found:
-            result[i] = h[i]
-        seen_dirs.add(dn)
-
-    f = open(file_name, "w")
-    for i in sorted(result, key=graft_point_sort_key):
-        # make sure all files required for boot come first,
-        # otherwise there may be problems with booting (large LBA address, etc.)
-        found = False
-        for excl in exclude:
-            if fnmatch(i, excl):
-                found = True
-                break
-        if found:
-            continue
-        f.write("%s=%s\n" % (i, h[i]))
-    f.close()
+    with open(file_name, "w") as f:
+        for i in sorted(result, key=graft_point_sort_key):
+            # make sure all files required for boot come first,
+            # otherwise there may be problems with booting (large LBA address, etc.)
+            if exclude_re and exclude_re.match(i):
+                continue
+            f.write("%s=%s\n" % (i, h[i]))
 
 
 def _is_rpm(path):
@@ -42,46 +42,61 @@ class KojiWrapper(object):
             self.profile = self.compose.conf["koji_profile"]
         except KeyError:
             raise RuntimeError("Koji profile must be configured")
+        pool = getattr(compose, "koji_sessions", None)
+        self.session_pool = pool if isinstance(pool, KojiSessionPool) else None
+        self._task_watcher = None
         with self.lock:
             self.koji_module = koji.get_profile_module(self.profile)
-            session_opts = {}
-            for key in (
-                "timeout",
-                "keepalive",
-                "max_retries",
-                "retry_interval",
-                "anon_retry",
-                "offline_retry",
-                "offline_retry_interval",
-                "debug",
-                "debug_xmlrpc",
-                "serverca",
-                "use_fast_upload",
-            ):
-                value = getattr(self.koji_module.config, key, None)
-                if value is not None:
-                    session_opts[key] = value
-            self.koji_proxy = koji.ClientSession(
-                self.koji_module.config.server, session_opts
-            )
+        if self.session_pool:
+            self.koji_proxy = self.session_pool.get_session(self)
+        else:
+            self.koji_proxy = self._create_session()
+
+    def _create_session(self):
+        session_opts = {}
+        for key in (
+            "timeout",
+            "keepalive",
+            "max_retries",
+            "retry_interval",
+            "anon_retry",
+            "offline_retry",
+            "offline_retry_interval",
+            "debug",
+            "debug_xmlrpc",
+            "serverca",
+            "use_fast_upload",
+        ):
+            value = getattr(self.koji_module.config, key, None)
+            if value is not None:
+                session_opts[key] = value
+        return koji.ClientSession(self.koji_module.config.server, session_opts)
+
+    def login(self):
+        """Authenticate to the hub. With a session pool, the pool logs in only
+        once and this thread gets a subsession of the authenticated session.
+        """
+        if self.session_pool:
+            self.koji_proxy = self.session_pool.login(self)
+        else:
+            self._login(self.koji_proxy)
 
     # This retry should be removed once https://pagure.io/koji/issue/3170 is
     # fixed and released.
     @util.retry(wait_on=(xmlrpclib.ProtocolError, koji.GenericError))
-    def login(self):
-        """Authenticate to the hub."""
+    def _login(self, session):
         auth_type = self.koji_module.config.authtype
         if auth_type == "ssl" or (
             os.path.isfile(os.path.expanduser(self.koji_module.config.cert))
             and auth_type is None
         ):
-            self.koji_proxy.ssl_login(
+            session.ssl_login(
                 os.path.expanduser(self.koji_module.config.cert),
                 os.path.expanduser(self.koji_module.config.ca),
                 os.path.expanduser(self.koji_module.config.serverca),
             )
         elif auth_type == "kerberos":
-            self.koji_proxy.gssapi_login(
+            session.gssapi_login(
                 getattr(self.koji_module.config, "principal", None),
                 getattr(self.koji_module.config, "keytab", None),
             )
@@ -501,40 +516,63 @@ class KojiWrapper(object):
         """Check if output indicates server offline."""
         return re.search("koji: ServerOffline:", output)
 
-    def _wait_for_task(self, task_id, logfile=None, max_retries=None):
-        """Tries to wait for a task to finish. On connection error it will
-        retry with `watch-task` command.
+    def get_task_watcher(self):
+        """Return watcher of tasks. With a session pool, the watcher is shared
+        by all wrappers of the compose using the same profile.
         """
-        cmd = self._get_cmd("watch-task", str(task_id))
-        attempt = 0
-
-        while True:
-            retcode, output = run(
-                cmd, can_fail=True, logfile=logfile, universal_newlines=True
-            )
+        if self.session_pool:
+            return self.session_pool.get_task_watcher(self)
+        with self.lock:
+            if self._task_watcher is None:
+                self._task_watcher = self._new_task_watcher(self._create_session())
+            return self._task_watcher
+
+    def _new_task_watcher(self, session):
+        return KojiTaskWatcher(
+            self,
+            session,
+            interval=getattr(self.koji_module.config, "poll_interval", 6),
+        )
 
-            if retcode == 0 or not (
-                self._has_connection_error(output) or self._has_offline_error(output)
-            ):
-                # Task finished for reason other than connection error
-                # or server offline error.
-                return retcode, output
+    def _get_task_failure(self, task_id):
+        """Return the reason why the task failed as reported by the hub."""
+        try:
+            self.koji_proxy.getTaskResult(task_id)
+        except koji.GenericError as exc:
+            return "%s\n" % str(exc).strip()
+        except (xmlrpclib.ProtocolError, IOError) as exc:
+            return "Failed to get result of task %d: %s\n" % (task_id, exc)
+        return ""
 
-            attempt += 1
-            if max_retries and attempt >= max_retries:
-                break
-            time.sleep(attempt * 10)
+    def _wait_for_task(self, task_id, logfile=None, max_retries=None):
+        """Wait for a task to finish. Hub errors are retried with increasing
+        delay, up to `max_retries` times in a row if given.
 
-        raise RuntimeError(
-            "Failed to wait for task %s. Too many connection errors." % task_id
-        )
+        :returns: tuple of return code (0 if the task finished successfully)
+            and a line describing the final state of the task
+        """
+        info = self.get_task_watcher().wait(task_id, max_retries=max_retries)
+        state = koji.TASK_STATES[info["state"]]
+        output = "%d %s: %s\n" % (task_id, info.get("method"), state.lower())
+        if state in ("FAILED", "CANCELED"):
+            output += self._get_task_failure(task_id)
+        if logfile:
+            with open(logfile, "a") as f:
+                f.write(output)
+        return 0 if state == "CLOSED" else 1, output
 
     def run_blocking_cmd(self, command, log_file=None, max_retries=None):
         """
         Run a blocking koji command. Returns a dict with output of the command,
         its exit code and parsed task id. This method will block until the
-        command finishes.
+        task finishes.
+
+        If the command would wait for the task, it is changed to exit right
+        after creating it and the task is waited for in this process.
         """
+        wait = isinstance(command, list) and "--wait" in command
+        if wait:
+            command = ["--nowait" if arg == "--wait" else arg for arg in command]
         with self.get_koji_cmd_env() as env:
             retcode, output = run(
                 command,
@@ -556,12 +594,14 @@ class KojiWrapper(object):
 
         self.save_task_id(task_id)
 
-        if retcode != 0 and (
-            self._has_connection_error(output) or self._has_offline_error(output)
+        if (retcode == 0 and wait) or (
+            retcode != 0
+            and (self._has_connection_error(output) or self._has_offline_error(output))
         ):
-            retcode, output = self._wait_for_task(
+            retcode, state = self._wait_for_task(
                 task_id, logfile=log_file, max_retries=max_retries
             )
+            output += state
 
         return {
             "retcode": retcode,
@@ -864,6 +904,263 @@ class KojiWrapper(object):
             pass
 
 
+class KojiSessionPool(object):
+    """Koji sessions shared by all :class:`KojiWrapper` instances of a compose.
+
+    Each thread gets its own anonymous session, which is not safe to share,
+    and keeps using it with its keep-alive connection to the hub.
+    Authentication happens once for the whole pool; threads that need it get
+    a subsession of the authenticated session instead of logging in again.
+    The subsession is kept separately, so the anonymous session of the thread
+    stays anonymous.
+
+    :param int max_calls: maximum number of hub requests in progress at the
+        same time, not limited if not given
+    """
+
+    def __init__(self, max_calls=None):
+        self.lock = threading.Lock()
+        self.max_calls = max_calls
+        self._semaphore = threading.BoundedSemaphore(max_calls) if max_calls else None
+        self._local = threading.local()
+        # Profile name -> authenticated session used to create subsessions.
+        self._logged_in = {}
+        # Profile name -> KojiTaskWatcher
+        self._task_watchers = {}
+
+    def _limit_calls(self, session):
+        if not self._semaphore:
+            return session
+        # Each HTTP request to the hub goes through this method of the
+        # session. Retries, waiting for an offline hub and renewing of an
+        # expired session happen around it, so they don't hold the permit.
+        send_call = session._sendCall
+
+        def _sendCall(*args, **kwargs):
+            with self._semaphore:
+                return send_call(*args, **kwargs)
+
+        session._sendCall = _sendCall
+        return session
+
+    def _sessions(self, name="sessions"):
+        if not hasattr(self._local, name):
+            setattr(self._local, name, {})
+        return getattr(self._local, name)
+
+    def new_session(self, koji_wrapper):
+        """Create an anonymous session not bound to current thread."""
+        return self._limit_calls(koji_wrapper._create_session())
+
+    def get_session(self, koji_wrapper):
+        """Return anonymous session of current thread for the wrapper's
+        profile.
+        """
+        sessions = self._sessions()
+        if koji_wrapper.profile not in sessions:
+            sessions[koji_wrapper.profile] = self.new_session(koji_wrapper)
+        return sessions[koji_wrapper.profile]
+
+    def get_task_watcher(self, koji_wrapper):
+        """Return watcher of tasks for the wrapper's profile, with its own
+        anonymous session.
+        """
+        with self.lock:
+            watcher = self._task_watchers.get(koji_wrapper.profile)
+            if watcher is None:
+                watcher = koji_wrapper._new_task_watcher(self.new_session(koji_wrapper))
+                self._task_watchers[koji_wrapper.profile] = watcher
+            return watcher
+
+    def _subsession(self, koji_wrapper):
+        """Create a subsession of the authenticated session, logging in if
+        there is no such session yet or if it expired. Must be called with
+        the lock held.
+        """
+        main = self._logged_in.get(koji_wrapper.profile)
+        if main is not None and main.logged_in:
+            try:
+                return main.subsession()
+            except koji.AuthExpired:
+                pass
+        main = self.new_session(koji_wrapper)
+        koji_wrapper._login(main)
+        self._logged_in[koji_wrapper.profile] = main
+        return main.subsession()
+
+    def login(self, koji_wrapper):
+        """Return an authenticated session for current thread. The session
+        returned by :meth:`get_session` is not changed.
+        """
+        sessions = self._sessions("auth_sessions")
+        session = sessions.get(koji_wrapper.profile)
+        if session is not None and session.logged_in:
+            return session
+        with self.lock:
+            session = self._limit_calls(self._subsession(koji_wrapper))
+        sessions[koji_wrapper.profile] = session
+        return session
+
+
+class TaskFuture(object):
+    """Result of waiting for a Koji task, set by :class:`KojiTaskWatcher`."""
+
+    def __init__(self, task_id, max_retries=None):
+        self.task_id = task_id
+        self.max_retries = max_retries
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._event.set()
+
+    def result(self):
+        """Block until the task finishes and return its info from the hub."""
+        # With a timeout the wait can be interrupted by signals.
+        while not self._event.wait(1):
+            pass
+        if self._exception:
+            raise self._exception
+        return self._result
+
+
+class KojiTaskWatcher(object):
+    """Wait for Koji tasks from a single thread in this process.
+
+    All watched tasks are checked with one multicall of ``getTaskInfo`` every
+    `interval` seconds. When the hub can not be reached, the delay doubles
+    with each failed attempt up to `max_interval`. The thread only runs while
+    there is something to watch, and closes connections of the session when
+    it exits.
+
+    :param KojiWrapper koji_wrapper: wrapper providing multicall helpers
+    :param session: Koji session used only by the watcher thread
+    """
+
+    def __init__(self, koji_wrapper, session, interval=6, max_interval=600):
+        self.koji_wrapper = koji_wrapper
+        self.session = session
+        self.interval = interval
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+        self._futures = {}
+        self._thread = None
+
+    def watch(self, task_id, max_retries=None):
+        """Start watching a task.
+
+        :param int max_retries: fail if the hub can not be reached this many
+            times in a row, no limit by default
+        :rtype: TaskFuture
+        """
+        future = TaskFuture(task_id, max_retries)
+        with self.lock:
+            self._futures.setdefault(task_id, []).append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="koji-task-watcher"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def wait(self, task_id, max_retries=None):
+        """Block until the task finishes and return its info."""
+        return self.watch(task_id, max_retries).result()
+
+    def _poll(self, task_ids):
+        return self.koji_wrapper.multicall_map(
+            self.session, self.session.getTaskInfo, list(task_ids)
+        )
+
+    def _resolve(self, task_ids, infos):
+        finished = []
+        with self.lock:
+            for task_id, info in zip(task_ids, infos):
+                if info is None:
+                    error = RuntimeError("Task %s does not exist" % task_id)
+                    for future in self._futures.pop(task_id):
+                        future.set_exception(error)
+                elif koji.TASK_STATES[info["state"]] in (
+                    "CLOSED",
+                    "CANCELED",
+                    "FAILED",
+                ):
+                    finished.extend(
+                        (future, info) for future in self._futures.pop(task_id)
+                    )
+        for future, info in finished:
+            future.set_result(info)
+
+    def _give_up(self, errors):
+        with self.lock:
+            for task_id in list(self._futures):
+                futures = self._futures[task_id]
+                for future in [f for f in futures if f.max_retries]:
+                    if errors >= future.max_retries:
+                        futures.remove(future)
+                        future.set_exception(
+                            RuntimeError(
+                                "Failed to wait for task %s. "
+                                "Too many connection errors." % task_id
+                            )
+                        )
+                if not futures:
+                    del self._futures[task_id]
+
+    def _stop_thread(self):
+        # Called with the lock held, so a new thread can not use the session
+        # yet.
+        self._thread = None
+        rsession = getattr(self.session, "rsession", None)
+        if rsession:
+            rsession.close()
+
+    def _fail_all(self, exception):
+        with self.lock:
+            futures = [f for pending in self._futures.values() for f in pending]
+            self._futures.clear()
+            self._stop_thread()
+        for future in futures:
+            future.set_exception(exception)
+
+    def _run(self):
+        try:
+            self._watch()
+        except Exception as exc:
+            # Nobody would wake up the waiting threads otherwise.
+            self._fail_all(exc)
+
+    def _watch(self):
+        errors = 0
+        while True:
+            with self.lock:
+                if not self._futures:
+                    self._stop_thread()
+                    return
+                task_ids = sorted(self._futures)
+            try:
+                infos = self._poll(task_ids)
+            except (koji.GenericError, xmlrpclib.ProtocolError, IOError, ValueError):
+                errors += 1
+                self._give_up(errors)
+                delay = min(self.interval * 2**errors, self.max_interval)
+            else:
+                errors = 0
+                self._resolve(task_ids, infos or [])
+                delay = self.interval
+            time.sleep(delay)
+
+
 def get_buildroot_rpms(compose, task_id):
     """Get build root RPMs - either from runroot or local"""
     result = []
@@ -27,6 +27,7 @@ import pungi.util
 from pungi.compose import get_compose_dir
 from pungi.linker import linker_pool
 from pungi.phases.pkgset.sources.source_koji import get_koji_event_raw
+from pungi.treescan import list_tree
 from pungi.util import find_old_compose, parse_koji_event, temp_dir
 from pungi.wrappers.kojiwrapper import KojiWrapper
 
@@ -233,12 +234,11 @@ def copy_part(global_config, linker, part):
 
 
 def hardlink_dir(linker, srcdir, dstdir):
-    for root, dirs, files in os.walk(srcdir):
-        root = os.path.relpath(root, srcdir)
-        for f in files:
-            src = os.path.normpath(os.path.join(srcdir, root, f))
-            dst = os.path.normpath(os.path.join(dstdir, root, f))
-            linker.queue_put((src, dst))
+    _, files = list_tree(srcdir)
+    for f in files:
+        src = os.path.normpath(os.path.join(srcdir, f))
+        dst = os.path.normpath(os.path.join(dstdir, f))
+        linker.queue_put((src, dst))
 
 
 def update_metadata(global_config, part):
@@ -34,6 +34,7 @@ import pungi.wrappers.createrepo
 from pungi.util import makedirs
 from pungi.compose_metadata.discinfo import write_discinfo as create_discinfo
 from pungi.wrappers import iso
+from pungi.checksums import get_checksum_engine
 from pungi.phases.image_checksum import make_checksums
 
 
@@ -476,13 +477,18 @@ class UnifiedISO(object):
         return base_name
 
     def update_checksums(self):
-        make_checksums(
-            self.compose_path,
-            self.get_image_manifest(),
-            self.conf.get("media_checksums", DEFAULT_CHECKSUMS),
-            self.conf.get("media_checksum_one_file", False),
-            self._get_base_filename,
-        )
+        engine = get_checksum_engine(self.conf)
+        try:
+            make_checksums(
+                self.compose_path,
+                self.get_image_manifest(),
+                self.conf.get("media_checksums", DEFAULT_CHECKSUMS),
+                self.conf.get("media_checksum_one_file", False),
+                self._get_base_filename,
+                engine=engine,
+            )
+        finally:
+            engine.close()
 
     def get_image_manifest(self):
         if not self.images:
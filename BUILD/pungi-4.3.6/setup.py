@@ -65,6 +65,6 @@ setup(
         "six",
         "dogpile.cache",
     ],
-    extras_require={':python_version=="2.7"': ["enum34", "lockfile"]},
+    extras_require={':python_version=="2.7"': ["enum34", "lockfile", "scandir"]},
     tests_require=["mock", "pytest", "pytest-cov"],
 )
@@ -19,6 +19,8 @@ except ImportError:
 from pungi.util import get_arch_variant_data
 from pungi import paths, checks
 from pungi.module_util import Modulemd
+from pungi.checksums import ChecksumEngine
+from pungi.treescan import TreeScanner
 
 
 class BaseTestCase(unittest.TestCase):
@@ -180,6 +182,8 @@ class DummyCompose(object):
         self.conf = load_config(PKGSET_REPOS, **config)
         checks.validate(self.conf, offline=True)
         self.paths = paths.Paths(self)
+        self.tree_scanner = TreeScanner()
+        self.checksum_engine = ChecksumEngine()
         self.has_comps = True
         self.variants = {
             "Server": MockVariant(
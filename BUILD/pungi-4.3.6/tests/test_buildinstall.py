@@ -1774,10 +1774,12 @@ class BuildinstallThreadTestCase(PungiTestCase):
                 mock.call(
                     os.path.join(buildinstall_topdir, "x86_64/Server/results"),
                     os.path.join(self.topdir, "work/x86_64/buildinstall/Server"),
+                    workers=10,
                 ),
                 mock.call(
                     os.path.join(buildinstall_topdir, "x86_64/Server/logs"),
                     os.path.join(self.topdir, "logs/x86_64/buildinstall-Server-logs"),
+                    workers=10,
                 ),
             ],
         )
@@ -1900,10 +1902,12 @@ class BuildinstallThreadTestCase(PungiTestCase):
                 mock.call(
                     "/tmp/old/1",
                     os.path.join(self.topdir, "work/x86_64/buildinstall/Server"),
+                    workers=10,
                 ),
                 mock.call(
                     "/tmp/old/2",
                     os.path.join(self.topdir, "logs/x86_64/buildinstall-Server-logs"),
+                    workers=10,
                 ),
             ],
         )
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+import mock
+
+from pungi import checksums
+from tests.helpers import PungiTestCase, touch
+
+
+class TestComputeChecksums(PungiTestCase):
+    def test_multiple_types_with_small_buffer(self):
+        path = os.path.join(self.topdir, "file")
+        content = b"x" * 1000 + b"y" * 24
+        touch(path, content)
+
+        self.assertEqual(
+            checksums.compute_checksums(path, ["md5", "sha256"], buffer_size=100),
+            {
+                "md5": hashlib.md5(content).hexdigest(),
+                "sha256": hashlib.sha256(content).hexdigest(),
+            },
+        )
+
+    def test_unknown_type(self):
+        path = os.path.join(self.topdir, "file")
+        touch(path)
+
+        with self.assertRaises(ValueError) as ctx:
+            checksums.compute_checksums(path, "foo")
+
+        self.assertIn("foo", str(ctx.exception))
+
+
+class TestChecksumEngine(PungiTestCase):
+    def setUp(self):
+        super(TestChecksumEngine, self).setUp()
+        self.path = os.path.join(self.topdir, "image.iso")
+        touch(self.path, "image")
+        self.sha256 = hashlib.sha256(b"image").hexdigest()
+
+    @mock.patch("pungi.checksums.compute_checksums", wraps=checksums.compute_checksums)
+    def test_hardlinks_read_once(self, compute):
+        link = os.path.join(self.topdir, "link.iso")
+        os.link(self.path, link)
+        engine = checksums.ChecksumEngine()
+
+        result = engine.checksum_files([self.path, link, self.path], ["sha256"])
+
+        self.assertEqual(
+            result, {self.path: {"sha256": self.sha256}, link: {"sha256": self.sha256}}
+        )
+        self.assertEqual(len(compute.call_args_list), 1)
+        self.assertEqual((engine.hits, engine.misses), (1, 1))
+
+    @mock.patch("pungi.checksums.compute_checksums", wraps=checksums.compute_checksums)
+    def test_only_missing_types_are_computed(self, compute):
+        engine = checksums.ChecksumEngine()
+        engine.checksum(self.path, "sha256")
+
+        result = engine.checksum(self.path, ["md5", "sha256"])
+
+        self.assertEqual(
+            result, {"md5": hashlib.md5(b"image").hexdigest(), "sha256": self.sha256}
+        )
+        self.assertEqual(
+            compute.call_args_list,
+            [mock.call(self.path, ["sha256"]), mock.call(self.path, ["md5"])],
+        )
+
+    def test_persistent_cache(self):
+        cache = checksums.ChecksumCache(os.path.join(self.topdir, "cache"))
+        checksums.ChecksumEngine(cache).checksum(self.path, ["sha256"])
+
+        with mock.patch("pungi.checksums.compute_checksums") as compute:
+            result = checksums.ChecksumEngine(cache).checksum(self.path, ["sha256"])
+
+        self.assertEqual(result, {"sha256": self.sha256})
+        self.assertEqual(compute.call_args_list, [])
+
+    def test_modified_file_is_read_again(self):
+        cache = checksums.ChecksumCache(os.path.join(self.topdir, "cache"))
+        checksums.ChecksumEngine(cache).checksum(self.path, ["sha256"])
+        touch(self.path, "new image")
+
+        result = checksums.ChecksumEngine(cache).checksum(self.path, ["sha256"])
+
+        self.assertEqual(result, {"sha256": hashlib.sha256(b"new image").hexdigest()})
+
+    @mock.patch("pungi.checksums.compute_checksums", wraps=checksums.compute_checksums)
+    def test_prefetch(self, compute):
+        engine = checksums.ChecksumEngine(workers=2)
+        engine.prefetch(self.path, ["sha256"])
+        engine.wait()
+
+        self.assertEqual(
+            engine.checksum(self.path, ["sha256"]), {"sha256": self.sha256}
+        )
+        self.assertEqual(compute.call_args_list, [mock.call(self.path, ["sha256"])])
+
+    def test_prefetch_failure_is_not_fatal(self):
+        logger = mock.Mock()
+        engine = checksums.ChecksumEngine(logger=logger)
+        engine.prefetch(os.path.join(self.topdir, "missing.iso"), ["sha256"])
+        engine.wait()
+
+        self.assertEqual(len(logger.log.call_args_list), 1)
+
+    def test_memory_is_bounded(self):
+        engine = checksums.ChecksumEngine(max_memo=2)
+        paths = []
+        for name in ("a", "b", "c"):
+            paths.append(os.path.join(self.topdir, name))
+            touch(paths[-1], name)
+            engine.checksum(paths[-1], ["sha256"])
+
+        self.assertEqual(
+            list(engine._memo), [checksums.get_file_key(p) for p in paths[1:]]
+        )
+        self.assertEqual(engine._key_locks, {})
+
+    def test_close_prunes_cache(self):
+        cache = mock.Mock()
+        cache.get.return_value = {}
+        engine = checksums.ChecksumEngine(cache)
+        engine.prefetch(self.path, ["sha256"])
+
+        engine.close()
+
+        self.assertIsNone(engine._prefetch_pool)
+        self.assertEqual(cache.prune.call_args_list, [mock.call()])
+
+
+class TestChecksumCache(PungiTestCase):
+    def setUp(self):
+        super(TestChecksumCache, self).setUp()
+        self.cache_dir = os.path.join(self.topdir, "cache")
+
+    def test_prune_least_recently_used(self):
+        cache = checksums.ChecksumCache(self.cache_dir, max_size=70)
+        for num in range(3):
+            cache.update((num,), {"sha256": "x" * 20})
+            os.utime(cache._path((num,)), (num, num))
+        # Using an entry makes it the most recently used one.
+        cache.get((0,))
+
+        cache.prune()
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["0.json", "2.json"])
+
+    def test_no_limit(self):
+        cache = checksums.ChecksumCache(self.cache_dir)
+        for num in range(3):
+            cache.update((num,), {"sha256": "x" * 20})
+
+        cache.prune()
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+    def test_get_checksum_engine(self):
+        engine = checksums.get_checksum_engine(
+            {
+                "media_checksum_cache_dir": self.cache_dir,
+                "media_checksum_cache_size": "1k",
+            }
+        )
+
+        self.assertEqual(engine.cache.max_size, 1024)
+        self.assertEqual(
+            engine.cache.topdir, os.path.join(self.cache_dir, str(os.getuid()))
+        )
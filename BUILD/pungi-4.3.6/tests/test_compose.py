@@ -13,7 +13,9 @@ import tempfile
 import shutil
 import json
 
-from pungi.compose import Compose
+from productmd.images import Image
+
+from pungi.compose import Compose, ComposeImages
 
 
 class ConfigWrapper(dict):
@@ -807,3 +809,19 @@ class TracebackTest(unittest.TestCase):
     def test_with_detail(self):
         self.compose.traceback("extra-info")
         self.assertTraceback("traceback-extra-info")
+
+
+class ComposeImagesTest(unittest.TestCase):
+    def test_notifies_listeners(self):
+        im = ComposeImages()
+        listener = mock.Mock()
+        im.add_listener(listener)
+        image = Image(im)
+        image.path = "Server/x86_64/iso/image.iso"
+
+        im.add("Server", "x86_64", image)
+
+        self.assertEqual(
+            listener.call_args_list, [mock.call("Server", "x86_64", image)]
+        )
+        self.assertEqual(im.images, {"Server": {"x86_64": set([image])}})
@@ -6,6 +6,10 @@ import mock
 import six
 
 import os
+import threading
+import time
+
+import productmd.rpms
 
 from tests import helpers
 from pungi.createiso import CreateIsoOpts
@@ -58,6 +62,119 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
             ],
         )
 
+    @mock.patch("pungi.phases.createiso.CreateIsoThread")
+    @mock.patch("pungi.createiso.write_script")
+    @mock.patch("pungi.phases.createiso.prepare_iso")
+    @mock.patch("pungi.phases.createiso.split_iso")
+    @mock.patch("pungi.phases.createiso.ThreadPool")
+    def test_run_part(
+        self, ThreadPool, split_iso, prepare_iso, write_script, CreateIsoThread
+    ):
+        compose = helpers.DummyCompose(
+            self.topdir,
+            {"release_short": "test", "release_version": "1.0", "createiso_skip": []},
+        )
+        server = compose.variants["Server"]
+        helpers.touch(
+            os.path.join(compose.paths.compose.os_tree("x86_64", server), "dummy.rpm")
+        )
+        split_iso.return_value = [{"files": [], "size": 1024}]
+        prepare_iso.return_value = "dummy-graft-points"
+
+        phase = createiso.CreateisoPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
+        self.assertIn((server, "x86_64"), phase.get_parts())
+        compose.just_phases = []
+        compose.skip_phases = []
+        compose.notifier = mock.Mock()
+        pool = ThreadPool.return_value
+        # Finish each image as soon as it is queued.
+        pool.queue_put.side_effect = lambda item: item[4].done()
+        phase.start(split=True)
+        phase.run_part(server, "x86_64")
+        # There are no packages for source image.
+        phase.run_part(server, "src")
+
+        pool.start.assert_called_once_with()
+        self.assertEqual(len(pool.queue_put.call_args_list), 1)
+        ((_, cmd, variant, arch, _),) = pool.queue_put.call_args[0]
+        self.assertEqual(
+            cmd["iso_path"], "%s/compose/Server/x86_64/iso/image-name" % self.topdir
+        )
+        self.assertEqual((variant, arch), (server, "x86_64"))
+        self.assertEqual(
+            pool.add.call_args_list, [mock.call(CreateIsoThread.return_value)]
+        )
+        CreateIsoThread.return_value.start.assert_called_once_with()
+        self.assertIn(
+            mock.call("createiso-targets", deliverables=[cmd["iso_path"]]),
+            compose.notifier.send.call_args_list,
+        )
+        self.assertEqual(phase.iso_names, ["image-name"])
+
+    @mock.patch("pungi.phases.createiso.add_iso_to_metadata")
+    @mock.patch("pungi.phases.createiso.run_createiso_command")
+    def test_parts_share_write_slots(self, run_createiso_command, add_iso_to_metadata):
+        compose = helpers.DummyCompose(self.topdir, {"createiso_max_writes_per_fs": 1})
+        compose.just_phases = []
+        compose.skip_phases = []
+        compose.notifier = mock.Mock()
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def write(num, compose, bootable, arch, cmd, mounts, log_file):
+            with lock:
+                active.append(cmd)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(cmd)
+
+        run_createiso_command.side_effect = write
+
+        def prepare_images(variant, arch, deliverables):
+            commands = []
+            for num in (1, 2):
+                name = "%s-%s-%d.iso" % (variant.uid, arch, num)
+                cmd = {
+                    "iso_path": os.path.join(self.topdir, "iso", name),
+                    "bootable": False,
+                    "cmd": name,
+                    "disc_num": num,
+                    "disc_count": 2,
+                }
+                commands.append((name, num, (cmd, variant, arch)))
+            return commands
+
+        # Log into mocks only, the workers log through the pool.
+        compose._logger.handlers = []
+        phase = createiso.CreateisoPhase(compose, mock.Mock())
+        phase._prepare_images = prepare_images
+        phase.start(split=True)
+        parts = [
+            threading.Thread(target=phase.run_part, args=(variant, "x86_64"))
+            for variant in (compose.variants["Server"], compose.variants["Client"])
+        ]
+        for t in parts:
+            t.start()
+        for t in parts:
+            t.join()
+        phase.stop()
+
+        self.assertEqual(len(run_createiso_command.call_args_list), 4)
+        self.assertEqual(max(peak), 1)
+        six.assertCountEqual(
+            self,
+            compose.iso_write_scheduler.started,
+            [
+                "Server-x86_64-1.iso",
+                "Server-x86_64-2.iso",
+                "Client-x86_64-1.iso",
+                "Client-x86_64-2.iso",
+            ],
+        )
+
     @mock.patch("pungi.createiso.write_script")
     @mock.patch("pungi.phases.createiso.prepare_iso")
     @mock.patch("pungi.phases.createiso.split_iso")
@@ -73,7 +190,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                 "dummy.rpm",
             )
         )
-        disc_data = mock.Mock()
+        disc_data = {"files": [], "size": 1024}
         split_iso.return_value = [disc_data]
         prepare_iso.return_value = "dummy-graft-points"
 
@@ -105,6 +222,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                     compose.variants["Server"],
                     no_split=False,
                     logger=phase.logger,
+                    rpm_manifest=None,
                 )
             ],
         )
@@ -154,6 +272,77 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
             ],
         )
 
+    @mock.patch("pungi.createiso.write_script")
+    @mock.patch("pungi.phases.createiso.prepare_iso")
+    @mock.patch("pungi.phases.createiso.split_iso")
+    @mock.patch("pungi.phases.createiso.load_rpm_manifest")
+    @mock.patch("pungi.phases.createiso.ThreadPool")
+    def test_bin_packing_loads_manifest_once(
+        self, ThreadPool, load_rpm_manifest, split_iso, prepare_iso, write_script
+    ):
+        compose = helpers.DummyCompose(
+            self.topdir,
+            {
+                "release_short": "test",
+                "release_version": "1.0",
+                "createiso_skip": [],
+                "split_iso_method": "bin-packing",
+            },
+        )
+        for arch in ("x86_64", "src"):
+            helpers.touch(
+                os.path.join(
+                    compose.paths.compose.os_tree(arch, compose.variants["Server"]),
+                    "dummy.rpm",
+                )
+            )
+        split_iso.return_value = [{"files": [], "size": 1024}]
+        prepare_iso.return_value = "dummy-graft-points"
+
+        phase = createiso.CreateisoPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
+        phase.run()
+
+        self.assertEqual(load_rpm_manifest.call_args_list, [mock.call(compose)])
+        self.assertEqual(
+            [c[1]["rpm_manifest"] for c in split_iso.call_args_list],
+            [load_rpm_manifest.return_value] * 2,
+        )
+
+    @mock.patch("pungi.createiso.write_script")
+    @mock.patch("pungi.phases.createiso.prepare_iso")
+    @mock.patch("pungi.phases.createiso.split_iso")
+    @mock.patch("pungi.phases.createiso.ThreadPool")
+    def test_queues_biggest_first(
+        self, ThreadPool, split_iso, prepare_iso, write_script
+    ):
+        compose = helpers.DummyCompose(
+            self.topdir,
+            {"release_short": "test", "release_version": "1.0", "createiso_skip": []},
+        )
+        for arch in ("x86_64", "src"):
+            helpers.touch(
+                os.path.join(
+                    compose.paths.compose.os_tree(arch, compose.variants["Server"]),
+                    "dummy.rpm",
+                )
+            )
+        sizes = {"x86_64": 10, "src": 20}
+        split_iso.side_effect = lambda c, arch, *args, **kwargs: [
+            {"files": [], "size": sizes[arch]}
+        ]
+        prepare_iso.return_value = "dummy-graft-points"
+
+        phase = createiso.CreateisoPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
+        phase.run()
+
+        self.assertEqual(
+            [c[0][0][3] for c in ThreadPool.return_value.queue_put.call_args_list],
+            ["src", "x86_64"],
+        )
+        self.assertEqual(phase.scheduler.planned, ["image-name", "image-name"])
+
     @mock.patch("pungi.createiso.write_script")
     @mock.patch("pungi.phases.createiso.prepare_iso")
     @mock.patch("pungi.phases.createiso.split_iso")
@@ -181,7 +370,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                 "dummy.rpm",
             )
         )
-        disc_data = mock.Mock()
+        disc_data = {"files": [], "size": 1024}
         split_iso.return_value = [disc_data]
         prepare_iso.return_value = "dummy-graft-points"
 
@@ -223,6 +412,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                     compose.variants["Server"],
                     no_split=True,
                     logger=phase.logger,
+                    rpm_manifest=None,
                 ),
                 mock.call(
                     compose,
@@ -230,6 +420,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                     compose.variants["Server"],
                     no_split=False,
                     logger=phase.logger,
+                    rpm_manifest=None,
                 ),
             ],
         )
@@ -347,7 +538,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                 "dummy.rpm",
             )
         )
-        disc_data = mock.Mock()
+        disc_data = {"files": [], "size": 1024}
         split_iso.return_value = [disc_data]
         prepare_iso.return_value = "dummy-graft-points"
 
@@ -381,6 +572,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                     compose.variants["Server"],
                     no_split=False,
                     logger=phase.logger,
+                    rpm_manifest=None,
                 )
             ],
         )
@@ -455,7 +647,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                 "dummy.rpm",
             )
         )
-        disc_data = mock.Mock()
+        disc_data = {"files": [], "size": 1024}
         split_iso.return_value = [disc_data]
         prepare_iso.return_value = "dummy-graft-points"
 
@@ -490,6 +682,7 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
                     compose.variants["Server"],
                     no_split=False,
                     logger=phase.logger,
+                    rpm_manifest=None,
                 )
             ],
         )
@@ -539,7 +732,172 @@ class CreateisoPhaseTest(helpers.PungiTestCase):
         )
 
 
+class IsoWriteSchedulerTest(helpers.PungiTestCase):
+    def test_plan_largest_first(self):
+        scheduler = createiso.IsoWriteScheduler(logger=mock.Mock())
+
+        jobs = scheduler.plan(
+            [("small.iso", 10, "small"), ("big.iso", 30, "big"), ("mid.iso", 20, "mid")]
+        )
+
+        self.assertEqual(jobs, ["big", "mid", "small"])
+        self.assertEqual(scheduler.planned, ["big.iso", "mid.iso", "small.iso"])
+
+    def test_limits_writes_per_filesystem(self):
+        scheduler = createiso.IsoWriteScheduler(max_writes=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def write(num):
+            path = os.path.join(self.topdir, "iso", "%d.iso" % num)
+            with scheduler.writing(path):
+                with lock:
+                    active.append(num)
+                    peak.append(len(active))
+                time.sleep(0.01)
+                with lock:
+                    active.remove(num)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(
+            sorted(scheduler.started), sorted("%d.iso" % i for i in range(6))
+        )
+
+    def test_waiting_writes_start_from_biggest(self):
+        scheduler = createiso.IsoWriteScheduler(max_writes=1)
+        scheduler.plan(
+            [
+                ("first.iso", 1, None),
+                ("small.iso", 10, None),
+                ("big.iso", 30, None),
+                ("mid.iso", 20, None),
+            ]
+        )
+        path = os.path.join(self.topdir, "iso")
+        helpers.touch(os.path.join(path, "first.iso"))
+        slots = scheduler._get_slots(os.path.join(path, "first.iso"))
+
+        def write(name):
+            with scheduler.writing(os.path.join(path, name)):
+                pass
+
+        threads = []
+        with scheduler.writing(os.path.join(path, "first.iso")):
+            for name in ("small.iso", "big.iso", "mid.iso"):
+                threads.append(threading.Thread(target=write, args=(name,)))
+                threads[-1].start()
+            while len(slots.waiting) < 3:
+                time.sleep(0.01)
+        for t in threads:
+            t.join()
+
+        self.assertEqual(
+            scheduler.started, ["first.iso", "big.iso", "mid.iso", "small.iso"]
+        )
+
+    def test_shared_by_compose(self):
+        compose = helpers.DummyCompose(self.topdir, {"createiso_max_writes_per_fs": 2})
+
+        scheduler = createiso.get_iso_write_scheduler(compose)
+
+        self.assertEqual(scheduler.max_writes, 2)
+        self.assertIs(createiso.get_iso_write_scheduler(compose), scheduler)
+
+    def test_report_only_given_images(self):
+        logger = mock.Mock()
+        scheduler = createiso.IsoWriteScheduler()
+        for name in ("a.iso", "b.iso", "c.iso"):
+            with scheduler.writing(os.path.join(self.topdir, name)):
+                pass
+
+        scheduler.report(["c.iso", "a.iso"], logger)
+
+        self.assertEqual(
+            logger.info.call_args_list,
+            [mock.call("Actual order of ISO images:\n%s", "  1. a.iso\n  2. c.iso")],
+        )
+
+
 class CreateisoThreadTest(helpers.PungiTestCase):
+    @mock.patch("pungi.phases.createiso.add_iso_to_metadata")
+    @mock.patch("pungi.phases.createiso.run_createiso_command")
+    def test_writes_reuse_key(self, run_createiso_command, add_iso_to_metadata):
+        compose = helpers.DummyCompose(self.topdir, {})
+        iso_path = os.path.join(self.topdir, "compose/Server/x86_64/iso/image.iso")
+        helpers.touch(iso_path)
+        cmd = {
+            "iso_path": iso_path,
+            "bootable": False,
+            "cmd": mock.Mock(),
+            "disc_num": 1,
+            "disc_count": 1,
+        }
+        phase = mock.Mock()
+        phase.reuse_image.return_value = False
+
+        t = createiso.CreateIsoThread(mock.Mock(), phase=phase)
+        t.process((compose, cmd, compose.variants["Server"], "x86_64"), 1)
+
+        self.assertEqual(len(run_createiso_command.call_args_list), 1)
+        self.assertEqual(
+            phase.mock_calls,
+            [
+                mock.call.reuse_image(cmd, compose.variants["Server"], "x86_64"),
+                mock.call.save_reuse_key(cmd, compose.variants["Server"], "x86_64"),
+            ],
+        )
+
+    @mock.patch("pungi.phases.createiso.add_iso_to_metadata")
+    @mock.patch("pungi.phases.createiso.run_createiso_command")
+    def test_reused_image_is_not_created(
+        self, run_createiso_command, add_iso_to_metadata
+    ):
+        compose = helpers.DummyCompose(self.topdir, {})
+        cmd = {
+            "iso_path": os.path.join(self.topdir, "image.iso"),
+            "bootable": False,
+            "cmd": mock.Mock(),
+            "disc_num": 1,
+            "disc_count": 1,
+        }
+        phase = mock.Mock()
+        phase.reuse_image.return_value = True
+
+        t = createiso.CreateIsoThread(mock.Mock(), phase=phase)
+        t.process((compose, cmd, compose.variants["Server"], "x86_64"), 1)
+
+        self.assertEqual(run_createiso_command.call_args_list, [])
+        self.assertEqual(add_iso_to_metadata.call_args_list, [])
+        self.assertEqual(phase.save_reuse_key.call_args_list, [])
+
+    @mock.patch("pungi.phases.createiso.run_createiso_command")
+    def test_failure_is_reported_to_part(self, run_createiso_command):
+        compose = helpers.DummyCompose(self.topdir, {})
+        compose.notifier = None
+        cmd = {
+            "iso_path": os.path.join(self.topdir, "image.iso"),
+            "bootable": False,
+            "cmd": mock.Mock(),
+            "disc_num": 1,
+            "disc_count": 1,
+        }
+        run_createiso_command.side_effect = RuntimeError("Boom")
+        part = createiso._PartJobs(1)
+
+        t = createiso.CreateIsoThread(mock.Mock(), phase=None)
+        t.process((compose, cmd, compose.variants["Server"], "x86_64", part), 1)
+
+        with self.assertRaises(RuntimeError) as ctx:
+            part.wait()
+        self.assertEqual(str(ctx.exception), "Boom")
+
     @mock.patch("pungi.phases.createiso.iso")
     @mock.patch("pungi.phases.createiso.get_mtime")
     @mock.patch("pungi.phases.createiso.get_file_size")
@@ -1032,20 +1390,29 @@ type = variant
 
 class DummySize(object):
     """
-    This is intended as a replacement for os.path.getsize that returns
-    predefined sizes. The argument to __init__ should be a mapping from
-    substring of filepath to size.
+    This is intended as a replacement for stat of files found by tree scanner
+    that returns predefined sizes. The argument to __init__ should be a
+    mapping from substring of filepath to size.
     """
 
     def __init__(self, sizes):
         self.sizes = sizes
 
-    def __call__(self, path):
+    def get_size(self, path):
         for fragment, size in self.sizes.items():
             if fragment in path:
                 return size
         return 0
 
+    def __call__(self, entry):
+        info = os.stat(entry.path)
+        return mock.Mock(
+            st_size=self.get_size(entry.path),
+            st_dev=info.st_dev,
+            st_ino=info.st_ino,
+            st_nlink=info.st_nlink,
+        )
+
 
 class SplitIsoTest(helpers.PungiTestCase):
     def test_split_fits_on_single_disc(self):
@@ -1066,7 +1433,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         )
 
         with mock.patch(
-            "os.path.getsize",
+            "pungi.treescan._stat",
             DummySize(
                 {
                     "GPL": 20 * 2048,
@@ -1117,7 +1484,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         G = 1024**3
 
         with mock.patch(
-            "os.path.getsize",
+            "pungi.treescan._stat",
             DummySize(
                 {"GPL": 20 * M, "bash": 3 * G, "media": 2 * G, "treeinfo": 10 * M}
             ),
@@ -1148,6 +1515,81 @@ class SplitIsoTest(helpers.PungiTestCase):
             ],
         )
 
+    def test_split_bin_packing_keeps_source_packages_together(self):
+        compose = helpers.DummyCompose(self.topdir, {"split_iso_method": "bin-packing"})
+        base_path = os.path.join(self.topdir, "compose/Server/x86_64/os")
+        helpers.touch(os.path.join(base_path, ".treeinfo"), TREEINFO)
+        helpers.touch(os.path.join(self.topdir, "work/x86_64/Server/extra-files/GPL"))
+        helpers.touch(os.path.join(base_path, "GPL"))
+        helpers.touch(os.path.join(base_path, "n/media.repo"))
+        manifest = productmd.rpms.Rpms()
+        manifest.compose.id = compose.compose_id
+        manifest.compose.type = "test"
+        manifest.compose.date = "20151203"
+        manifest.compose.respin = 0
+        for name, srpm in [
+            ("bash", "bash"),
+            ("bash-doc", "bash"),
+            ("zsh", "zsh"),
+        ]:
+            rel_path = "Packages/%s/%s-1.0-1.x86_64.rpm" % (name[0], name)
+            helpers.touch(os.path.join(base_path, rel_path))
+            manifest.add(
+                "Server",
+                "x86_64",
+                "%s-0:1.0-1.x86_64" % name,
+                path="Server/x86_64/os/" + rel_path,
+                sigkey=None,
+                category="binary",
+                srpm_nevra="%s-0:1.0-1.src" % srpm,
+            )
+        manifest.dump(compose.paths.compose.metadata("rpms.json"))
+
+        M = 1024**2
+        G = 1024**3
+
+        with mock.patch(
+            "pungi.treescan._stat",
+            DummySize(
+                {
+                    "GPL": 20 * M,
+                    "bash-1": 2 * G,
+                    "bash-doc": 1 * G,
+                    "zsh": 2 * G + 512 * M,
+                    "media": 100 * M,
+                    "treeinfo": 10 * M,
+                }
+            ),
+        ):
+            data = createiso.split_iso(compose, "x86_64", compose.variants["Server"])
+
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]["files"][0], os.path.join(base_path, "GPL"))
+        self.assertEqual(
+            sorted(data[0]["files"]),
+            sorted(
+                os.path.join(base_path, f)
+                for f in [
+                    "GPL",
+                    "Packages/b/bash-1.0-1.x86_64.rpm",
+                    "Packages/b/bash-doc-1.0-1.x86_64.rpm",
+                ]
+            ),
+        )
+        self.assertEqual(data[1]["files"][0], os.path.join(base_path, "GPL"))
+        self.assertEqual(
+            sorted(data[1]["files"]),
+            sorted(
+                os.path.join(base_path, f)
+                for f in [
+                    "GPL",
+                    ".treeinfo",
+                    "n/media.repo",
+                    "Packages/z/zsh-1.0-1.x86_64.rpm",
+                ]
+            ),
+        )
+
     def test_no_split_when_requested(self):
         compose = helpers.DummyCompose(self.topdir, {})
         helpers.touch(
@@ -1169,7 +1611,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         G = 1024**3
 
         with mock.patch(
-            "os.path.getsize",
+            "pungi.treescan._stat",
             DummySize(
                 {"GPL": 20 * M, "bash": 3 * G, "media": 2 * G, "treeinfo": 10 * M}
             ),
@@ -1223,7 +1665,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         # reserve the padding package should be on second disk
 
         with mock.patch(
-            "os.path.getsize", DummySize({"spacer": 4688465664, "pad": 5 * M})
+            "pungi.treescan._stat", DummySize({"spacer": 4688465664, "pad": 5 * M})
         ):
             data = createiso.split_iso(compose, "x86_64", compose.variants["Server"])
 
@@ -1255,7 +1697,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         M = 1024**2
 
         with mock.patch(
-            "os.path.getsize", DummySize({"spacer": 4688465664, "pad": 5 * M})
+            "pungi.treescan._stat", DummySize({"spacer": 4688465664, "pad": 5 * M})
         ):
             data = createiso.split_iso(compose, "x86_64", compose.variants["Server"])
 
@@ -1276,7 +1718,7 @@ class SplitIsoTest(helpers.PungiTestCase):
         M = 1024**2
 
         with mock.patch(
-            "os.path.getsize", DummySize({"spacer": 4688465664, "pad": 5 * M})
+            "pungi.treescan._stat", DummySize({"spacer": 4688465664, "pad": 5 * M})
         ):
             data = createiso.split_iso(compose, "x86_64", compose.variants["Server"])
 
@@ -1319,6 +1761,23 @@ class BreakHardlinksTest(helpers.PungiTestCase):
         self.assertEqual(d, {"f": expected})
         self.assertTrue(os.path.exists(expected))
 
+    def test_copy_shared_between_links(self):
+        f = os.path.join(self.src, "file")
+        helpers.touch(f, "data")
+        g = os.path.join(self.src, "other")
+        os.link(f, g)
+
+        d = {"f": f, "g": g, "h": f}
+        createiso.break_hardlinks(d, self.stage)
+
+        self.assertEqual(
+            d, {"f": self.stage + f, "g": self.stage + g, "h": self.stage + f}
+        )
+        staged = os.stat(self.stage + f)
+        self.assertNotEqual(staged.st_ino, os.stat(f).st_ino)
+        self.assertEqual(staged.st_ino, os.stat(self.stage + g).st_ino)
+        self.assertEqual(staged.st_nlink, 2)
+
 
 class TweakTreeinfo(helpers.PungiTestCase):
     def test_tweaking(self):
@@ -1332,145 +1791,252 @@ class TweakTreeinfo(helpers.PungiTestCase):
         self.assertFilesEqual(output, expected)
 
 
-class CreateisoTryReusePhaseTest(helpers.PungiTestCase):
+class GetReuseKeyTest(helpers.PungiTestCase):
     def setUp(self):
-        super(CreateisoTryReusePhaseTest, self).setUp()
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.addHandler(logging.StreamHandler(os.devnull))
-
-    def test_disabled(self):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": False})
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
+        super(GetReuseKeyTest, self).setUp()
+        self.graft_points = os.path.join(self.topdir, "graft-points")
+        self.rpm = os.path.join(self.topdir, "os/Packages/f/foo-1-1.x86_64.rpm")
+        helpers.touch(self.rpm, "foo")
+        helpers.touch(self.graft_points, "Packages/f/foo.rpm=%s\n" % self.rpm)
+        self.opts = CreateIsoOpts(
+            graft_points=self.graft_points,
+            volid="volid",
+            arch="x86_64",
+            iso_name="image.iso",
+            output_dir=os.path.join(self.topdir, "iso"),
+        )
+
+    def test_paths_do_not_matter(self):
+        copy = os.path.join(self.topdir, "other/foo.rpm")
+        helpers.touch(copy, "foo")
+        nevras = {self.rpm: "foo-0:1-1.x86_64", copy: "foo-0:1-1.x86_64"}
+        key = createiso.get_reuse_key(self.opts, nevras)
+        graft_points = os.path.join(self.topdir, "other-graft-points")
+        helpers.touch(graft_points, "Packages/f/foo.rpm=%s\n" % copy)
 
-        self.assertFalse(phase.try_reuse(mock.Mock(), "Server", "x86_64", mock.Mock()))
+        self.assertEqual(
+            createiso.get_reuse_key(
+                self.opts._replace(
+                    graft_points=graft_points,
+                    iso_name="other.iso",
+                    output_dir=os.path.join(self.topdir, "other"),
+                ),
+                nevras,
+            ),
+            key,
+        )
 
-    def test_buildinstall_changed(self):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        phase.bi = mock.Mock()
-        phase.bi.reused.return_value = False
-        cmd = {"disc_num": 1, "disc_count": 1}
-        opts = CreateIsoOpts(buildinstall_method="lorax")
+    def test_package_changed(self):
+        key = createiso.get_reuse_key(self.opts, {self.rpm: "foo-0:1-1.x86_64"})
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
+        self.assertNotEqual(
+            createiso.get_reuse_key(self.opts, {self.rpm: "foo-0:1-2.x86_64"}), key
         )
 
-    def test_no_old_config(self):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        cmd = {"disc_num": 1, "disc_count": 1}
-        opts = CreateIsoOpts()
+    def test_file_changed(self):
+        key = createiso.get_reuse_key(self.opts)
+        os.utime(self.rpm, (0, 0))
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
-        )
+        self.assertNotEqual(createiso.get_reuse_key(self.opts), key)
+        key = createiso.get_reuse_key(self.opts)
+        helpers.touch(self.rpm, "longer")
+        os.utime(self.rpm, (0, 0))
 
-    def test_old_config_changed(self):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        old_config = compose.conf.copy()
-        old_config["release_version"] = "2"
-        compose.load_old_compose_config.return_value = old_config
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        cmd = {"disc_num": 1, "disc_count": 1}
-        opts = CreateIsoOpts()
+        self.assertNotEqual(createiso.get_reuse_key(self.opts), key)
+
+    def test_files_are_not_read(self):
+        nevras = {self.rpm: "foo-0:1-1.x86_64"}
+        key = createiso.get_reuse_key(self.opts, nevras)
+        helpers.touch(self.rpm, "baz")
+
+        self.assertEqual(createiso.get_reuse_key(self.opts, nevras), key)
+
+    def test_compose_metadata_is_skipped(self):
+        key = createiso.get_reuse_key(self.opts)
+        discinfo = os.path.join(self.topdir, "os/.discinfo")
+        repomd = os.path.join(self.topdir, "os/repodata/repomd.xml")
+        helpers.touch(discinfo)
+        helpers.touch(repomd)
+        with open(self.graft_points, "a") as f:
+            f.write(".discinfo=%s\nrepodata/repomd.xml=%s\n" % (discinfo, repomd))
+
+        self.assertEqual(createiso.get_reuse_key(self.opts), key)
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
+    def test_package_nevras(self):
+        compose = helpers.DummyCompose(self.topdir, {})
+        manifest = productmd.rpms.Rpms()
+        manifest.compose.id = compose.compose_id
+        manifest.compose.type = "test"
+        manifest.compose.date = "20151203"
+        manifest.compose.respin = 0
+        manifest.add(
+            "Server",
+            "x86_64",
+            "foo-0:1-1.x86_64",
+            path="Server/x86_64/os/Packages/f/foo-1-1.x86_64.rpm",
+            sigkey=None,
+            category="binary",
+            srpm_nevra="foo-0:1-1.src",
         )
+        manifest.dump(compose.paths.compose.metadata("rpms.json"))
 
-    def test_no_old_metadata(self):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        compose.load_old_compose_config.return_value = compose.conf.copy()
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        cmd = {"disc_num": 1, "disc_count": 1}
-        opts = CreateIsoOpts()
+        self.assertEqual(
+            createiso.get_package_nevras(compose),
+            {
+                os.path.join(
+                    self.topdir,
+                    "compose/Server/x86_64/os/Packages/f/foo-1-1.x86_64.rpm",
+                ): "foo-0:1-1.x86_64"
+            },
+        )
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
+    def test_options_changed(self):
+        key = createiso.get_reuse_key(self.opts)
+
+        for changed in (
+            self.opts._replace(volid="other-volid"),
+            self.opts._replace(iso_level=3),
+            self.opts._replace(use_xorrisofs=True),
+            self.opts._replace(buildinstall_method="lorax"),
+        ):
+            self.assertNotEqual(createiso.get_reuse_key(changed), key)
+
+    def test_boot_image_changed(self):
+        boot_iso = os.path.join(self.topdir, "boot.iso")
+        helpers.touch(boot_iso, "boot")
+        opts = self.opts._replace(
+            buildinstall_method="lorax", use_xorrisofs=True, boot_iso=boot_iso
         )
+        key = createiso.get_reuse_key(opts)
+        helpers.touch(boot_iso, "new boot")
 
-    @mock.patch("pungi.phases.createiso.read_json_file")
-    def test_volume_id_differs(self, read_json_file):
+        self.assertNotEqual(createiso.get_reuse_key(opts), key)
+
+
+class CreateisoTryReusePhaseTest(helpers.PungiTestCase):
+    def setUp(self):
+        super(CreateisoTryReusePhaseTest, self).setUp()
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(logging.StreamHandler(os.devnull))
+        rpm = os.path.join(self.topdir, "os/Packages/f/foo-1-1.x86_64.rpm")
+        helpers.touch(rpm)
+        self.graft_points = os.path.join(self.topdir, "graft_points")
+        helpers.touch(self.graft_points, "Packages/f/foo.rpm=%s\n" % rpm)
+        self.opts = CreateIsoOpts(graft_points=self.graft_points, volid="volid")
+        self.old_iso = os.path.join(self.topdir, "old/image.iso")
+        helpers.touch(self.old_iso)
+        self.iso_path = os.path.join(self.topdir, "compose/image.iso")
+        self.cmd = {"iso_path": self.iso_path, "disc_num": 1, "disc_count": 1}
+
+    def _get_phase(self):
         compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        compose.load_old_compose_config.return_value = compose.conf.copy()
+        compose.old_composes = [os.path.join(self.topdir, "old")]
         phase = createiso.CreateisoPhase(compose, mock.Mock())
         phase.logger = self.logger
-        cmd = {"disc_num": 1, "disc_count": 1}
+        phase.perform_reuse = mock.Mock()
+        return compose, phase
 
-        opts = CreateIsoOpts(volid="new-volid")
+    @mock.patch("pungi.phases.createiso.get_reuse_key")
+    @mock.patch("pungi.phases.createiso.read_json_file")
+    def test_no_old_composes(self, read_json_file, get_reuse_key):
+        compose, phase = self._get_phase()
+        compose.old_composes = []
+        variant = compose.variants["Server"]
+        helpers.touch(self.iso_path)
 
-        read_json_file.return_value = {"opts": {"volid": "old-volid"}}
+        self.assertFalse(phase.try_reuse(self.cmd, variant, "x86_64", self.opts))
+        phase.save_reuse_key(self.cmd, variant, "x86_64")
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
-        )
+        self.assertEqual(read_json_file.call_args_list, [])
+        self.assertEqual(get_reuse_key.call_args_list, [])
+        self.assertIsNone(createiso.read_reuse_key(self.iso_path))
 
     @mock.patch("pungi.phases.createiso.read_json_file")
-    def test_packages_differ(self, read_json_file):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        compose.load_old_compose_config.return_value = compose.conf.copy()
+    def test_buildinstall_not_reused(self, read_json_file):
+        compose, phase = self._get_phase()
+        phase.bi.reused.return_value = False
+        variant = compose.variants["Server"]
+        opts = self.opts._replace(buildinstall_method="lorax", arch="x86_64")
+        read_json_file.return_value = {"cmd": {"iso_path": self.old_iso}}
+        createiso.write_reuse_key(self.old_iso, createiso.get_reuse_key(opts))
+
+        self.assertFalse(phase.try_reuse(self.cmd, variant, "x86_64", opts))
+        self.assertFalse(phase.reuse_image(self.cmd, variant, "x86_64"))
+        self.assertEqual(phase.bi.reused.call_args_list, [mock.call(variant, "x86_64")])
+        self.assertEqual(phase.perform_reuse.call_args_list, [])
+
+    def test_disabled(self):
+        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": False})
         phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        cmd = {"disc_num": 1, "disc_count": 1}
 
-        new_graft_points = os.path.join(self.topdir, "new_graft_points")
-        helpers.touch(new_graft_points, "Packages/f/foo-1-1.x86_64.rpm\n")
-        opts = CreateIsoOpts(graft_points=new_graft_points, volid="volid")
+        self.assertFalse(phase.try_reuse(mock.Mock(), "Server", "x86_64", mock.Mock()))
+        self.assertFalse(phase.reuse_image(self.cmd, "Server", "x86_64"))
 
-        old_graft_points = os.path.join(self.topdir, "old_graft_points")
-        helpers.touch(old_graft_points, "Packages/f/foo-1-2.x86_64.rpm\n")
-        read_json_file.return_value = {
-            "opts": {"graft_points": old_graft_points, "volid": "volid"}
-        }
+    @mock.patch("pungi.phases.createiso.get_reuse_key")
+    def test_no_old_metadata(self, get_reuse_key):
+        compose, phase = self._get_phase()
+        variant = compose.variants["Server"]
 
-        self.assertFalse(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
-        )
+        self.assertFalse(phase.try_reuse(self.cmd, variant, "x86_64", self.opts))
+        self.assertFalse(phase.reuse_image(self.cmd, variant, "x86_64"))
+        # Nothing can be reused, inputs are not hashed before creating image.
+        self.assertEqual(get_reuse_key.call_args_list, [])
 
+    @mock.patch("pungi.phases.createiso.get_reuse_key")
     @mock.patch("pungi.phases.createiso.read_json_file")
-    def test_runs_perform_reuse(self, read_json_file):
-        compose = helpers.DummyCompose(self.topdir, {"createiso_allow_reuse": True})
-        compose.load_old_compose_config.return_value = compose.conf.copy()
-        phase = createiso.CreateisoPhase(compose, mock.Mock())
-        phase.logger = self.logger
-        phase.perform_reuse = mock.Mock()
-        cmd = {"disc_num": 1, "disc_count": 1}
-
-        new_graft_points = os.path.join(self.topdir, "new_graft_points")
-        helpers.touch(new_graft_points)
-        opts = CreateIsoOpts(graft_points=new_graft_points, volid="volid")
-
-        old_graft_points = os.path.join(self.topdir, "old_graft_points")
-        helpers.touch(old_graft_points)
-        dummy_iso_path = "dummy-iso-path"
-        read_json_file.return_value = {
-            "opts": {
-                "graft_points": old_graft_points,
-                "volid": "volid",
-            },
-            "cmd": {"iso_path": dummy_iso_path},
-        }
+    def test_no_old_reuse_key(self, read_json_file, get_reuse_key):
+        compose, phase = self._get_phase()
+        variant = compose.variants["Server"]
+        read_json_file.return_value = {"cmd": {"iso_path": self.old_iso}}
 
-        self.assertTrue(
-            phase.try_reuse(cmd, compose.variants["Server"], "x86_64", opts)
+        self.assertFalse(phase.try_reuse(self.cmd, variant, "x86_64", self.opts))
+        self.assertFalse(phase.reuse_image(self.cmd, variant, "x86_64"))
+        self.assertEqual(get_reuse_key.call_args_list, [])
+        self.assertEqual(phase.perform_reuse.call_args_list, [])
+
+    @mock.patch("pungi.phases.createiso.read_json_file")
+    def test_reuse_key_differs(self, read_json_file):
+        compose, phase = self._get_phase()
+        variant = compose.variants["Server"]
+        read_json_file.return_value = {"cmd": {"iso_path": self.old_iso}}
+        createiso.write_reuse_key(
+            self.old_iso, createiso.get_reuse_key(self.opts._replace(volid="old"))
         )
+
+        self.assertTrue(phase.try_reuse(self.cmd, variant, "x86_64", self.opts))
+        self.assertFalse(phase.reuse_image(self.cmd, variant, "x86_64"))
+        self.assertEqual(phase.perform_reuse.call_args_list, [])
+
+    @mock.patch("pungi.phases.createiso.read_json_file")
+    def test_runs_perform_reuse(self, read_json_file):
+        compose, phase = self._get_phase()
+        variant = compose.variants["Server"]
+        # Configuration changes do not prevent reuse.
+        compose.load_old_compose_config.return_value = {"release_version": "2"}
+        read_json_file.return_value = {"cmd": {"iso_path": self.old_iso}}
+        createiso.write_reuse_key(self.old_iso, createiso.get_reuse_key(self.opts))
+
+        self.assertTrue(phase.try_reuse(self.cmd, variant, "x86_64", self.opts))
+        self.assertTrue(phase.reuse_image(self.cmd, variant, "x86_64"))
         self.assertEqual(
             phase.perform_reuse.call_args_list,
-            [
-                mock.call(
-                    cmd,
-                    compose.variants["Server"],
-                    "x86_64",
-                    opts,
-                    dummy_iso_path,
-                )
-            ],
+            [mock.call(self.cmd, variant, "x86_64", self.opts, self.old_iso)],
+        )
+
+    @mock.patch("pungi.phases.createiso.read_json_file")
+    def test_save_reuse_key(self, read_json_file):
+        compose, phase = self._get_phase()
+        variant = compose.variants["Server"]
+        read_json_file.return_value = None
+        helpers.touch(self.iso_path)
+
+        phase.try_reuse(self.cmd, variant, "x86_64", self.opts)
+        phase.save_reuse_key(self.cmd, variant, "x86_64")
+
+        self.assertEqual(
+            createiso.read_reuse_key(self.iso_path),
+            createiso.get_reuse_key(self.opts),
         )
 
 
@@ -1515,6 +2081,7 @@ class CreateisoPerformReusePhaseTest(helpers.PungiTestCase):
             [
                 mock.call.link("old/image.iso", "target/image.iso"),
                 mock.call.link("old/image.iso.manifest", "target/image.iso.manifest"),
+                mock.call.link("old/image.iso.reuse-key", "target/image.iso.reuse-key"),
                 # The old log file doesn't exist in the test scenario.
                 mock.call.link(
                     None,
@@ -13,9 +13,12 @@ import six
 
 from pungi.module_util import Modulemd
 from pungi.phases.createrepo import (
+    ChecksumCache,
     CreaterepoPhase,
     ModulesMetadata,
+    RpmManifestIndex,
     create_variant_repo,
+    get_checksum_cache,
     get_productids_from_scm,
 )
 from tests.helpers import DummyCompose, PungiTestCase, copy_fixture, touch
@@ -95,6 +98,32 @@ class TestCreaterepoPhase(PungiTestCase):
             ],
         )
 
+    @mock.patch("pungi.phases.createrepo.create_variant_repo")
+    @mock.patch("pungi.phases.createrepo.ThreadPool")
+    def test_run_part(self, ThreadPoolCls, create_variant_repo):
+        compose = DummyCompose(self.topdir, {"createrepo_num_threads": 2})
+        compose.variants["Client"].is_empty = True
+        server = compose.variants["Server"]
+
+        phase = CreaterepoPhase(compose)
+        self.assertNotIn(compose.variants["Client"], [v for v, _ in phase.get_parts()])
+        phase.prepare()
+        phase.run_part(server, "x86_64")
+        phase.run_part(server, "src")
+
+        self.assertEqual(ThreadPoolCls.return_value.mock_calls, [])
+        self.assertEqual(
+            [c[0][1:] for c in create_variant_repo.call_args_list],
+            [("x86_64", server), ("x86_64", server), (None, server)],
+        )
+        self.assertEqual(
+            [c[1]["pkg_type"] for c in create_variant_repo.call_args_list],
+            ["rpm", "debuginfo", "srpm"],
+        )
+        self.assertIs(
+            create_variant_repo.call_args[1]["manifest_index"], phase.manifest_index
+        )
+
     @mock.patch("pungi.checks.get_num_cpus")
     @mock.patch("pungi.phases.createrepo.ThreadPool")
     def test_skips_empty_variants(self, ThreadPoolCls, get_num_cpus):
@@ -151,10 +180,11 @@ class TestCreaterepoPhase(PungiTestCase):
         )
 
 
-def make_mocked_modifyrepo_cmd(tc, module_artifacts):
-    def mocked_modifyrepo_cmd(repodir, mmd_path, **kwargs):
+def make_mocked_add_content(tc, module_artifacts):
+    def mocked_add_content(mdtype, filename, content):
+        tc.assertEqual(mdtype, "modules")
         mod_index = Modulemd.ModuleIndex.new()
-        mod_index.update_from_file(mmd_path, strict=True)
+        mod_index.update_from_string(content, strict=True)
 
         tc.assertEqual(len(mod_index.get_module_names()), 1)
 
@@ -169,7 +199,7 @@ def make_mocked_modifyrepo_cmd(tc, module_artifacts):
                 module_artifacts[ms.get_stream_name()],
             )
 
-    return mocked_modifyrepo_cmd
+    return mocked_add_content
 
 
 class TestCreateVariantRepo(PungiTestCase):
@@ -221,16 +251,104 @@ class TestCreateVariantRepo(PungiTestCase):
                     oldpackagedirs=None,
                     use_xz=False,
                     extra_args=[],
-                    cachedir=os.path.join(
-                        self.topdir,
-                        "%s-%s" % (compose.conf["release_short"], os.getuid()),
-                    ),
+                    cachedir=os.path.join(self.topdir, str(os.getuid())),
                 )
             ],
         )
         self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
 
+    @mock.patch("pungi.phases.createrepo.RepodataAssembler")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_assembled_from_pkgset(
+        self, CreaterepoWrapperCls, run, RepodataAssemblerCls
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {
+                "createrepo_checksum": "sha256",
+                "createrepo_enable_cache": False,
+                "createrepo_assemble_from_pkgset": True,
+            },
+        )
+        compose.has_comps = False
+        assembler = RepodataAssemblerCls.return_value
+        assembler.add_packages.return_value = []
+
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        create_variant_repo(
+            compose, "x86_64", compose.variants["Server"], "rpm", self.pkgset
+        )
+
+        repo = CreaterepoWrapperCls.return_value
+        self.assertEqual(repo.get_createrepo_cmd.mock_calls, [])
+        self.assertEqual(run.mock_calls, [])
+        self.assertEqual(
+            RepodataAssemblerCls.mock_calls,
+            [
+                mock.call(
+                    self.topdir + "/compose/Server/x86_64/os",
+                    checksum="sha256",
+                    database=True,
+                    use_xz=False,
+                ),
+                mock.call().add_packages(
+                    "/repo/x86_64", ["Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"]
+                ),
+                mock.call().write(groupfile=None),
+            ],
+        )
+
+    @mock.patch("pungi.phases.createrepo.RepodataAssembler")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_assembled_from_pkgset_with_missing(
+        self, CreaterepoWrapperCls, run, RepodataAssemblerCls
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {
+                "createrepo_checksum": "sha256",
+                "createrepo_enable_cache": False,
+                "createrepo_assemble_from_pkgset": True,
+            },
+        )
+        compose.has_comps = False
+        assembler = RepodataAssemblerCls.return_value
+        missing = ["Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"]
+        assembler.add_packages.return_value = missing
+
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+
+        create_variant_repo(
+            compose, "x86_64", compose.variants["Server"], "rpm", self.pkgset
+        )
+
+        repo = CreaterepoWrapperCls.return_value
+        self.assertEqual(len(repo.get_createrepo_cmd.mock_calls), 1)
+        args, kwargs = repo.get_createrepo_cmd.call_args
+        self.assertEqual(args, (self.topdir + "/compose/Server/x86_64/os",))
+        self.assertEqual(kwargs["update"], False)
+        self.assertEqual(kwargs["database"], False)
+        tmp_dir = kwargs["outputdir"]
+        self.assertEqual(kwargs["pkglist"], os.path.join(tmp_dir, "pkglist"))
+        self.assertEqual(
+            run.mock_calls,
+            [
+                mock.call(
+                    repo.get_createrepo_cmd.return_value,
+                    logfile=self.topdir
+                    + "/logs/x86_64/createrepo-Server.rpm.x86_64.log",
+                    show_cmd=True,
+                )
+            ],
+        )
+        assembler.add_repo.assert_called_once_with(tmp_dir)
+        assembler.write.assert_called_once_with(groupfile=None)
+        self.assertFalse(os.path.exists(tmp_dir))
+
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_rpms_without_database(self, CreaterepoWrapperCls, run):
@@ -592,6 +710,72 @@ class TestCreateVariantRepo(PungiTestCase):
         self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
 
+    @mock.patch("pungi.phases.createrepo.link_deltas")
+    @mock.patch("pungi.phases.createrepo.RepodataFinaliser")
+    @mock.patch("pungi.phases.createrepo.run")
+    @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
+    def test_variant_repo_rpms_with_deltas_from_store(
+        self, CreaterepoWrapperCls, run, RepodataFinaliserCls, link_deltas
+    ):
+        compose = DummyCompose(
+            self.topdir,
+            {
+                "createrepo_checksum": "sha256",
+                "createrepo_deltas": True,
+                "createrepo_enable_cache": False,
+            },
+        )
+        compose.has_comps = False
+        compose.old_composes = [self.topdir + "/old"]
+        touch(
+            os.path.join(self.topdir, "old", "test-1.0-20151203.0", "STATUS"),
+            "FINISHED",
+        )
+        old_packages = (
+            self.topdir + "/old/test-1.0-20151203.0/compose/Server/x86_64/os/Packages"
+        )
+        touch(os.path.join(old_packages, "bash-4.3.30-1.fc21.x86_64.rpm"))
+
+        repo = CreaterepoWrapperCls.return_value
+        copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
+        store = mock.Mock()
+        link_deltas.return_value = []
+
+        create_variant_repo(
+            compose,
+            "x86_64",
+            compose.variants["Server"],
+            "rpm",
+            self.pkgset,
+            delta_store=store,
+        )
+
+        args, kwargs = repo.get_createrepo_cmd.call_args
+        self.assertFalse(kwargs["deltas"])
+        self.assertIsNone(kwargs["oldpackagedirs"])
+        self.assertEqual(
+            link_deltas.mock_calls,
+            [
+                mock.call(
+                    store,
+                    self.topdir + "/compose/Server/x86_64/os",
+                    [
+                        (
+                            "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm",
+                            old_packages + "/bash-4.3.30-1.fc21.x86_64.rpm",
+                        )
+                    ],
+                    "sha256",
+                    workers=3,
+                    logger=compose._logger,
+                )
+            ],
+        )
+        self.assertEqual(
+            RepodataFinaliserCls.return_value.add_content.mock_calls,
+            [mock.call("prestodelta", "prestodelta.xml", mock.ANY)],
+        )
+
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_rpms_with_deltas_granular_config(
@@ -1014,9 +1198,12 @@ class TestCreateVariantRepo(PungiTestCase):
             list_file, "Packages/b/bash-debuginfo-4.3.30-2.fc21.x86_64.rpm\n"
         )
 
+    @mock.patch("pungi.phases.createrepo.RepodataFinaliser")
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
-    def test_variant_repo_rpms_with_productid(self, CreaterepoWrapperCls, run):
+    def test_variant_repo_rpms_with_productid(
+        self, CreaterepoWrapperCls, run, RepodataFinaliserCls
+    ):
         compose = DummyCompose(
             self.topdir,
             {
@@ -1070,9 +1257,21 @@ class TestCreateVariantRepo(PungiTestCase):
                 )
             ],
         )
+        self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertEqual(
-            repo.get_modifyrepo_cmd.mock_calls,
-            [mock.call(repodata_dir, product_id, compress_type="gz")],
+            RepodataFinaliserCls.mock_calls,
+            [
+                mock.call(
+                    self.topdir + "/compose/Server/x86_64/os",
+                    checksum="sha256",
+                    workers=3,
+                ),
+                mock.call().add_file("productid", product_id),
+                mock.call().write(),
+            ],
+        )
+        self.assertFileContent(
+            os.path.join(repodata_dir, "productid"), product_id + "\n"
         )
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.x86_64.rpm\n")
 
@@ -1181,11 +1380,11 @@ class TestCreateVariantRepo(PungiTestCase):
         self.assertFileContent(list_file, "Packages/b/bash-4.3.30-2.fc21.src.rpm\n")
 
     @unittest.skipUnless(Modulemd is not None, "Skipped test, no module support.")
-    @mock.patch("pungi.phases.createrepo.find_file_in_repodata")
+    @mock.patch("pungi.phases.createrepo.RepodataFinaliser")
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_modules_artifacts_not_in_compose(
-        self, CreaterepoWrapperCls, run, modulemd_filename
+        self, CreaterepoWrapperCls, run, RepodataFinaliserCls
     ):
         compose = DummyCompose(self.topdir, {"createrepo_checksum": "sha256"})
         compose.has_comps = False
@@ -1200,18 +1399,15 @@ class TestCreateVariantRepo(PungiTestCase):
         )
 
         repo = CreaterepoWrapperCls.return_value
-        repo.get_modifyrepo_cmd.side_effect = make_mocked_modifyrepo_cmd(
+        finaliser = RepodataFinaliserCls.return_value
+        finaliser.add_content.side_effect = make_mocked_add_content(
             self, {"f27": [], "f28": []}
         )
         copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
 
-        repodata_dir = os.path.join(
-            compose.paths.compose.os_tree("x86_64", compose.variants["Server"]),
-            "repodata",
-        )
-        modulemd_filename.return_value = (
-            "Server/x86_64/os/repodata/3511d16a7-modules.yaml.gz"
-        )
+        RepodataFinaliserCls.return_value.write.return_value = {
+            "modules": "repodata/3511d16a7-modules.yaml.gz"
+        }
         modules_metadata = mock.Mock()
 
         create_variant_repo(
@@ -1223,17 +1419,18 @@ class TestCreateVariantRepo(PungiTestCase):
             modules_metadata,
         )
 
+        self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertEqual(
-            repo.get_modifyrepo_cmd.mock_calls,
-            [mock.call(repodata_dir, mock.ANY, compress_type="gz", mdtype="modules")],
+            RepodataFinaliserCls.return_value.add_content.mock_calls,
+            [mock.call("modules", "modules.yaml", mock.ANY)],
         )
 
     @unittest.skipUnless(Modulemd is not None, "Skipped test, no module support.")
-    @mock.patch("pungi.phases.createrepo.find_file_in_repodata")
+    @mock.patch("pungi.phases.createrepo.RepodataFinaliser")
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_modules_artifacts(
-        self, CreaterepoWrapperCls, run, modulemd_filename
+        self, CreaterepoWrapperCls, run, RepodataFinaliserCls
     ):
         compose = DummyCompose(self.topdir, {"createrepo_checksum": "sha256"})
         compose.has_comps = False
@@ -1257,21 +1454,19 @@ class TestCreateVariantRepo(PungiTestCase):
         }
 
         repo = CreaterepoWrapperCls.return_value
-        repo.get_modifyrepo_cmd.side_effect = make_mocked_modifyrepo_cmd(
+        finaliser = RepodataFinaliserCls.return_value
+        finaliser.add_content.side_effect = make_mocked_add_content(
             self,
             {"f27": ["bash-0:4.3.30-2.fc21.x86_64"], "f28": ["pkg-0:2.0.0-1.x86_64"]},
         )
 
         copy_fixture("server-rpms.json", compose.paths.compose.metadata("rpms.json"))
 
-        repodata_dir = os.path.join(
-            compose.paths.compose.os_tree("x86_64", compose.variants["Server"]),
-            "repodata",
-        )
-
         modules_metadata = ModulesMetadata(compose)
 
-        modulemd_filename.return_value = "Server/x86_64/os/repodata/3511d16a723e1bd69826e591508f07e377d2212769b59178a9-modules.yaml.gz"  # noqa: E501
+        RepodataFinaliserCls.return_value.write.return_value = {
+            "modules": "repodata/3511d16a723e1bd69826e591508f07e377d2212769b59178a9-modules.yaml.gz"  # noqa: E501
+        }
         create_variant_repo(
             compose,
             "x86_64",
@@ -1281,17 +1476,18 @@ class TestCreateVariantRepo(PungiTestCase):
             modules_metadata,
         )
 
+        self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertEqual(
-            repo.get_modifyrepo_cmd.mock_calls,
-            [mock.call(repodata_dir, mock.ANY, compress_type="gz", mdtype="modules")],
+            RepodataFinaliserCls.return_value.add_content.mock_calls,
+            [mock.call("modules", "modules.yaml", mock.ANY)],
         )
 
     @unittest.skipUnless(Modulemd is not None, "Skipped test, no module support.")
-    @mock.patch("pungi.phases.createrepo.find_file_in_repodata")
+    @mock.patch("pungi.phases.createrepo.RepodataFinaliser")
     @mock.patch("pungi.phases.createrepo.run")
     @mock.patch("pungi.phases.createrepo.CreaterepoWrapper")
     def test_variant_repo_extra_modulemd(
-        self, CreaterepoWrapperCls, run, modulemd_filename
+        self, CreaterepoWrapperCls, run, RepodataFinaliserCls
     ):
         compose = DummyCompose(
             self.topdir, {"createrepo_extra_modulemd": {"Server": mock.Mock()}}
@@ -1310,14 +1506,11 @@ class TestCreateVariantRepo(PungiTestCase):
             os.path.join(compose.topdir, "work/global/tmp-Server/x86_64/*.yaml"),
         )
 
-        repodata_dir = os.path.join(
-            compose.paths.compose.os_tree("x86_64", compose.variants["Server"]),
-            "repodata",
-        )
-
         modules_metadata = ModulesMetadata(compose)
 
-        modulemd_filename.return_value = "Server/x86_64/os/repodata/3511d16a723e1bd69826e591508f07e377d2212769b59178a9-modules.yaml.gz"  # noqa: E501
+        RepodataFinaliserCls.return_value.write.return_value = {
+            "modules": "repodata/3511d16a723e1bd69826e591508f07e377d2212769b59178a9-modules.yaml.gz"  # noqa: E501
+        }
         create_variant_repo(
             compose,
             "x86_64",
@@ -1327,9 +1520,10 @@ class TestCreateVariantRepo(PungiTestCase):
             modules_metadata,
         )
 
+        self.assertEqual(repo.get_modifyrepo_cmd.mock_calls, [])
         self.assertEqual(
-            repo.get_modifyrepo_cmd.mock_calls,
-            [mock.call(repodata_dir, mock.ANY, compress_type="gz", mdtype="modules")],
+            RepodataFinaliserCls.return_value.add_content.mock_calls,
+            [mock.call("modules", "modules.yaml", mock.ANY)],
         )
         self.assertEqual(
             list(modules_metadata.productmd_modules_metadata["Server"]["x86_64"]),
@@ -1337,6 +1531,144 @@ class TestCreateVariantRepo(PungiTestCase):
         )
 
 
+class TestChecksumCache(PungiTestCase):
+    def setUp(self):
+        super(TestChecksumCache, self).setUp()
+        self.cachedir = os.path.join(self.topdir, "cache")
+        os.makedirs(self.cachedir)
+
+    def _add_entry(self, filename, mtime=None, size=10):
+        path = os.path.join(self.cachedir, "%s-abcdef-sha256" % filename)
+        touch(path, "x" * size)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_counts_hits_and_misses(self):
+        cache = ChecksumCache(self.cachedir)
+        entry = self._add_entry("bash-1.0-1.x86_64.rpm", mtime=1000)
+        cache.snapshot()
+        self._add_entry("zsh-1.0-1.x86_64.rpm")
+
+        with mock.patch("os.listdir", wraps=os.listdir) as listdir:
+            first = cache.mark_used(
+                [
+                    "Packages/b/bash-1.0-1.x86_64.rpm",
+                    "Packages/z/zsh-1.0-1.x86_64.rpm",
+                ]
+            )
+            second = cache.mark_used(
+                [
+                    "Packages/b/bash-1.0-1.x86_64.rpm",
+                    "Packages/f/foo-1.0-1.x86_64.rpm",
+                ]
+            )
+            # The cache is not listed for each task.
+            self.assertEqual(listdir.call_count, 0)
+
+        # Stats for each createrepo run.
+        self.assertEqual(first, (1, 1))
+        self.assertEqual(second, (1, 1))
+        self.assertEqual(cache.get_stats(), (1, 1))
+        # Used entry is marked as recently used.
+        self.assertGreater(os.stat(entry).st_mtime, 1000)
+
+    def test_prune_removes_least_recently_used(self):
+        old = self._add_entry("a-1.0-1.x86_64.rpm", mtime=1000)
+        middle = self._add_entry("b-1.0-1.x86_64.rpm", mtime=2000)
+        new = self._add_entry("c-1.0-1.x86_64.rpm", mtime=3000)
+
+        ChecksumCache(self.cachedir, max_size=25).prune()
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(middle))
+        self.assertTrue(os.path.exists(new))
+
+    def test_prune_without_limit(self):
+        entry = self._add_entry("a-1.0-1.x86_64.rpm", size=100)
+
+        ChecksumCache(self.cachedir).prune()
+
+        self.assertTrue(os.path.exists(entry))
+
+    @mock.patch("pungi.phases.createrepo.os.getuid", new=lambda: 1000)
+    def test_shared_between_releases(self):
+        compose = DummyCompose(self.topdir, {"createrepo_cache_size": "1k"})
+        with mock.patch("pungi.phases.createrepo.CACHE_TOPDIR", self.cachedir):
+            cache = get_checksum_cache(compose)
+
+        self.assertEqual(cache.topdir, os.path.join(self.cachedir, "1000"))
+        self.assertEqual(cache.max_size, 1024)
+        self.assertTrue(os.path.isdir(cache.topdir))
+
+    def test_disabled(self):
+        compose = DummyCompose(self.topdir, {"createrepo_enable_cache": False})
+        self.assertIsNone(get_checksum_cache(compose))
+
+
+class TestRpmManifestIndex(PungiTestCase):
+    def setUp(self):
+        super(TestRpmManifestIndex, self).setUp()
+        self.compose = DummyCompose(self.topdir, {})
+        copy_fixture(
+            "server-rpms.json", self.compose.paths.compose.metadata("rpms.json")
+        )
+
+    def test_get_paths_for_arch(self):
+        index = RpmManifestIndex(self.compose)
+        self.assertEqual(
+            index.get_paths(self.compose.variants["Server"], "x86_64", "binary"),
+            ["Server/x86_64/os/Packages/b/bash-4.3.30-2.fc21.x86_64.rpm"],
+        )
+
+    def test_get_paths_for_all_arches(self):
+        index = RpmManifestIndex(self.compose)
+        self.assertEqual(
+            index.get_paths(self.compose.variants["Server"], None, "source"),
+            ["Server/source/tree/Packages/b/bash-4.3.30-2.fc21.src.rpm"] * 2,
+        )
+
+    def test_get_paths_for_missing_variant(self):
+        index = RpmManifestIndex(self.compose)
+        self.assertEqual(
+            index.get_paths(self.compose.variants["Client"], "amd64", "binary"), []
+        )
+
+    @mock.patch("productmd.rpms.Rpms")
+    def test_loads_manifest_once(self, RpmsCls):
+        RpmsCls.return_value.rpms = {}
+        index = RpmManifestIndex(self.compose)
+        index.get_paths(self.compose.variants["Server"], "x86_64", "binary")
+        index.get_paths(self.compose.variants["Server"], "amd64", "debug")
+        self.assertEqual(
+            RpmsCls.return_value.load.mock_calls,
+            [mock.call(self.compose.paths.compose.metadata("rpms.json"))],
+        )
+
+    @mock.patch("productmd.rpms.Rpms")
+    def test_uses_in_memory_manifest(self, RpmsCls):
+        manifest = mock.Mock(
+            rpms={
+                "Server": {
+                    "x86_64": {
+                        "bash-0:4.3.30-2.fc21.src": {
+                            "bash-0:4.3.30-2.fc21.x86_64": {
+                                "path": "Server/x86_64/os/Packages/b/bash.rpm",
+                                "category": "binary",
+                            }
+                        }
+                    }
+                }
+            }
+        )
+        index = RpmManifestIndex(self.compose, manifest=manifest)
+        self.assertEqual(
+            index.get_paths(self.compose.variants["Server"], "x86_64", "binary"),
+            ["Server/x86_64/os/Packages/b/bash.rpm"],
+        )
+        self.assertEqual(RpmsCls.mock_calls, [])
+
+
 class TestGetProductIds(PungiTestCase):
     def mock_get(self, filenames):
         def _mock_get(scm, dest, compose=None):
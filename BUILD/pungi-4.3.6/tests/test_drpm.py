@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+
+import mock
+import rpm
+
+from pungi import drpm
+from tests.helpers import PungiTestCase, touch
+
+
+def _info(path, version, release, sigmd5):
+    return drpm.RpmInfo(path, "bash", "0", version, release, "x86_64", sigmd5)
+
+
+def _fake_makedeltarpm(cmd, **kwargs):
+    touch(cmd[2], "sequence\n")
+    touch(cmd[-1], "delta")
+
+
+class TestFindOldPackages(PungiTestCase):
+    def test_uses_newest_older_build(self):
+        old_dir = os.path.join(self.topdir, "old")
+        for fn in (
+            "bash-4.3-1.x86_64.rpm",
+            "bash-4.3-2.x86_64.rpm",
+            "bash-4.4-1.x86_64.rpm",
+            "bash-4.3-2.i686.rpm",
+            "zsh-5.0-1.x86_64.rpm",
+        ):
+            touch(os.path.join(old_dir, fn))
+
+        self.assertEqual(
+            drpm.find_old_packages(
+                [
+                    "Packages/b/bash-4.3-3.x86_64.rpm",
+                    "Packages/z/zsh-5.0-1.x86_64.rpm",
+                    "Packages/f/foo-1.0-1.x86_64.rpm",
+                ],
+                [old_dir],
+            ),
+            [
+                (
+                    "Packages/b/bash-4.3-3.x86_64.rpm",
+                    os.path.join(old_dir, "bash-4.3-2.x86_64.rpm"),
+                )
+            ],
+        )
+
+
+class TestDeltaRpmStore(PungiTestCase):
+    def setUp(self):
+        super(TestDeltaRpmStore, self).setUp()
+        self.store_dir = os.path.join(self.topdir, "store")
+        self.old = _info("/old/bash.rpm", "4.3", "1", "aaaa")
+        self.new = _info("/new/bash.rpm", "4.3", "2", "bbbb")
+
+    @mock.patch("pungi.drpm.run")
+    def test_creates_delta_only_once(self, run):
+        run.side_effect = _fake_makedeltarpm
+        store = drpm.DeltaRpmStore(self.store_dir)
+
+        first = store.get(self.old, self.new)
+        second = store.get(self.old, self.new)
+
+        path = os.path.join(self.store_dir, "aa", "aaaa-bbbb.drpm")
+        self.assertEqual(first, (path, "sequence"))
+        self.assertEqual(second, first)
+        self.assertEqual(len(run.mock_calls), 1)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(path))),
+            ["aaaa-bbbb.drpm", "aaaa-bbbb.drpm.seq"],
+        )
+
+    @mock.patch("pungi.drpm.run")
+    def test_failure_leaves_no_files(self, run):
+        run.side_effect = RuntimeError("makedeltarpm failed")
+        store = drpm.DeltaRpmStore(self.store_dir)
+
+        with self.assertRaises(RuntimeError):
+            store.get(self.old, self.new)
+
+        self.assertEqual(os.listdir(os.path.join(self.store_dir, "aa")), [])
+
+    @mock.patch("pungi.drpm.run")
+    def test_concurrent_requests_create_delta_once(self, run):
+        started = threading.Event()
+        release = threading.Event()
+
+        def _slow_makedeltarpm(cmd, **kwargs):
+            started.set()
+            release.wait(5)
+            _fake_makedeltarpm(cmd)
+
+        run.side_effect = _slow_makedeltarpm
+        store = drpm.DeltaRpmStore(self.store_dir)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(store.get(self.old, self.new))
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(run.mock_calls), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual((store.hits, store.misses), (2, 1))
+        # Locks are not kept once the delta is done.
+        self.assertEqual(store._path_locks, {})
+
+    @mock.patch("pungi.drpm.run")
+    def test_delta_too_big(self, run):
+        run.side_effect = _fake_makedeltarpm
+        new_path = os.path.join(self.topdir, "bash-4.3-2.x86_64.rpm")
+        touch(new_path, "package")
+        new = self.new._replace(path=new_path)
+        store = drpm.DeltaRpmStore(self.store_dir, max_ratio=0.5)
+
+        self.assertIsNone(store.get(self.old, new))
+        self.assertIsNone(store.get(self.old, new))
+
+        # The delta is still stored so that it is not created again.
+        self.assertEqual(len(run.mock_calls), 1)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+        store.max_ratio = 0.75
+        self.assertEqual(
+            store.get(self.old, new),
+            (os.path.join(self.store_dir, "aa", "aaaa-bbbb.drpm"), "sequence"),
+        )
+
+    def test_prune_removes_least_recently_used(self):
+        now = time.time()
+        for idx, name in enumerate(["aa/old", "bb/middle", "cc/new"]):
+            path = os.path.join(self.store_dir, name + ".drpm")
+            touch(path, "x" * 10)
+            touch(path + ".seq", "sequence")
+            os.utime(path, (now + idx, now + idx))
+
+        drpm.DeltaRpmStore(self.store_dir, max_size=25).prune()
+
+        self.assertFalse(os.path.exists(os.path.join(self.store_dir, "aa/old.drpm")))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.store_dir, "aa/old.drpm.seq"))
+        )
+        self.assertTrue(os.path.exists(os.path.join(self.store_dir, "bb/middle.drpm")))
+        self.assertTrue(os.path.exists(os.path.join(self.store_dir, "cc/new.drpm")))
+
+
+class TestLinkDeltas(PungiTestCase):
+    @mock.patch("pungi.drpm.read_rpm_info")
+    @mock.patch("pungi.drpm.run")
+    def test_links_deltas_into_repo(self, run, read_rpm_info):
+        run.side_effect = _fake_makedeltarpm
+        repo_dir = os.path.join(self.topdir, "repo")
+        touch(os.path.join(repo_dir, "drpms", "stale.drpm"))
+        infos = {
+            "/old/bash-4.3-1.x86_64.rpm": _info("/old/bash.rpm", "4.3", "1", "aaaa"),
+            os.path.join(repo_dir, "Packages/bash-4.3-2.x86_64.rpm"): _info(
+                "/new/bash.rpm", "4.3", "2", "bbbb"
+            ),
+        }
+        read_rpm_info.side_effect = lambda path: infos[path]
+        store = drpm.DeltaRpmStore(os.path.join(self.topdir, "store"))
+
+        deltas = drpm.link_deltas(
+            store,
+            repo_dir,
+            [("Packages/bash-4.3-2.x86_64.rpm", "/old/bash-4.3-1.x86_64.rpm")],
+            "sha256",
+        )
+
+        self.assertEqual(
+            os.listdir(os.path.join(repo_dir, "drpms")),
+            ["bash-4.3-1_4.3-2.x86_64.drpm"],
+        )
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]["filename"], "drpms/bash-4.3-1_4.3-2.x86_64.drpm")
+        self.assertEqual(deltas[0]["size"], 5)
+
+        xml = drpm.get_prestodelta_xml(deltas, "sha256")
+        self.assertIn(
+            '<newpackage name="bash" epoch="0" version="4.3" release="2" '
+            'arch="x86_64">',
+            xml,
+        )
+        self.assertIn('<delta oldepoch="0" oldversion="4.3" oldrelease="1">', xml)
+        self.assertIn("<sequence>sequence</sequence>", xml)
+
+    @mock.patch("pungi.drpm.read_rpm_info")
+    def test_skips_delta_failing_with_os_error(self, read_rpm_info):
+        repo_dir = os.path.join(self.topdir, "repo")
+        read_rpm_info.return_value = _info("/new/bash.rpm", "4.3", "2", "bbbb")
+        store = mock.Mock()
+        store.get.side_effect = OSError("No such file or directory")
+
+        deltas = drpm.link_deltas(
+            store,
+            repo_dir,
+            [("Packages/bash-4.3-2.x86_64.rpm", "/old/bash-4.3-1.x86_64.rpm")],
+            "sha256",
+        )
+
+        self.assertEqual(deltas, [])
+
+    @mock.patch("pungi.drpm.read_rpm_info")
+    def test_skips_package_with_bad_header(self, read_rpm_info):
+        repo_dir = os.path.join(self.topdir, "repo")
+        read_rpm_info.side_effect = rpm.error("error reading package header")
+        store = mock.Mock()
+        logger = mock.Mock()
+
+        deltas = drpm.link_deltas(
+            store,
+            repo_dir,
+            [("Packages/bash-4.3-2.x86_64.rpm", "/old/bash-4.3-1.x86_64.rpm")],
+            "sha256",
+            logger=logger,
+        )
+
+        self.assertEqual(deltas, [])
+        self.assertEqual(store.get.mock_calls, [])
+        self.assertEqual(len(logger.warning.mock_calls), 1)
+
+    @mock.patch("pungi.drpm.read_rpm_info")
+    def test_skips_delta_too_big(self, read_rpm_info):
+        repo_dir = os.path.join(self.topdir, "repo")
+        read_rpm_info.return_value = _info("/new/bash.rpm", "4.3", "2", "bbbb")
+        store = mock.Mock()
+        store.get.return_value = None
+
+        deltas = drpm.link_deltas(
+            store,
+            repo_dir,
+            [("Packages/bash-4.3-2.x86_64.rpm", "/old/bash-4.3-1.x86_64.rpm")],
+            "sha256",
+        )
+
+        self.assertEqual(deltas, [])
+        self.assertEqual(os.listdir(os.path.join(repo_dir, "drpms")), [])
@@ -32,6 +32,7 @@ class ExtraIsosPhaseTest(helpers.PungiTestCase):
         compose = helpers.DummyCompose(self.topdir, {"extra_isos": {"^Server$": [cfg]}})
 
         phase = extra_isos.ExtraIsosPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
         phase.run()
 
         self.assertEqual(len(ThreadPool.return_value.add.call_args_list), 3)
@@ -53,6 +54,7 @@ class ExtraIsosPhaseTest(helpers.PungiTestCase):
         compose = helpers.DummyCompose(self.topdir, {"extra_isos": {"^Server$": [cfg]}})
 
         phase = extra_isos.ExtraIsosPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
         phase.run()
 
         self.assertEqual(len(ThreadPool.return_value.add.call_args_list), 2)
@@ -73,6 +75,7 @@ class ExtraIsosPhaseTest(helpers.PungiTestCase):
         compose = helpers.DummyCompose(self.topdir, {"extra_isos": {"^Server$": [cfg]}})
 
         phase = extra_isos.ExtraIsosPhase(compose, mock.Mock())
+        phase.logger = mock.Mock()
         phase.run()
 
         self.assertEqual(len(ThreadPool.return_value.add.call_args_list), 2)
@@ -543,6 +546,7 @@ class GetExtraFilesTest(helpers.PungiTestCase):
                     self.dir,
                     ["legalese/GPL"],
                     self.compose.conf["media_checksums"],
+                    engine=self.compose.checksum_engine,
                 )
             ],
         )
@@ -572,6 +576,7 @@ class GetExtraFilesTest(helpers.PungiTestCase):
                     self.dir,
                     ["foo/a", "foo/b"],
                     self.compose.conf["media_checksums"],
+                    engine=self.compose.checksum_engine,
                 ),
             ],
         )
@@ -609,6 +614,7 @@ class GetExtraFilesTest(helpers.PungiTestCase):
                     self.dir,
                     ["legalese/GPL", "setup.py"],
                     self.compose.conf["media_checksums"],
+                    engine=self.compose.checksum_engine,
                 ),
             ],
         )
@@ -636,7 +642,7 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             "work/x86_64/Server/extra-iso-extra-files": {"EULA": "/mnt/EULA"},
         }
 
-        ggp.side_effect = lambda compose, x: gp[x[0][len(self.topdir) + 1 :]]
+        ggp.side_effect = lambda compose, x, scanner: gp[x[0][len(self.topdir) + 1 :]]
         gp_file = os.path.join(self.topdir, "work/x86_64/iso/my.iso-graft-points")
 
         self.assertEqual(
@@ -665,7 +671,9 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             ggp.call_args_list,
             [
                 mock.call(
-                    self.compose.paths.compose.topdir(), [os.path.join(self.topdir, x)]
+                    self.compose.paths.compose.topdir(),
+                    [os.path.join(self.topdir, x)],
+                    scanner=self.compose.tree_scanner,
                 )
                 for x in gp
             ],
@@ -708,7 +716,7 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             "work/x86_64/Server/extra-iso-extra-files": {"EULA": "/mnt/EULA"},
         }
 
-        ggp.side_effect = lambda compose, x: gp[x[0][len(self.topdir) + 1 :]]
+        ggp.side_effect = lambda compose, x, scanner: gp[x[0][len(self.topdir) + 1 :]]
         gp_file = os.path.join(self.topdir, "work/x86_64/iso/my.iso-graft-points")
 
         self.assertEqual(
@@ -739,7 +747,9 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             ggp.call_args_list,
             [
                 mock.call(
-                    self.compose.paths.compose.topdir(), [os.path.join(self.topdir, x)]
+                    self.compose.paths.compose.topdir(),
+                    [os.path.join(self.topdir, x)],
+                    scanner=self.compose.tree_scanner,
                 )
                 for x in gp
             ],
@@ -780,7 +790,7 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             "work/src/Server/extra-iso-extra-files": {"EULA": "/mnt/EULA"},
         }
 
-        ggp.side_effect = lambda compose, x: gp[x[0][len(self.topdir) + 1 :]]
+        ggp.side_effect = lambda compose, x, scanner: gp[x[0][len(self.topdir) + 1 :]]
         gp_file = os.path.join(self.topdir, "work/src/iso/my.iso-graft-points")
 
         self.assertEqual(
@@ -809,7 +819,9 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             ggp.call_args_list,
             [
                 mock.call(
-                    self.compose.paths.compose.topdir(), [os.path.join(self.topdir, x)]
+                    self.compose.paths.compose.topdir(),
+                    [os.path.join(self.topdir, x)],
+                    scanner=self.compose.tree_scanner,
                 )
                 for x in gp
             ],
@@ -864,7 +876,7 @@ class GetIsoContentsTest(helpers.PungiTestCase):
         }
 
         ggp.side_effect = (
-            lambda compose, x: gp[x[0][len(self.topdir) + 1 :]]
+            lambda compose, x, scanner: gp[x[0][len(self.topdir) + 1 :]]
             if len(x) == 1
             else bi_gp
         )
@@ -906,11 +918,19 @@ class GetIsoContentsTest(helpers.PungiTestCase):
             ggp.call_args_list,
             [
                 mock.call(
-                    self.compose.paths.compose.topdir(), [os.path.join(self.topdir, x)]
+                    self.compose.paths.compose.topdir(),
+                    [os.path.join(self.topdir, x)],
+                    scanner=self.compose.tree_scanner,
                 )
                 for x in gp
             ]
-            + [mock.call(self.compose.paths.compose.topdir(), [bi_dir, iso_dir])],
+            + [
+                mock.call(
+                    self.compose.paths.compose.topdir(),
+                    [bi_dir, iso_dir],
+                    scanner=self.compose.tree_scanner,
+                )
+            ],
         )
         self.assertEqual(len(wgp.call_args_list), 1)
         self.assertEqual(wgp.call_args_list[0][0][0], gp_file)
@@ -1478,6 +1478,7 @@ class TestGatherPhase(helpers.PungiTestCase):
                 pkg_map[arch][variant],
                 pkgset_phase.package_sets,
                 manifest=phase.manifest,
+                linker=mock.ANY,
             )
 
         phase = gather.GatherPhase(compose, pkgset_phase)
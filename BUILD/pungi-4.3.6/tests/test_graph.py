@@ -89,3 +89,47 @@ class SimpleAcyclicOrientedGraphTestCase(unittest.TestCase):
 
         # spanning line have to match completely to given graph
         self.assertEqual(["1", "3", "2"], spanning_line)
+
+    def test_cycle_is_reported_with_path(self):
+        self.g.add_edge("1", "2")
+        self.g.add_edge("2", "3")
+
+        with self.assertRaises(ValueError) as ctx:
+            self.g.add_edge("3", "1")
+
+        self.assertIn("['1', '2', '3']", str(ctx.exception))
+        # The rejected edge is not added.
+        self.assertEqual(["1", "2", "3"], self.g.prune_graph())
+
+    def test_edge_against_insertion_order(self):
+        graph_data = (
+            ("3", "4"),
+            ("1", "2"),
+            ("4", "1"),
+            ("2", "5"),
+        )
+
+        for start, end in graph_data:
+            self.g.add_edge(start, end)
+
+        self.assertEqual(["3", "4", "1", "2", "5"], self.g.prune_graph())
+        with self.assertRaises(ValueError):
+            self.g.add_edge("5", "3")
+
+    def test_duplicate_edge(self):
+        self.g.add_edge("1", "2")
+        self.g.add_edge("1", "2")
+
+        self.assertEqual(["1", "2"], self.g.prune_graph())
+
+    def test_prune_does_not_modify_graph(self):
+        self.g.add_edge("1", "2")
+
+        self.assertEqual(self.g.prune_graph(), self.g.prune_graph())
+
+    def test_long_chain(self):
+        nodes = ["node-%05d" % i for i in range(5000)]
+        for start, end in zip(nodes[1:], nodes):
+            self.g.add_edge(start, end)
+
+        self.assertEqual(list(reversed(nodes)), self.g.prune_graph())
@@ -4,14 +4,20 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
+import hashlib
 import mock
 
 import os
 import tempfile
 import shutil
 
-from pungi.phases.image_checksum import ImageChecksumPhase, dump_checksums
-from tests.helpers import DummyCompose, PungiTestCase
+from pungi.checksums import ChecksumEngine
+from pungi.phases.image_checksum import (
+    ImageChecksumPhase,
+    dump_checksums,
+    make_checksums,
+)
+from tests.helpers import DummyCompose, PungiTestCase, touch
 
 
 class TestImageChecksumPhase(PungiTestCase):
@@ -20,6 +26,24 @@ class TestImageChecksumPhase(PungiTestCase):
         phase = ImageChecksumPhase(compose)
         self.assertFalse(phase.skip())
 
+    def test_hashes_images_as_they_are_added(self):
+        compose = DummyCompose(self.topdir, {"media_checksums": ["sha256"]})
+        compose.checksum_engine = mock.Mock()
+        phase = ImageChecksumPhase(compose)
+
+        compose.im.add_listener.assert_called_once_with(phase._image_added)
+        phase._image_added("Client", "x86_64", mock.Mock(path="Client/iso/image.iso"))
+
+        self.assertEqual(
+            compose.checksum_engine.prefetch.call_args_list,
+            [
+                mock.call(
+                    os.path.join(self.topdir, "compose/Client/iso/image.iso"),
+                    ["sha256"],
+                )
+            ],
+        )
+
     def test_config_skip_individual_with_multiple_algorithms(self):
         compose = DummyCompose(
             self.topdir,
@@ -32,7 +56,7 @@ class TestImageChecksumPhase(PungiTestCase):
         self.assertIn("media_checksum_one_file", str(ctx.exception))
 
     @mock.patch("os.path.exists")
-    @mock.patch("kobo.shortcuts.compute_file_checksums")
+    @mock.patch("pungi.checksums.ChecksumEngine.checksum")
     @mock.patch("pungi.phases.image_checksum.dump_checksums")
     def test_checksum_one_file(self, dump_checksums, cc, exists):
         compose = DummyCompose(
@@ -57,7 +81,7 @@ class TestImageChecksumPhase(PungiTestCase):
         compose.image.add_checksum.assert_called_once_with(None, "sha256", "cafebabe")
 
     @mock.patch("os.path.exists")
-    @mock.patch("kobo.shortcuts.compute_file_checksums")
+    @mock.patch("pungi.checksums.ChecksumEngine.checksum")
     @mock.patch("pungi.phases.image_checksum.dump_checksums")
     def test_checksum_save_individuals(self, dump_checksums, cc, exists):
         compose = DummyCompose(self.topdir, {"media_checksums": ["md5", "sha256"]})
@@ -99,7 +123,7 @@ class TestImageChecksumPhase(PungiTestCase):
         )
 
     @mock.patch("os.path.exists")
-    @mock.patch("kobo.shortcuts.compute_file_checksums")
+    @mock.patch("pungi.checksums.ChecksumEngine.checksum")
     @mock.patch("pungi.phases.image_checksum.dump_checksums")
     def test_checksum_one_file_custom_name(self, dump_checksums, cc, exists):
         compose = DummyCompose(
@@ -130,7 +154,7 @@ class TestImageChecksumPhase(PungiTestCase):
         compose.image.add_checksum.assert_called_once_with(None, "sha256", "cafebabe")
 
     @mock.patch("os.path.exists")
-    @mock.patch("kobo.shortcuts.compute_file_checksums")
+    @mock.patch("pungi.checksums.ChecksumEngine.checksum")
     @mock.patch("pungi.phases.image_checksum.dump_checksums")
     def test_checksum_save_individuals_custom_name(self, dump_checksums, cc, exists):
         compose = DummyCompose(
@@ -180,7 +204,7 @@ class TestImageChecksumPhase(PungiTestCase):
         )
 
     @mock.patch("os.path.exists")
-    @mock.patch("kobo.shortcuts.compute_file_checksums")
+    @mock.patch("pungi.checksums.ChecksumEngine.checksum")
     @mock.patch("pungi.phases.image_checksum.dump_checksums")
     def test_checksum_save_individuals_custom_name_str_format(
         self, dump_checksums, cc, exists
@@ -232,6 +256,51 @@ class TestImageChecksumPhase(PungiTestCase):
         )
 
 
+class TestMakeChecksums(PungiTestCase):
+    def test_shared_image_is_hashed_once(self):
+        touch(os.path.join(self.topdir, "Server/source/iso/src.iso"), "src")
+        touch(os.path.join(self.topdir, "Server/x86_64/iso/x86_64.iso"), "x86_64")
+        src_images = [
+            mock.Mock(path="Server/source/iso/src.iso", size=3) for _ in range(2)
+        ]
+        binary_image = mock.Mock(path="Server/x86_64/iso/x86_64.iso", size=6)
+        im = mock.Mock(
+            images={
+                "Server": {
+                    "x86_64": [src_images[0], binary_image],
+                    "aarch64": [src_images[1]],
+                }
+            }
+        )
+        engine = ChecksumEngine(workers=2)
+
+        with mock.patch.object(
+            engine, "checksum", wraps=engine.checksum
+        ) as checksum, mock.patch("pungi.phases.image_checksum.dump_checksums") as dump:
+            make_checksums(
+                self.topdir, im, ["md5"], True, lambda *a, **kw: "", engine=engine
+            )
+
+        self.assertEqual(
+            sorted(call[0][0] for call in checksum.call_args_list),
+            [
+                os.path.join(self.topdir, "Server/source/iso/src.iso"),
+                os.path.join(self.topdir, "Server/x86_64/iso/x86_64.iso"),
+            ],
+        )
+        for image in src_images:
+            image.add_checksum.assert_called_once_with(
+                None, "md5", hashlib.md5(b"src").hexdigest()
+            )
+        self.assertEqual(
+            sorted(call[0][0] for call in dump.call_args_list),
+            [
+                os.path.join(self.topdir, "Server/source/iso/CHECKSUM"),
+                os.path.join(self.topdir, "Server/x86_64/iso/CHECKSUM"),
+            ],
+        )
+
+
 class TestDumpChecksums(unittest.TestCase):
     def setUp(self):
         self.tmp_dir = tempfile.mkdtemp()
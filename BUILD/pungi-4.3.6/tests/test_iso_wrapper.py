@@ -3,7 +3,9 @@
 import itertools
 import mock
 import os
+import shutil
 import six
+import tempfile
 
 try:
     import unittest2 as unittest
@@ -212,3 +214,75 @@ class TestCmpGraftPoints(unittest.TestCase):
 
     def test_all_kinds(self):
         self.assertSorted("etc/file", "ppc/file", "c.txt", "d.txt", "a.rpm", "b.rpm")
+
+
+class TestMergeTrees(unittest.TestCase):
+    def test_higher_priority_wins(self):
+        self.assertEqual(
+            iso._merge_trees(
+                {"a/foo": "/old/a/foo", "b/bar": "/old/b/bar"},
+                {"a/foo": "/new/a/foo"},
+            ),
+            {"a/foo": "/new/a/foo", "b/bar": "/old/b/bar"},
+        )
+
+    def test_exclusive_overrides_whole_dirs(self):
+        self.assertEqual(
+            iso._merge_trees(
+                {
+                    "a/foo": "/old/a/foo",
+                    "a/sub/baz": "/old/a/sub/baz",
+                    "ab/bar": "/old/ab/bar",
+                    "top": "/old/top",
+                },
+                {"a/new": "/new/a/new"},
+                exclusive=True,
+            ),
+            {"a/new": "/new/a/new", "ab/bar": "/old/ab/bar", "top": "/old/top"},
+        )
+
+
+class TestWriteGraftPoints(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gp = os.path.join(self.tmp_dir, "graft-points")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertGraftPoints(self, expected):
+        with open(self.gp) as f:
+            self.assertEqual(f.read().splitlines(), expected)
+
+    def test_skips_dirs_with_content(self):
+        iso.write_graft_points(
+            self.gp,
+            {
+                "Packages/": "/c/Packages/",
+                "Packages/a.rpm": "/c/Packages/a.rpm",
+                "empty/": "/c/empty/",
+                "images/boot.img": "/c/images/boot.img",
+                "readme": "/c/readme",
+            },
+        )
+        self.assertGraftPoints(
+            [
+                "images/boot.img=/c/images/boot.img",
+                "empty/=/c/empty/",
+                "readme=/c/readme",
+                "Packages/a.rpm=/c/Packages/a.rpm",
+            ]
+        )
+
+    def test_exclude(self):
+        iso.write_graft_points(
+            self.gp,
+            {
+                "images/boot.iso": "/c/images/boot.iso",
+                "lost+found/": "/c/lost+found/",
+                "x/lost+found": "/c/x/lost+found",
+                "readme": "/c/readme",
+            },
+            exclude=["*/lost+found", "*/boot.iso"],
+        )
+        self.assertGraftPoints(["lost+found/=/c/lost+found/", "readme=/c/readme"])
@@ -8,13 +8,22 @@ try:
 except ImportError:
     import unittest
 import tempfile
+import threading
+import time
 
 import os
 import shutil
 
+import koji
 import six
+import six.moves.xmlrpc_client as xmlrpclib
 
-from pungi.wrappers.kojiwrapper import KojiWrapper, get_buildroot_rpms
+from pungi.wrappers.kojiwrapper import (
+    KojiSessionPool,
+    KojiTaskWatcher,
+    KojiWrapper,
+    get_buildroot_rpms,
+)
 
 from .helpers import FIXTURE_DIR
 
@@ -856,178 +865,138 @@ class RunBlockingCmdTest(KojiWrapperBaseTestCase):
         )
         self.assertIn("Could not find task ID", str(ctx.exception))
 
+    def mock_watcher(self, *states):
+        watcher = mock.Mock()
+        watcher.wait.side_effect = [
+            {"id": 1234, "method": "image", "state": koji.TASK_STATES[state]}
+            for state in states
+        ]
+        self.koji.get_task_watcher = mock.Mock(return_value=watcher)
+        return watcher
+
     @mock.patch("pungi.wrappers.kojiwrapper.run")
-    def test_disconnect_and_retry(self, run):
-        output = "Created task: 1234\nerror: failed to connect\n"
-        retry = "Created task: 1234\nOook\n"
-        run.side_effect = [(1, output), (0, retry)]
+    def test_waits_in_process(self, run):
+        output = "Created task: 1234\nTask info: https://koji/taskinfo?taskID=1234\n"
+        run.return_value = (0, output)
+        watcher = self.mock_watcher("CLOSED")
 
-        result = self.koji.run_blocking_cmd("cmd")
+        result = self.koji.run_blocking_cmd(
+            ["koji", "image-build", "--wait"], log_file=self.tmpfile
+        )
 
-        self.assertDictEqual(result, {"retcode": 0, "output": retry, "task_id": 1234})
+        self.assertDictEqual(
+            result,
+            {"retcode": 0, "output": output + "1234 image: closed\n", "task_id": 1234},
+        )
         self.assertEqual(
             run.mock_calls,
             [
                 mock.call(
-                    "cmd",
+                    ["koji", "image-build", "--nowait"],
                     can_fail=True,
                     show_cmd=True,
-                    logfile=None,
+                    logfile=self.tmpfile,
                     env={"FOO": "BAR", "PYTHONUNBUFFERED": "1"},
                     buffer_size=-1,
                     universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
+                )
             ],
         )
+        self.assertEqual(watcher.wait.mock_calls, [mock.call(1234, max_retries=None)])
+        with open(self.tmpfile) as f:
+            self.assertEqual(f.read(), "1234 image: closed\n")
 
     @mock.patch("pungi.wrappers.kojiwrapper.run")
-    def test_disconnect_and_retry_but_fail(self, run):
-        output = "Created task: 1234\nerror: failed to connect\n"
-        retry = "Created task: 1234\nNot working still\n"
-        run.side_effect = [(1, output), (1, retry)]
+    def test_waits_in_process_for_failed_task(self, run):
+        output = "Created task: 1234\n"
+        run.return_value = (0, output)
+        self.mock_watcher("FAILED")
 
-        result = self.koji.run_blocking_cmd("cmd")
+        result = self.koji.run_blocking_cmd(["koji", "image-build", "--wait"])
+
+        self.assertDictEqual(
+            result,
+            {"retcode": 1, "output": output + "1234 image: failed\n", "task_id": 1234},
+        )
 
-        self.assertDictEqual(result, {"retcode": 1, "output": retry, "task_id": 1234})
+    @mock.patch("pungi.wrappers.kojiwrapper.run")
+    def test_failed_task_reports_reason(self, run):
+        output = "Created task: 1234\n"
+        run.return_value = (0, output)
+        self.mock_watcher("FAILED")
+        self.koji.koji_proxy.getTaskResult.side_effect = koji.GenericError(
+            "No space left on device"
+        )
+
+        result = self.koji.run_blocking_cmd(
+            ["koji", "image-build", "--wait"], log_file=self.tmpfile
+        )
+
+        expected = "1234 image: failed\nNo space left on device\n"
+        self.assertEqual(result["output"], output + expected)
+        self.assertEqual(result["retcode"], 1)
         self.assertEqual(
-            run.mock_calls,
-            [
-                mock.call(
-                    "cmd",
-                    can_fail=True,
-                    show_cmd=True,
-                    logfile=None,
-                    env={"FOO": "BAR", "PYTHONUNBUFFERED": "1"},
-                    buffer_size=-1,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-            ],
+            self.koji.koji_proxy.getTaskResult.call_args_list, [mock.call(1234)]
         )
+        with open(self.tmpfile) as f:
+            self.assertEqual(f.read(), expected)
 
-    @mock.patch("time.sleep")
     @mock.patch("pungi.wrappers.kojiwrapper.run")
-    def test_disconnect_and_retry_multiple_times(self, run, sleep):
+    def test_disconnect_and_retry(self, run):
         output = "Created task: 1234\nerror: failed to connect\n"
-        retry = "Created task: 1234\nOK\n"
-        run.side_effect = [(1, output), (1, output), (1, output), (0, retry)]
+        run.return_value = (1, output)
+        watcher = self.mock_watcher("CLOSED")
 
-        result = self.koji.run_blocking_cmd("cmd")
+        result = self.koji.run_blocking_cmd("cmd", max_retries=2)
 
-        self.assertDictEqual(result, {"retcode": 0, "output": retry, "task_id": 1234})
-        self.assertEqual(
-            run.mock_calls,
-            [
-                mock.call(
-                    "cmd",
-                    can_fail=True,
-                    show_cmd=True,
-                    logfile=None,
-                    env={"FOO": "BAR", "PYTHONUNBUFFERED": "1"},
-                    buffer_size=-1,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-            ],
+        self.assertDictEqual(
+            result,
+            {"retcode": 0, "output": output + "1234 image: closed\n", "task_id": 1234},
         )
-        self.assertEqual(sleep.mock_calls, [mock.call(i * 10) for i in range(1, 3)])
+        self.assertEqual(watcher.wait.mock_calls, [mock.call(1234, max_retries=2)])
 
-    @mock.patch("time.sleep")
     @mock.patch("pungi.wrappers.kojiwrapper.run")
-    def test_disconnect_and_never_reconnect(self, run, sleep):
+    def test_disconnect_and_never_reconnect(self, run):
         output = "Created task: 1234\nerror: failed to connect\n"
-        run.side_effect = [(1, output), (1, output), (1, output), (1, output)]
+        run.return_value = (1, output)
+        watcher = self.mock_watcher()
+        watcher.wait.side_effect = RuntimeError("Failed to wait for task 1234.")
 
         with self.assertRaises(RuntimeError) as ctx:
             self.koji.run_blocking_cmd("cmd", max_retries=2)
 
         self.assertIn("Failed to wait", str(ctx.exception))
-        self.assertEqual(
-            run.mock_calls,
-            [
-                mock.call(
-                    "cmd",
-                    can_fail=True,
-                    show_cmd=True,
-                    logfile=None,
-                    env={"FOO": "BAR", "PYTHONUNBUFFERED": "1"},
-                    buffer_size=-1,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-            ],
-        )
-        self.assertEqual(sleep.mock_calls, [mock.call(i * 10) for i in range(1, 2)])
 
     @mock.patch("pungi.wrappers.kojiwrapper.run")
     def test_server_offline_and_retry(self, run):
         output = "Created task: 1234\nkoji: ServerOffline:"
-        retry = "Created task: 1234\nOook\n"
-        run.side_effect = [(1, output), (0, retry)]
+        run.return_value = (1, output)
+        self.mock_watcher("CANCELED")
 
         result = self.koji.run_blocking_cmd("cmd")
 
-        self.assertDictEqual(result, {"retcode": 0, "output": retry, "task_id": 1234})
-        self.assertEqual(
-            run.mock_calls,
-            [
-                mock.call(
-                    "cmd",
-                    can_fail=True,
-                    show_cmd=True,
-                    logfile=None,
-                    env={"FOO": "BAR", "PYTHONUNBUFFERED": "1"},
-                    buffer_size=-1,
-                    universal_newlines=True,
-                ),
-                mock.call(
-                    ["koji", "--profile=custom-koji", "watch-task", "1234"],
-                    can_fail=True,
-                    logfile=None,
-                    universal_newlines=True,
-                ),
-            ],
+        self.assertDictEqual(
+            result,
+            {
+                "retcode": 1,
+                "output": output + "1234 image: canceled\n",
+                "task_id": 1234,
+            },
         )
 
+    def test_watch_task(self):
+        self.koji.koji_module.config.weburl = "https://koji"
+        watcher = self.mock_watcher("CLOSED")
+
+        self.assertEqual(self.koji.watch_task(1234, self.tmpfile, max_retries=3), 0)
+
+        self.assertEqual(watcher.wait.mock_calls, [mock.call(1234, max_retries=3)])
+        with open(self.tmpfile) as f:
+            self.assertEqual(
+                f.read(),
+                "Task URL: https://koji/taskinfo?taskID=1234\n1234 image: closed\n",
+            )
+
     def test_get_pungi_buildinstall_cmd(self):
         args = {"product": "Fedora 23"}
         cmd = self.koji.get_pungi_buildinstall_cmd(
@@ -1189,6 +1158,214 @@ RPM_LIST = [
 ]
 
 
+class KojiSessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.compose = mock.Mock(conf={"koji_profile": "custom-koji"})
+        self.compose.koji_sessions = KojiSessionPool(max_calls=2)
+        patcher = mock.patch("pungi.wrappers.kojiwrapper.koji")
+        self.koji = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.koji.get_profile_module.return_value = mock.Mock(
+            config=DumbMock(server="koji.example.com", authtype="kerberos", cert="")
+        )
+        self.koji.ClientSession.side_effect = self.make_session
+
+    def make_session(self, *args, **kwargs):
+        session = mock.Mock(logged_in=False)
+        session.subsession.side_effect = lambda: mock.Mock(logged_in=True)
+        session.gssapi_login.side_effect = lambda *args, **kwargs: setattr(
+            session, "logged_in", True
+        )
+        return session
+
+    def in_thread(self, func):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(func()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_session_per_thread(self):
+        first = KojiWrapper(self.compose)
+        second = KojiWrapper(self.compose)
+        other = self.in_thread(lambda: KojiWrapper(self.compose))
+
+        self.assertIs(first.koji_proxy, second.koji_proxy)
+        self.assertIsNot(first.koji_proxy, other.koji_proxy)
+        self.assertEqual(self.koji.ClientSession.call_count, 2)
+
+    def test_login_once(self):
+        def login():
+            wrapper = KojiWrapper(self.compose)
+            wrapper.login()
+            return wrapper
+
+        first = login()
+        second = login()
+        other = self.in_thread(login)
+
+        # One anonymous session for each thread and one for the login.
+        self.assertEqual(self.koji.ClientSession.call_count, 3)
+        [main] = self.compose.koji_sessions._logged_in.values()
+        self.assertEqual(main.gssapi_login.call_count, 1)
+        self.assertEqual(main.subsession.call_count, 2)
+        self.assertIs(first.koji_proxy, second.koji_proxy)
+        self.assertTrue(first.koji_proxy.logged_in)
+        self.assertTrue(other.koji_proxy.logged_in)
+        self.assertIsNot(first.koji_proxy, other.koji_proxy)
+        # The anonymous session of the thread is not replaced.
+        anonymous = KojiWrapper(self.compose).koji_proxy
+        self.assertFalse(anonymous.logged_in)
+        self.assertIsNot(anonymous, first.koji_proxy)
+
+    def test_login_again_when_expired(self):
+        self.koji.AuthExpired = koji.AuthExpired
+        KojiWrapper(self.compose).login()
+        [expired] = self.compose.koji_sessions._logged_in.values()
+        expired.subsession.side_effect = koji.AuthExpired("expired")
+
+        wrapper = self.in_thread(lambda: KojiWrapper(self.compose))
+        self.in_thread(wrapper.login)
+
+        [main] = self.compose.koji_sessions._logged_in.values()
+        self.assertIsNot(main, expired)
+        self.assertEqual(main.gssapi_login.call_count, 1)
+        self.assertEqual(main.subsession.call_count, 1)
+        self.assertTrue(wrapper.koji_proxy.logged_in)
+
+    def test_task_watcher_per_compose(self):
+        first = KojiWrapper(self.compose).get_task_watcher()
+        second = self.in_thread(lambda: KojiWrapper(self.compose).get_task_watcher())
+        other_compose = mock.Mock(conf={"koji_profile": "custom-koji"})
+        other_compose.koji_sessions = KojiSessionPool()
+        other = KojiWrapper(other_compose).get_task_watcher()
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        # The watcher does not share session with any wrapper.
+        self.assertIsNot(first.session, KojiWrapper(self.compose).koji_proxy)
+
+    def test_limits_concurrent_calls(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def call(*args, **kwargs):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.pop()
+
+        def make_session(*args, **kwargs):
+            return mock.Mock(_sendCall=call)
+
+        self.koji.ClientSession.side_effect = make_session
+        threads = [
+            threading.Thread(
+                target=lambda: KojiWrapper(self.compose).koji_proxy._sendCall("x")
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(peak), 5)
+        self.assertEqual(max(peak), 2)
+
+
+class KojiTaskWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.wrapper = mock.Mock()
+        self.session = mock.Mock()
+        self.watcher = KojiTaskWatcher(
+            self.wrapper, self.session, interval=0.01, max_interval=0.05
+        )
+
+    def task(self, task_id, state):
+        return {"id": task_id, "method": "image", "state": koji.TASK_STATES[state]}
+
+    def test_polls_all_tasks_at_once(self):
+        polls = []
+
+        def multicall_map(session, func, task_ids):
+            polls.append(task_ids)
+            if len(polls) == 1:
+                # Both tasks must be watched before the first poll finishes.
+                second.append(self.watcher.watch(2))
+                return [self.task(1, "OPEN")]
+            return [self.task(1, "CLOSED"), self.task(2, "FAILED")]
+
+        self.wrapper.multicall_map.side_effect = multicall_map
+        second = []
+        first = self.watcher.watch(1)
+
+        self.assertEqual(first.result(), self.task(1, "CLOSED"))
+        self.assertEqual(second[0].result(), self.task(2, "FAILED"))
+        self.assertEqual(polls, [[1], [1, 2]])
+        self.assertEqual(
+            self.wrapper.multicall_map.call_args[0][:2],
+            (self.session, self.session.getTaskInfo),
+        )
+
+    @mock.patch("pungi.wrappers.kojiwrapper.time.sleep")
+    def test_backoff_on_hub_errors(self, sleep):
+        self.wrapper.multicall_map.side_effect = [
+            xmlrpclib.ProtocolError("koji", 503, "Unavailable", {}),
+            IOError("Connection refused"),
+            koji.ServerOffline("Offline"),
+            [self.task(1, "CLOSED")],
+        ]
+
+        self.assertEqual(self.watcher.wait(1), self.task(1, "CLOSED"))
+        self.assertEqual(
+            sleep.mock_calls[:4],
+            [mock.call(0.02), mock.call(0.04), mock.call(0.05), mock.call(0.01)],
+        )
+
+    @mock.patch("pungi.wrappers.kojiwrapper.time.sleep")
+    def test_too_many_hub_errors(self, sleep):
+        self.wrapper.multicall_map.side_effect = IOError("Connection refused")
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.watcher.wait(1, max_retries=2)
+
+        self.assertIn("Failed to wait for task 1", str(ctx.exception))
+        self.assertEqual(self.wrapper.multicall_map.call_count, 2)
+
+    def test_unknown_task(self):
+        self.wrapper.multicall_map.return_value = [None]
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.watcher.wait(1)
+
+        self.assertIn("Task 1 does not exist", str(ctx.exception))
+
+    def test_unexpected_error(self):
+        self.wrapper.multicall_map.side_effect = [
+            TypeError("boom"),
+            [self.task(2, "CLOSED")],
+        ]
+
+        with self.assertRaises(TypeError):
+            self.watcher.wait(1)
+
+        # A new thread is started for tasks watched later.
+        self.assertEqual(self.watcher.wait(2), self.task(2, "CLOSED"))
+
+    def test_connections_closed_when_done(self):
+        self.wrapper.multicall_map.return_value = [self.task(1, "CLOSED")]
+
+        self.watcher.wait(1)
+        while self.watcher._thread:
+            time.sleep(0.01)
+
+        self.assertEqual(self.session.rsession.close.call_count, 1)
+
+
 class TestGetBuildrootRPMs(unittest.TestCase):
     @mock.patch("pungi.wrappers.kojiwrapper.KojiWrapper")
     def test_get_from_koji(self, KojiWrapper):
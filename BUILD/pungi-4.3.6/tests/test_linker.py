@@ -162,6 +162,30 @@ class TestLinkerCopy(TestLinkerBase):
         os.symlink(self.path_src, path_dst)
         self.assertRaises(OSError, self.linker.copy, self.path_src, path_dst)
 
+    def test_copy_does_not_check_new_destination(self):
+        path_dst = os.path.join(self.topdir, "b")
+
+        with mock.patch("os.stat", wraps=os.stat) as mock_stat:
+            with mock.patch("os.lstat", wraps=os.lstat) as mock_lstat:
+                self.linker.copy(self.path_src, path_dst)
+
+        checked = [
+            c[0][0] for c in mock_stat.call_args_list + mock_lstat.call_args_list
+        ]
+        self.assertNotIn(path_dst, checked)
+        self.assertTrue(os.path.isfile(path_dst))
+
+    def test_copy_to_existing_same_file(self):
+        path_dst = os.path.join(self.topdir, "b")
+        self.linker.copy(self.path_src, path_dst)
+
+        # Copying again finds the same file and keeps it.
+        self.linker.copy(self.path_src, path_dst)
+
+        self.assertDifferentFile(self.path_src, path_dst)
+        with open(path_dst) as f:
+            self.assertEqual(f.read(), "asdf")
+
 
 class TestLinkerLink(TestLinkerBase):
     def setUp(self):
@@ -229,6 +253,49 @@ class TestLinkerLink(TestLinkerBase):
         self.assertTrue(self.same_inode(self.path_src, dst))
         self.assertFalse(os.path.islink(dst))
 
+    def test_reflink_file(self):
+        dst = os.path.join(self.topdir, "reflink")
+
+        def _clone(dst_fd, request, src_fd):
+            os.write(dst_fd, os.read(src_fd, 100))
+
+        with mock.patch("fcntl.ioctl", side_effect=_clone) as ioctl:
+            self.linker.link(self.path_src, dst, link_type="reflink")
+            # The same file is already there.
+            self.linker.link(self.path_src, dst, link_type="reflink")
+        self.assertEqual(len(ioctl.call_args_list), 1)
+        self.assertEqual(ioctl.call_args_list[0][0][1], linker.FICLONE)
+        self.assertFalse(self.same_inode(self.path_src, dst))
+        self.assertSameStat(self.path_src, dst)
+
+    def test_reflink_or_copy_file(self):
+        dst = os.path.join(self.topdir, "reflink-or-copy")
+        with mock.patch(
+            "fcntl.ioctl", side_effect=IOError(errno.EXDEV, "Cross-device link")
+        ):
+            self.linker.link(self.path_src, dst, link_type="reflink-or-copy")
+        self.assertFalse(self.same_inode(self.path_src, dst))
+        self.assertTrue(self.same_content(self.path_src, dst))
+        self.assertSameStat(self.path_src, dst)
+
+    def test_reflink_or_hardlink_or_copy_file(self):
+        dst = os.path.join(self.topdir, "reflink-or-hardlink-or-copy")
+        with mock.patch(
+            "fcntl.ioctl", side_effect=IOError(errno.EOPNOTSUPP, "Not supported")
+        ):
+            self.linker.link(
+                self.path_src, dst, link_type="reflink-or-hardlink-or-copy"
+            )
+        self.assertTrue(self.same_inode(self.path_src, dst))
+
+    def test_reflink_to_existing_destination(self):
+        dst = self.touch("existing", "different content")
+        with mock.patch("fcntl.ioctl") as ioctl:
+            with self.assertRaises(OSError) as ctx:
+                self.linker.link(self.path_src, dst, link_type="reflink-or-copy")
+        self.assertEqual(ctx.exception.errno, errno.EEXIST)
+        self.assertEqual(ioctl.call_args_list, [])
+
     def test_link_file_test_mode(self):
         self.linker = linker.Linker(logger=self.logger, test=True)
 
@@ -296,6 +363,29 @@ class TestLinkerLink(TestLinkerBase):
         self.assertEqual(os.readlink(self.dst_symlink2), "subdir")
         self.assertEqual(os.readlink(self.dst_symlink3), "does-not-exist")
 
+    def test_link_dir_hardlink_in_parallel(self):
+        self.touch("src/subdir2/file4", "file4")
+        self.linker.link(self.src_dir, self.dst_dir, link_type="hardlink", workers=3)
+        self.assertTrue(self.same_inode(self.file1, self.dst_file1))
+        self.assertTrue(self.same_inode(self.file3, self.dst_file3))
+        self.assertTrue(os.path.isfile(os.path.join(self.dst_dir, "subdir2/file4")))
+        self.assertEqual(os.readlink(self.dst_symlink2), "subdir")
+        self.assertSameStat(
+            os.path.dirname(self.file3), os.path.dirname(self.dst_file3)
+        )
+
+    def test_link_dir_to_existing_tree(self):
+        self.touch("dst/subdir/other", "other")
+        self.linker.link(self.src_dir, self.dst_dir, link_type="hardlink")
+        self.assertTrue(self.same_inode(self.file3, self.dst_file3))
+        self.assertTrue(os.path.isfile(os.path.join(self.dst_dir, "subdir/other")))
+
+    def test_link_dir_over_file(self):
+        self.touch("dst/subdir", "file in the way")
+        with self.assertRaises(OSError) as ctx:
+            self.linker.link(self.src_dir, self.dst_dir, link_type="hardlink")
+        self.assertEqual(ctx.exception.errno, errno.EEXIST)
+
     def test_link_dir_copy(self):
         self.linker.link(self.src_dir, self.dst_dir, link_type="copy")
         self.assertTrue(os.path.isfile(self.dst_file1))
@@ -348,3 +438,112 @@ class TestLinkerLink(TestLinkerBase):
         self.assertTrue(self.same_inode(self.file1, self.hardlink1))
         self.linker.link(self.src_dir, self.dst_dir, link_type="copy")
         self.assertTrue(self.same_inode(self.dst_file1, self.dst_hardlink1))
+
+
+class TestCloneOrCopy(TestLinkerBase):
+    def test_reflink_supported(self):
+        dst = os.path.join(self.topdir, "clone")
+        with mock.patch("fcntl.ioctl") as ioctl:
+            linker.clone_or_copy(self.path_src, dst)
+
+        self.assertEqual(len(ioctl.call_args_list), 1)
+        self.assertEqual(ioctl.call_args_list[0][0][1], linker.FICLONE)
+        self.assertTrue(os.path.exists(dst))
+
+    def test_falls_back_to_copy(self):
+        dst = os.path.join(self.topdir, "copy")
+        with mock.patch(
+            "fcntl.ioctl", side_effect=IOError(errno.EOPNOTSUPP, "Not supported")
+        ):
+            linker.clone_or_copy(self.path_src, dst)
+
+        self.assertFalse(self.same_inode(self.path_src, dst))
+        self.assertTrue(self.same_content(self.path_src, dst))
+        self.assertSameStat(self.path_src, dst)
+
+    def test_copy_without_copy_file_range(self):
+        dst = os.path.join(self.topdir, "copy")
+        with mock.patch("os.copy_file_range", create=True, new=None):
+            linker.copy_file_data(self.path_src, dst)
+
+        self.assertTrue(self.same_content(self.path_src, dst))
+
+    def test_copy_file_range_unsupported(self):
+        dst = os.path.join(self.topdir, "copy")
+        with mock.patch(
+            "os.copy_file_range",
+            create=True,
+            side_effect=OSError(errno.EXDEV, "Cross-device link"),
+        ):
+            linker.copy_file_data(self.path_src, dst)
+
+        self.assertTrue(self.same_content(self.path_src, dst))
+
+    def test_sendfile_when_copy_file_range_unsupported(self):
+        dst = os.path.join(self.topdir, "copy")
+        if not hasattr(os, "sendfile"):
+            self.skipTest("sendfile is not available")
+        with mock.patch(
+            "os.copy_file_range",
+            create=True,
+            side_effect=OSError(errno.EXDEV, "Cross-device link"),
+        ):
+            with mock.patch("os.sendfile", wraps=os.sendfile) as sendfile:
+                linker.copy_file_data(self.path_src, dst)
+
+        self.assertTrue(self.same_content(self.path_src, dst))
+        self.assertEqual(len(sendfile.call_args_list), 1)
+
+    @mock.patch("time.sleep")
+    @mock.patch("time.time")
+    def test_copy_with_throttle(self, time, sleep):
+        time.return_value = 100
+        dst = os.path.join(self.topdir, "copy")
+        linker.copy_file_data(self.path_src, dst, throttle=linker.Throttle(2))
+
+        self.assertTrue(self.same_content(self.path_src, dst))
+        # Copying 4 bytes at 2 bytes per second should take 2 seconds.
+        self.assertEqual(sleep.call_args_list, [mock.call(2)])
+
+
+class TestThrottle(helpers.PungiTestCase):
+    @mock.patch("time.sleep")
+    @mock.patch("time.time")
+    def test_idle_time_is_not_credited(self, time, sleep):
+        throttle = linker.Throttle(10)
+        time.return_value = 100
+        throttle.consume(10)
+        time.return_value = 200
+        throttle.consume(5)
+
+        self.assertEqual(sleep.call_args_list, [mock.call(1), mock.call(0.5)])
+
+
+class TestLinkService(TestLinkerBase):
+    def test_links_planned_files(self):
+        service = linker.LinkService("hardlink", workers=2, logger=self.logger)
+        dst1 = os.path.join(self.topdir, "a", "b", "file")
+        dst2 = os.path.join(self.topdir, "c", "file")
+        service.add(self.path_src, dst1)
+        service.add(self.path_src, dst2)
+        service.add(self.path_src, dst1)
+
+        self.assertEqual(len(service), 2)
+        self.assertEqual(service.duplicates, 1)
+
+        with mock.patch("pungi.linker.makedirs", wraps=linker.makedirs) as mkdirs:
+            service.run()
+
+        self.assertTrue(self.same_inode(self.path_src, dst1))
+        self.assertTrue(self.same_inode(self.path_src, dst2))
+        self.assertEqual(
+            mkdirs.call_args_list,
+            [mock.call(os.path.dirname(dst1)), mock.call(os.path.dirname(dst2))],
+        )
+        self.assertEqual(len(self.logger.info.call_args_list), 1)
+        self.assertEqual(len(service), 0)
+
+    def test_nothing_planned(self):
+        service = linker.LinkService(logger=self.logger)
+        service.run()
+        self.assertEqual(self.logger.info.call_args_list, [])
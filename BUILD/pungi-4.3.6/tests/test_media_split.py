@@ -127,3 +127,113 @@ class MediaSplitterTestCase(unittest.TestCase):
         self.assertEqual(
             ms.split(), [{"files": ["first", "second", "third"], "size": bl(145)}]
         )
+
+    def test_split_ordered_with_groups_keeps_order(self):
+        ms = media_split.MediaSplitter(bl(100))
+        ms.add_file("first", bl(60), group="src")
+        ms.add_file("second", bl(50))
+        ms.add_file("third", bl(30), group="src")
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["first"], "size": bl(60)},
+                {"files": ["second", "third"], "size": bl(80)},
+            ],
+        )
+
+
+class BinPackingMediaSplitterTestCase(unittest.TestCase):
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            media_split.MediaSplitter(bl(100), method="random")
+
+    def test_uses_fewer_discs(self):
+        ms = media_split.MediaSplitter(bl(100), method="bin-packing")
+        ms.add_file("a", bl(60))
+        ms.add_file("b", bl(50))
+        ms.add_file("c", bl(40))
+        ms.add_file("d", bl(50))
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["a", "c"], "size": bl(100)},
+                {"files": ["b", "d"], "size": bl(100)},
+            ],
+        )
+
+    def test_sticky_files_on_all_discs(self):
+        logger = mock.Mock()
+        ms = media_split.MediaSplitter(bl(100), logger=logger, method="bin-packing")
+        ms.add_file("sticky", bl(20), sticky=True)
+        ms.add_file("a", bl(50))
+        ms.add_file("b", bl(30))
+        ms.add_file("c", bl(40))
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["sticky", "a"], "size": bl(70)},
+                {"files": ["sticky", "b", "c"], "size": bl(90)},
+            ],
+        )
+        self.assertEqual(
+            logger.debug.call_args_list,
+            [
+                mock.call("Disk 1: 2 files, 143360 bytes, 70.0% full"),
+                mock.call("Disk 2: 3 files, 184320 bytes, 90.0% full"),
+            ],
+        )
+
+    def test_keeps_groups_together(self):
+        ms = media_split.MediaSplitter(bl(100), method="bin-packing")
+        ms.add_file("bash", bl(50), group="bash.src")
+        ms.add_file("zsh", bl(40))
+        ms.add_file("bash-doc", bl(20), group="bash.src")
+        ms.add_file("tcsh", bl(30))
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["bash", "bash-doc"], "size": bl(70)},
+                {"files": ["zsh", "tcsh"], "size": bl(70)},
+            ],
+        )
+
+    def test_splits_group_bigger_than_disc(self):
+        ms = media_split.MediaSplitter(bl(100), method="bin-packing")
+        ms.add_file("kernel", bl(70), group="kernel.src")
+        ms.add_file("kernel-debug", bl(60), group="kernel.src")
+        ms.add_file("bash", bl(30))
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["kernel"], "size": bl(70)},
+                {"files": ["kernel-debug", "bash"], "size": bl(90)},
+            ],
+        )
+
+    def test_fills_disk_with_most_free_space(self):
+        ms = media_split.MediaSplitter(bl(100), method="bin-packing")
+        ms.add_file("a", bl(60))
+        ms.add_file("b", bl(55))
+        ms.add_file("c", bl(30))
+        ms.add_file("d", bl(20))
+        ms.add_file("e", bl(10))
+
+        self.assertEqual(
+            ms.split(),
+            [
+                {"files": ["a", "d", "e"], "size": bl(90)},
+                {"files": ["b", "c"], "size": bl(85)},
+            ],
+        )
+
+    def test_unlimited_media(self):
+        ms = media_split.MediaSplitter(None, method="bin-packing")
+        ms.add_file("first", bl(25))
+        ms.add_file("second", bl(40))
+
+        self.assertEqual(ms.split(), [{"files": ["first", "second"], "size": bl(65)}])
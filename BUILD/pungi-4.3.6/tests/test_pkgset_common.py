@@ -192,10 +192,14 @@ class TestCreateArchRepos(helpers.PungiTestCase):
         mock_copy_all.assert_has_calls(
             [
                 mock.call(
-                    old_repo, os.path.join(self.compose.topdir, "work/amd64/repo/foo")
+                    old_repo,
+                    os.path.join(self.compose.topdir, "work/amd64/repo/foo"),
+                    workers=10,
                 ),
                 mock.call(
-                    old_repo, os.path.join(self.compose.topdir, "work/x86_64/repo/foo")
+                    old_repo,
+                    os.path.join(self.compose.topdir, "work/x86_64/repo/foo"),
+                    workers=10,
                 ),
             ],
             any_order=True,
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+
+import mock
+import six
+
+from pungi import profiler
+from pungi.profiler import Profiler
+from tests.helpers import PungiTestCase
+
+
+class TestProfiler(PungiTestCase):
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        Profiler.reset()
+        Profiler.enable()
+        self.addCleanup(Profiler.reset)
+        self.addCleanup(Profiler.enable, False)
+
+    def get_node(self, *path):
+        for node in Profiler.get_results():
+            if node["path"] == list(path):
+                return node
+        self.fail("No node %s" % (path,))
+
+    def test_nested(self):
+        @Profiler("inner")
+        def inner():
+            pass
+
+        with Profiler("outer"):
+            inner()
+            inner()
+        inner()
+
+        self.assertEqual(
+            [node["path"] for node in Profiler.get_results()],
+            [["inner"], ["outer"], ["outer", "inner"]],
+        )
+        self.assertEqual(self.get_node("outer", "inner")["calls"], 2)
+        self.assertEqual(self.get_node("inner")["calls"], 1)
+
+    @mock.patch("pungi.profiler._cpu_time")
+    @mock.patch("time.time")
+    def test_statistics(self, wall, cpu):
+        wall.side_effect = [0, 10, 11, 11, 12, 12, 20, 29]
+        cpu.side_effect = [0, 2, 3, 3, 3, 3, 4, 5]
+        with Profiler("outer"):
+            with Profiler("inner"):
+                pass
+            with Profiler("inner"):
+                pass
+            with Profiler("inner"):
+                pass
+
+        inner = self.get_node("outer", "inner")
+        self.assertEqual(inner["calls"], 3)
+        self.assertEqual(inner["wall"], 10)
+        self.assertEqual(inner["cpu"], 2)
+        self.assertEqual((inner["min"], inner["max"]), (1, 8))
+        self.assertEqual((inner["p50"], inner["p99"]), (1, 8))
+        outer = self.get_node("outer")
+        self.assertEqual((outer["wall"], outer["self_wall"]), (29, 19))
+
+    def test_threads_have_separate_stacks(self):
+        event = threading.Event()
+
+        def _worker():
+            with Profiler("worker"):
+                event.wait(5)
+
+        thread = threading.Thread(target=_worker)
+        with Profiler("main"):
+            thread.start()
+        event.set()
+        thread.join()
+
+        self.assertEqual(
+            [node["path"] for node in Profiler.get_results()], [["main"], ["worker"]]
+        )
+
+    def test_write_results(self):
+        with Profiler("a;b"):
+            with Profiler("c"):
+                threading.Event().wait(0.01)
+
+        prefix = os.path.join(self.topdir, "out", "profile")
+        profiler.write_results(prefix)
+
+        with open(prefix + ".json") as f:
+            data = json.load(f)
+        self.assertEqual(len(data["nodes"]), 2)
+        with open(prefix + ".folded") as f:
+            lines = f.read().splitlines()
+        six.assertRegex(self, lines[-1], r"^a,b;c \d+$")
+
+    def test_disabled(self):
+        Profiler.enable(False)
+
+        @Profiler("decorated")
+        def func():
+            return 42
+
+        with Profiler("block"):
+            self.assertEqual(func(), 42)
+
+        self.assertEqual(Profiler.get_results(), [])
+        self.assertEqual(Profiler._get_stack(), [])
+
+    def test_output_prefix(self):
+        with mock.patch.dict(os.environ, {profiler.ENV_VAR: "/tmp/profiles"}):
+            self.assertEqual(
+                profiler.get_output_prefix(None, "pungi-koji"),
+                "/tmp/profiles/pungi-koji-%d" % os.getpid(),
+            )
+            self.assertEqual(profiler.get_output_prefix("/foo", "pungi-koji"), "/foo")
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertIsNone(profiler.get_output_prefix(None, "pungi-koji"))
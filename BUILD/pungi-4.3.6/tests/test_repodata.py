@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import createrepo_c as cr
+
+from pungi.repodata import RepodataAssembler, RepodataFinaliser
+from tests.helpers import PungiTestCase, touch
+
+
+def _make_package(name, location_href):
+    pkg = cr.Package()
+    pkg.name = name
+    pkg.epoch = "0"
+    pkg.version = "1.0"
+    pkg.release = "1"
+    pkg.arch = "x86_64"
+    pkg.pkgId = name * 8
+    pkg.checksum_type = "sha256"
+    pkg.location_href = location_href
+    pkg.location_base = "file:///mnt/koji"
+    pkg.files = [(None, "/usr/bin/", name)]
+    return pkg
+
+
+def _load_packages(repo_dir):
+    md = cr.Metadata()
+    md.locate_and_load_xml(repo_dir)
+    return dict(
+        (md.get(key).location_href, md.get(key).location_base) for key in md.keys()
+    )
+
+
+class TestRepodataAssembler(PungiTestCase):
+    def setUp(self):
+        super(TestRepodataAssembler, self).setUp()
+        self.source_repo = os.path.join(self.topdir, "source")
+        self.repo_dir = os.path.join(self.topdir, "repo")
+        os.makedirs(self.source_repo)
+        os.makedirs(self.repo_dir)
+        source = RepodataAssembler(self.source_repo)
+        for name in ("bash", "zsh"):
+            pkg = _make_package(
+                name, "packages/%s/1.0/1/x86_64/%s-1.0-1.x86_64.rpm" % (name, name)
+            )
+            source.packages[pkg.location_href] = pkg
+        source.write()
+
+    def test_reuses_records_from_source(self):
+        assembler = RepodataAssembler(self.repo_dir)
+        missing = assembler.add_packages(
+            self.source_repo,
+            [
+                "Packages/b/bash-1.0-1.x86_64.rpm",
+                "Packages/f/foo-1.0-1.x86_64.rpm",
+            ],
+        )
+        assembler.write()
+
+        self.assertEqual(missing, ["Packages/f/foo-1.0-1.x86_64.rpm"])
+        self.assertEqual(
+            _load_packages(self.repo_dir),
+            {"Packages/b/bash-1.0-1.x86_64.rpm": None},
+        )
+
+    def test_adds_packages_from_other_repo(self):
+        extra_repo = os.path.join(self.topdir, "extra")
+        os.makedirs(extra_repo)
+        extra = RepodataAssembler(extra_repo)
+        pkg = _make_package("foo", "Packages/f/foo-1.0-1.x86_64.rpm")
+        pkg.location_base = None
+        extra.packages[pkg.location_href] = pkg
+        extra.write()
+
+        assembler = RepodataAssembler(self.repo_dir)
+        assembler.add_packages(self.source_repo, ["Packages/z/zsh-1.0-1.x86_64.rpm"])
+        assembler.add_repo(extra_repo)
+        assembler.write()
+
+        self.assertEqual(
+            _load_packages(self.repo_dir),
+            {
+                "Packages/f/foo-1.0-1.x86_64.rpm": None,
+                "Packages/z/zsh-1.0-1.x86_64.rpm": None,
+            },
+        )
+
+    def test_writes_database_and_comps(self):
+        comps = os.path.join(self.topdir, "comps.xml")
+        touch(comps, "<comps/>\n")
+        assembler = RepodataAssembler(self.repo_dir, database=True)
+        assembler.add_packages(self.source_repo, ["Packages/b/bash-1.0-1.x86_64.rpm"])
+        assembler.write(groupfile=comps)
+
+        repomd = cr.Repomd(os.path.join(self.repo_dir, "repodata", "repomd.xml"))
+        self.assertEqual(
+            sorted(record.type for record in repomd.records),
+            [
+                "filelists",
+                "filelists_db",
+                "group",
+                "group_gz",
+                "other",
+                "other_db",
+                "primary",
+                "primary_db",
+            ],
+        )
+        for record in repomd.records:
+            self.assertTrue(
+                os.path.isfile(os.path.join(self.repo_dir, record.location_href))
+            )
+
+    def test_replaces_existing_repodata(self):
+        touch(os.path.join(self.repo_dir, "repodata", "stale.xml"))
+        assembler = RepodataAssembler(self.repo_dir)
+        assembler.add_packages(self.source_repo, ["Packages/b/bash-1.0-1.x86_64.rpm"])
+        assembler.write()
+
+        self.assertEqual(
+            sorted(os.listdir(self.repo_dir)),
+            ["repodata"],
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.repo_dir, "repodata", "stale.xml"))
+        )
+
+
+class TestRepodataFinaliser(PungiTestCase):
+    def setUp(self):
+        super(TestRepodataFinaliser, self).setUp()
+        self.repo_dir = os.path.join(self.topdir, "repo")
+        os.makedirs(self.repo_dir)
+        assembler = RepodataAssembler(self.repo_dir)
+        pkg = _make_package("bash", "Packages/b/bash-1.0-1.x86_64.rpm")
+        assembler.packages[pkg.location_href] = pkg
+        assembler.write()
+        self.repodata = os.path.join(self.repo_dir, "repodata")
+
+    def _get_records(self):
+        repomd = cr.Repomd(os.path.join(self.repodata, "repomd.xml"))
+        return dict((record.type, record.location_href) for record in repomd.records)
+
+    def test_adds_files_in_one_pass(self):
+        product_id = os.path.join(self.topdir, "productid")
+        touch(product_id, "certificate\n")
+        finaliser = RepodataFinaliser(self.repo_dir)
+        finaliser.add_file("productid", product_id)
+        finaliser.add_content("modules", "modules.yaml", "---\n...\n")
+        locations = finaliser.write()
+
+        records = self._get_records()
+        self.assertEqual(
+            sorted(records), ["filelists", "modules", "other", "primary", "productid"]
+        )
+        self.assertEqual(locations["productid"], records["productid"])
+        self.assertEqual(locations["modules"], records["modules"])
+        self.assertTrue(locations["modules"].endswith("-modules.yaml.gz"))
+        for location in records.values():
+            self.assertTrue(os.path.isfile(os.path.join(self.repo_dir, location)))
+        # No leftovers from staging.
+        self.assertEqual(
+            sorted(f for f in os.listdir(self.repodata) if f.startswith(".")), []
+        )
+
+    def test_replaces_existing_record(self):
+        finaliser = RepodataFinaliser(self.repo_dir)
+        finaliser.add_content("modules", "modules.yaml", "---\nold\n...\n")
+        old_location = finaliser.write()["modules"]
+
+        finaliser = RepodataFinaliser(self.repo_dir)
+        finaliser.add_content("modules", "modules.yaml", "---\nnew\n...\n")
+        new_location = finaliser.write()["modules"]
+
+        self.assertNotEqual(old_location, new_location)
+        self.assertEqual(self._get_records()["modules"], new_location)
+        self.assertFalse(os.path.exists(os.path.join(self.repo_dir, old_location)))
+
+    def test_nothing_to_add(self):
+        with open(os.path.join(self.repodata, "repomd.xml")) as f:
+            repomd = f.read()
+        self.assertEqual(RepodataFinaliser(self.repo_dir).write(), {})
+        self.assertFileContent(os.path.join(self.repodata, "repomd.xml"), repomd)
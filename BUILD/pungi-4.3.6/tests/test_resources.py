@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+
+import mock
+from kobo.shortcuts import run
+
+from pungi import resources
+from pungi.phases.base import PhaseBase
+from tests.helpers import DummyCompose, PungiTestCase
+
+BURN_CPU = "import time\nt = time.time()\nwhile time.time() - t < 0.3: pass"
+
+
+class DummyPhase(PhaseBase):
+    name = "dummy"
+
+    def run(self):
+        run([sys.executable, "-c", BURN_CPU])
+
+
+class TestParseStat(PungiTestCase):
+    def test_command_with_spaces(self):
+        fields = ["S", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]
+        fields += ["100", "50", "7", "3", "20", "0", "1", "0", "12345", "4096", "25"]
+        data = "42 (tricky) name) %s\n" % " ".join(fields)
+
+        self.assertEqual(
+            resources._parse_stat(data),
+            {
+                "ppid": 1,
+                "utime": 100,
+                "stime": 50,
+                "cutime": 7,
+                "cstime": 3,
+                "rss": 25,
+            },
+        )
+
+
+class TestResourceMonitor(PungiTestCase):
+    def setUp(self):
+        super(TestResourceMonitor, self).setUp()
+        if not os.path.isdir("/proc/self"):
+            self.skipTest("/proc is not available")
+        self.monitor = resources.start_monitoring(0.05)
+        self.addCleanup(resources.stop_monitoring)
+
+    def test_get_usage(self):
+        usage = resources.get_usage()
+        self.assertGreater(usage.rss, 0)
+        self.assertGreater(usage.cpu, 0)
+
+    def test_total_includes_children(self):
+        compose = DummyCompose(self.topdir, {})
+        compose.just_phases = []
+        compose.skip_phases = []
+        compose.notifier = mock.Mock()
+        phase = DummyPhase(compose)
+        phase.start()
+        phase.stop()
+        resources.stop_monitoring()
+
+        summary = self.monitor.get_summary()
+        total = summary["total"]
+        # The child burned 0.3 seconds of CPU time and was reaped already.
+        self.assertGreaterEqual(total["cpu_seconds"], 0.25)
+        self.assertGreater(total["peak_rss"], 0)
+        self.assertGreaterEqual(total["read_bytes"], 0)
+        self.assertGreaterEqual(total["write_bytes"], 0)
+        # Phases only record when they ran.
+        dummy = summary["phases"]["dummy"]
+        self.assertEqual(sorted(dummy), ["duration", "start"])
+        self.assertGreaterEqual(dummy["duration"], 0.25)
+        self.assertGreaterEqual(len(summary["samples"]), 2)
+        self.assertGreaterEqual(summary["samples"][-1]["cpu_seconds"], 0.25)
+
+    def test_phases_do_not_scan_proc(self):
+        # Not started, so that the sampling thread does not interfere.
+        monitor = resources.ResourceMonitor()
+        with mock.patch("pungi.resources.get_usage") as get_usage:
+            monitor.started("phases", "dummy")
+            monitor.stopped("phases", "dummy")
+
+        self.assertEqual(get_usage.mock_calls, [])
+        self.assertIsNotNone(monitor.records[("phases", "dummy")].end_time)
+
+    def test_tasks_and_dump(self):
+        resources.task_started("treeinfo")
+        resources.task_stopped("treeinfo")
+        path = os.path.join(self.topdir, "resources.json")
+        resources.stop_monitoring(path)
+
+        with open(path) as f:
+            summary = json.load(f)
+        self.assertEqual(list(summary["tasks"]), ["treeinfo"])
+        self.assertEqual(summary["phases"], {})
+        self.assertEqual(summary["interval"], 0.05)
+        self.assertGreaterEqual(
+            summary["total"]["duration"], summary["tasks"]["treeinfo"]["duration"]
+        )
+
+    def test_stopping_unknown_phase(self):
+        resources.phase_stopped("unknown")
+        self.assertEqual(self.monitor.get_summary()["phases"], {})
+
+    def test_disabled(self):
+        resources.stop_monitoring()
+        resources.phase_started("dummy")
+        resources.phase_stopped("dummy")
+        self.assertIsNone(resources.stop_monitoring())
+        self.assertNotIn("dummy", self.monitor.get_summary()["phases"])
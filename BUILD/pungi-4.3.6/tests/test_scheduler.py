@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import mock
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from pungi import scheduler
+
+
+class TestTaskScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = scheduler.TaskScheduler(max_workers=4)
+        self.order = []
+        self.lock = threading.Lock()
+
+    def _task(self, name, event=None):
+        def _run():
+            if event:
+                event.wait(5)
+            with self.lock:
+                self.order.append(name)
+
+        return _run
+
+    def test_runs_dependencies_first(self):
+        self.scheduler.add("gather", self._task("gather"))
+        self.scheduler.add("createrepo", self._task("createrepo"), deps=["gather"])
+        self.scheduler.add("treeinfo", self._task("treeinfo"), deps=["createrepo"])
+
+        self.scheduler.run()
+
+        self.assertEqual(self.order, ["gather", "createrepo", "treeinfo"])
+
+    def test_does_not_wait_for_unrelated_tasks(self):
+        slow = threading.Event()
+        self.scheduler.add("buildinstall", self._task("buildinstall", slow))
+        self.scheduler.add("gather", self._task("gather"))
+
+        def _createrepo():
+            self.order.append("createrepo")
+            # Finishing buildinstall only now means createrepo did not wait
+            # for it.
+            slow.set()
+
+        self.scheduler.add("createrepo", _createrepo, deps=["gather"])
+
+        self.scheduler.run()
+
+        self.assertEqual(self.order, ["gather", "createrepo", "buildinstall"])
+
+    def test_limits_number_of_running_tasks(self):
+        self.scheduler = scheduler.TaskScheduler(max_workers=2)
+        running = []
+        peak = []
+
+        def _task():
+            with self.lock:
+                running.append(1)
+                peak.append(len(running))
+            threading.Event().wait(0.05)
+            with self.lock:
+                running.pop()
+
+        for i in range(6):
+            self.scheduler.add("task-%d" % i, _task)
+
+        self.scheduler.run()
+
+        self.assertEqual(max(peak), 2)
+
+    def test_failure_stops_scheduling(self):
+        def _fail():
+            raise RuntimeError("Boom")
+
+        self.scheduler.add("gather", _fail)
+        self.scheduler.add("createrepo", self._task("createrepo"), deps=["gather"])
+
+        with self.assertRaises(RuntimeError) as ctx:
+            self.scheduler.run()
+
+        self.assertEqual(str(ctx.exception), "Boom")
+        self.assertEqual(self.order, [])
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.add("createrepo", self._task("createrepo"), deps=["gather"])
+
+    def test_duplicate_task(self):
+        self.scheduler.add("gather", self._task("gather"))
+        with self.assertRaises(ValueError):
+            self.scheduler.add("gather", self._task("gather"))
+
+    def test_add_phase(self):
+        phase = mock.Mock()
+        phase.name = "gather"
+        self.scheduler.add_phase(phase)
+
+        self.scheduler.run()
+
+        self.assertEqual(phase.mock_calls, [mock.call.start(), mock.call.stop()])
+
+    def test_add_split_phase(self):
+        server = mock.Mock(uid="Server")
+        client = mock.Mock(uid="Client")
+        phase = mock.Mock()
+        phase.name = "createiso"
+        phase.skip.return_value = False
+        phase.get_parts.return_value = [(server, "x86_64"), (client, "x86_64")]
+        self.scheduler.add("treeinfo-Server.x86_64", self._task("treeinfo"))
+
+        parts = self.scheduler.add_split_phase(
+            phase,
+            part_deps=lambda variant, arch: ["treeinfo-%s.%s" % (variant.uid, arch)]
+            if variant is server
+            else [],
+        )
+        self.scheduler.run()
+
+        self.assertEqual(
+            dict(parts),
+            {
+                ("Server", "x86_64"): "createiso-Server.x86_64",
+                ("Client", "x86_64"): "createiso-Client.x86_64",
+            },
+        )
+        calls = phase.mock_calls
+        self.assertEqual(
+            calls[:2], [mock.call.get_parts(), mock.call.start(split=True)]
+        )
+        self.assertEqual(calls[-1], mock.call.stop())
+        self.assertIn(mock.call.run_part(server, "x86_64"), calls)
+        self.assertIn(mock.call.run_part(client, "x86_64"), calls)
+        task = dict((t.name, t) for t in self.scheduler.tasks)
+        self.assertEqual(
+            task["createiso-Server.x86_64"].deps, ["treeinfo-Server.x86_64"]
+        )
+        self.assertEqual(
+            task["createiso"].deps,
+            ["createiso-Server.x86_64", "createiso-Client.x86_64"],
+        )
+
+    def test_split_phase_starts_with_first_part(self):
+        phase = mock.Mock()
+        phase.name = "createiso"
+        phase.skip.return_value = False
+        phase.get_parts.return_value = [(mock.Mock(uid="Server"), "x86_64")]
+
+        def _treeinfo():
+            self.assertEqual(phase.start.call_count, 0)
+
+        self.scheduler.add("treeinfo-Server.x86_64", _treeinfo)
+        self.scheduler.add_split_phase(
+            phase, part_deps=lambda variant, arch: ["treeinfo-Server.x86_64"]
+        )
+        self.scheduler.run()
+
+        phase.start.assert_called_once_with(split=True)
+
+    def test_split_phase_without_parts(self):
+        phase = mock.Mock()
+        phase.name = "createiso"
+        phase.get_parts.return_value = []
+        self.scheduler.add_split_phase(phase)
+
+        self.scheduler.run()
+
+        self.assertEqual(
+            phase.mock_calls,
+            [mock.call.get_parts(), mock.call.start(split=True), mock.call.stop()],
+        )
+
+    def test_split_phase_skipped(self):
+        phase = mock.Mock()
+        phase.name = "createrepo"
+        phase.skip.return_value = True
+        phase.get_parts.return_value = [(mock.Mock(uid="Server"), "src")]
+        self.scheduler.add_split_phase(phase)
+
+        self.scheduler.run()
+
+        self.assertNotIn("run_part", [c[0] for c in phase.mock_calls])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import kobo.shortcuts
+import mock
+from kobo.threads import ThreadPool, WorkerThread
+
+from pungi import tracing
+from pungi.phases.base import PhaseBase
+from tests.helpers import DummyCompose, PungiTestCase
+
+
+class DummyThread(WorkerThread):
+    def process(self, item, num):
+        pass
+
+
+class DummyPhase(PhaseBase):
+    name = "dummy"
+
+    def run(self):
+        self.pool = ThreadPool()
+        self.pool.add(DummyThread(self.pool))
+        self.pool.queue_put((self.compose.variants["Server"], "x86_64"))
+        self.pool.start()
+
+
+class TestTracing(PungiTestCase):
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.tracer = tracing.start_tracing()
+        self.addCleanup(tracing.stop_tracing)
+        self.addCleanup(tracing.set_context)
+
+    def get_spans(self, category):
+        return [e for e in self.tracer.events if e["cat"] == category]
+
+    def test_disabled(self):
+        tracing.stop_tracing()
+        with tracing.span("foo", "test"):
+            pass
+        self.assertIsNone(tracing.get_tracer())
+        self.assertEqual(self.tracer.events, [])
+
+    def test_phase_and_worker_spans(self):
+        compose = DummyCompose(self.topdir, {})
+        compose.just_phases = []
+        compose.skip_phases = []
+        compose.notifier = mock.Mock()
+        phase = DummyPhase(compose)
+        phase.start()
+        phase.stop()
+
+        [phase_span] = self.get_spans("phase")
+        self.assertEqual(phase_span["name"], "dummy")
+        [worker_span] = self.get_spans("worker")
+        self.assertEqual(worker_span["name"], "DummyThread.process")
+        self.assertEqual(worker_span["args"]["phase"], "dummy")
+        self.assertEqual(worker_span["args"]["variant"], "Server")
+        self.assertEqual(worker_span["args"]["arch"], "x86_64")
+        self.assertNotEqual(worker_span["tid"], phase_span["tid"])
+        self.assertGreaterEqual(worker_span["ts"], phase_span["ts"])
+
+    def test_run_spans(self):
+        kobo.shortcuts.run(["true"], workdir=self.topdir)
+
+        [span] = self.get_spans("subprocess")
+        self.assertEqual(span["name"], "true")
+        self.assertEqual(span["args"], {"cmd": "true", "workdir": self.topdir})
+
+    def test_hooks_fall_through_when_stopped(self):
+        # Wrapper captured by a module while tracing was active.
+        run = kobo.shortcuts.run
+        tracing.stop_tracing()
+
+        self.assertEqual(run(["true"])[0], 0)
+        compose = DummyCompose(self.topdir, {})
+        compose.just_phases = []
+        compose.skip_phases = []
+        compose.notifier = mock.Mock()
+        phase = DummyPhase(compose)
+        phase.start()
+        phase.stop()
+        self.assertEqual(self.tracer.events, [])
+
+    def test_restart(self):
+        tracing.stop_tracing()
+        tracer = tracing.start_tracing()
+
+        kobo.shortcuts.run(["true"])
+
+        self.assertEqual(self.tracer.events, [])
+        [span] = [e for e in tracer.events if e["cat"] == "subprocess"]
+        self.assertEqual(span["name"], "true")
+
+    def test_dump(self):
+        with tracing.span("foo", "test", variant="Server"):
+            pass
+        path = os.path.join(self.topdir, "trace.json")
+        tracing.stop_tracing(path)
+
+        with open(path) as f:
+            trace = json.load(f)
+        events = trace["traceEvents"]
+        self.assertEqual(events[0]["ph"], "M")
+        self.assertEqual(events[1]["name"], "foo")
+        self.assertEqual(events[1]["ph"], "X")
+        self.assertEqual(events[1]["args"], {"variant": "Server"})
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import mock
+
+from pungi import treescan
+from tests.helpers import PungiTestCase, touch
+
+
+class TestScanTree(PungiTestCase):
+    def test_scan(self):
+        touch(os.path.join(self.topdir, "tree/top"), "top")
+        touch(os.path.join(self.topdir, "tree/a/b/nested"), "nested")
+        os.makedirs(os.path.join(self.topdir, "tree/empty"))
+        os.symlink(
+            os.path.join(self.topdir, "tree/a"), os.path.join(self.topdir, "tree/link")
+        )
+
+        snapshot = treescan.scan_tree(os.path.join(self.topdir, "tree"))
+
+        self.assertEqual(
+            [(entry.rel_path, entry.size) for entry in snapshot.files],
+            [("top", 3), ("a/b/nested", 6)],
+        )
+        self.assertEqual(sorted(snapshot.dirs), ["a", "a/b", "empty"])
+        info = os.stat(os.path.join(self.topdir, "tree/top"))
+        self.assertEqual(
+            snapshot.files[0],
+            treescan.TreeEntry(
+                "top",
+                os.path.join(self.topdir, "tree/top"),
+                3,
+                info.st_dev,
+                info.st_ino,
+                1,
+            ),
+        )
+
+    def test_missing_tree(self):
+        snapshot = treescan.scan_tree(os.path.join(self.topdir, "missing"))
+        self.assertEqual(snapshot.files, [])
+        self.assertEqual(snapshot.dirs, [])
+
+
+class TestListTree(PungiTestCase):
+    def setUp(self):
+        super(TestListTree, self).setUp()
+        self.tree = os.path.join(self.topdir, "tree")
+        touch(os.path.join(self.tree, "top"))
+        touch(os.path.join(self.tree, "a/b/nested"))
+        touch(os.path.join(self.tree, "c/file"))
+        os.makedirs(os.path.join(self.tree, "a/empty"))
+        os.symlink("a", os.path.join(self.tree, "link"))
+
+    def assertListed(self, result):
+        dirs, files = result
+        self.assertEqual(sorted(dirs), ["a", "a/b", "a/empty", "c"])
+        self.assertLess(dirs.index("a"), dirs.index("a/b"))
+        self.assertEqual(sorted(files), ["a/b/nested", "c/file", "link", "top"])
+
+    def test_list(self):
+        with mock.patch("os.stat") as stat:
+            self.assertListed(treescan.list_tree(self.tree))
+        self.assertEqual(stat.call_args_list, [])
+
+    def test_list_in_parallel(self):
+        self.assertListed(treescan.list_tree(self.tree, workers=3))
+
+    def test_missing_tree(self):
+        with self.assertRaises(OSError):
+            treescan.list_tree(os.path.join(self.topdir, "missing"))
+
+
+class TestTreeScanner(PungiTestCase):
+    def setUp(self):
+        super(TestTreeScanner, self).setUp()
+        self.tree = os.path.join(self.topdir, "tree")
+        touch(os.path.join(self.tree, "Packages/b/bash.rpm"))
+        touch(os.path.join(self.tree, "repodata/repomd.xml"))
+        self.scanner = treescan.TreeScanner()
+
+    def test_scans_tree_once(self):
+        with mock.patch("pungi.treescan.scan_tree", wraps=treescan.scan_tree) as scan:
+            first = self.scanner.scan(self.tree)
+            second = self.scanner.scan(self.tree)
+
+        self.assertIs(first, second)
+        self.assertEqual(scan.call_args_list, [mock.call(self.tree)])
+
+    def test_subtree_from_cached_parent(self):
+        self.scanner.scan(self.tree)
+        with mock.patch("pungi.treescan.scan_tree") as scan:
+            snapshot = self.scanner.scan(os.path.join(self.tree, "Packages"))
+
+        self.assertEqual(scan.call_args_list, [])
+        self.assertEqual(snapshot.topdir, os.path.join(self.tree, "Packages"))
+        self.assertEqual(
+            [(entry.rel_path, entry.path) for entry in snapshot.files],
+            [("b/bash.rpm", os.path.join(self.tree, "Packages/b/bash.rpm"))],
+        )
+        self.assertEqual(snapshot.dirs, ["b"])
+
+    def test_invalidate_subdir(self):
+        self.scanner.scan(self.tree)
+        touch(os.path.join(self.tree, "Packages/z/zsh.rpm"))
+        self.scanner.invalidate(os.path.join(self.tree, "Packages/z"))
+
+        snapshot = self.scanner.scan(self.tree)
+
+        self.assertEqual(
+            sorted(entry.rel_path for entry in snapshot.files),
+            ["Packages/b/bash.rpm", "Packages/z/zsh.rpm", "repodata/repomd.xml"],
+        )
+
+    def test_invalidate_all(self):
+        self.scanner.scan(self.tree)
+        touch(os.path.join(self.tree, "EULA"))
+        self.scanner.invalidate()
+
+        snapshot = self.scanner.scan(self.tree)
+
+        self.assertIn("EULA", [entry.rel_path for entry in snapshot.files])
@@ -768,6 +768,7 @@ class TestUpdateChecksums(PungiTestCase):
                     unified_isos.DEFAULT_CHECKSUMS,
                     False,
                     self.isos._get_base_filename,
+                    engine=mock.ANY,
                 )
             ],
         )
@@ -786,6 +787,7 @@ class TestUpdateChecksums(PungiTestCase):
                     unified_isos.DEFAULT_CHECKSUMS,
                     True,
                     self.isos._get_base_filename,
+                    engine=mock.ANY,
                 )
             ],
         )
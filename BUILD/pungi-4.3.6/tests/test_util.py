@@ -1013,6 +1013,97 @@ class TestCopyAll(PungiTestCase):
         self.assertTrue(os.path.islink(os.path.join(self.dst, "symlink")))
         self.assertEqual(os.readlink(os.path.join(self.dst, "symlink")), "broken")
 
+    def test_copy_in_parallel(self):
+        files = ["top", "a/file", "a/b/nested", "c/file"]
+        for f in files:
+            touch(os.path.join(self.src, f), f)
+
+        copied = util.copy_all(self.src, self.dst, workers=3)
+
+        six.assertCountEqual(self, copied, files)
+        for f in files:
+            path = os.path.join(self.dst, f)
+            self.assertTrue(os.path.isfile(path))
+            self.assertNotEqual(
+                os.stat(path).st_ino, os.stat(os.path.join(self.src, f)).st_ino
+            )
+
+    def test_hardlink(self):
+        touch(os.path.join(self.src, "a/file"))
+
+        util.copy_all(self.src, self.dst, link_type="hardlink")
+
+        self.assertEqual(
+            os.stat(os.path.join(self.dst, "a/file")).st_ino,
+            os.stat(os.path.join(self.src, "a/file")).st_ino,
+        )
+
+    def test_empty_source(self):
+        with self.assertRaises(RuntimeError):
+            util.copy_all(self.src, self.dst)
+
+    def test_replace_existing_files(self):
+        touch(os.path.join(self.src, "file"), "new content")
+        touch(os.path.join(self.src, "a/same-size"), "new")
+        touch(os.path.join(self.dst, "file"), "old")
+        touch(os.path.join(self.dst, "a/same-size"), "old")
+        os.utime(os.path.join(self.dst, "a/same-size"), (1, 1))
+        os.utime(os.path.join(self.src, "a/same-size"), (1, 1))
+        # The old file must not be modified in place.
+        other = os.path.join(self.topdir, "other")
+        os.link(os.path.join(self.dst, "file"), other)
+
+        util.copy_all(self.src, self.dst)
+
+        self.assertFileContent(os.path.join(self.dst, "file"), "new content")
+        self.assertFileContent(os.path.join(self.dst, "a/same-size"), "new")
+        self.assertFileContent(other, "old")
+
+    def test_replace_existing_symlink(self):
+        touch(os.path.join(self.src, "target"))
+        os.symlink("target", os.path.join(self.src, "symlink"))
+        util.makedirs(self.dst)
+        os.symlink("old-target", os.path.join(self.dst, "symlink"))
+
+        util.copy_all(self.src, self.dst)
+
+        self.assertEqual(os.readlink(os.path.join(self.dst, "symlink")), "target")
+
+    def test_follow_nested_symlinks(self):
+        touch(os.path.join(self.src, "a/target"), "data")
+        touch(os.path.join(self.src, "a/dir/file"), "file")
+        os.symlink("target", os.path.join(self.src, "a/symlink"))
+        os.symlink("dir", os.path.join(self.src, "a/dir-symlink"))
+
+        copied = util.copy_all(self.src, self.dst, workers=2)
+
+        six.assertCountEqual(
+            self,
+            copied,
+            ["a/target", "a/dir/file", "a/symlink", "a/dir-symlink/file"],
+        )
+        self.assertFalse(os.path.islink(os.path.join(self.dst, "a/symlink")))
+        self.assertFileContent(os.path.join(self.dst, "a/symlink"), "data")
+        self.assertFalse(os.path.islink(os.path.join(self.dst, "a/dir-symlink")))
+        self.assertFileContent(os.path.join(self.dst, "a/dir-symlink/file"), "file")
+
+    def test_copy_toplevel_directory_symlink(self):
+        touch(os.path.join(self.src, "dir/file"), "file")
+        os.symlink("dir", os.path.join(self.src, "dir-symlink"))
+
+        copied = util.copy_all(self.src, self.dst, workers=2)
+
+        six.assertCountEqual(self, copied, ["dir/file", "dir-symlink/file"])
+        self.assertFalse(os.path.islink(os.path.join(self.dst, "dir-symlink")))
+        self.assertFileContent(os.path.join(self.dst, "dir-symlink/file"), "file")
+
+    def test_hardlink_existing_different_file(self):
+        touch(os.path.join(self.src, "file"), "new")
+        touch(os.path.join(self.dst, "file"), "old content")
+
+        with self.assertRaises(OSError):
+            util.copy_all(self.src, self.dst, link_type="hardlink")
+
 
 class TestMoveAll(PungiTestCase):
     def setUp(self):